@@ -2,6 +2,12 @@
 
 import numpy as np
 
+# payoffs are evaluated on arrays of states X[n,size]
+def states(x):
+    if len(x.shape)==1:  # PDE and density integration, x is a grid of short rate states
+        return np.stack([x, np.zeros(x.shape[0])], axis=-1)
+    return x   # MC simulation, x are simulated states
+
 class BermudanOption:
 
     # Python constructor
@@ -17,10 +23,7 @@ class BermudanOption:
                 H = np.zeros(x.shape[0])
             else:
                 [x, H] = method.rollBack(expiryTimes[k-1],expiryTimes[k],x,U,H)
-            if len(x.shape)==1:  # PDE and density integration
-                U = np.array([ underlyings[k-1].at([state,0.0]) for state in x ])
-            else:   # MC simulation
-                U = np.array([ underlyings[k-1].at(state) for state in x ])
+            U = underlyings[k-1].at(states(x))
         [x, H] = method.rollBack(0.0,expiryTimes[0],x,U,H)
         self.x = x
         self.H = H
@@ -38,10 +41,44 @@ class EuropeanPayoff(BermudanOption):
     # Python constructor
     def __init__(self, expiryTime, underlying, method):
         x = method.xSet(expiryTime)
-        if len(x.shape)==1:  # PDE and density integration
-            U = np.array([ underlying.at([state,0.0]) for state in x ])
-        else:   # MC simulation
-            U = np.array([ underlying.at(state) for state in x ])
+        U = underlying.at(states(x))
         [x, H] = method.rollBack(0.0,expiryTime,x,U,U)
         self.x = x
-        self.H = H
\ No newline at end of file
+        self.H = H
+
+
+# We price a portfolio of Bermudan options in a single backward induction.
+# Values U and H are matrices [len(x),nTrades]. On exercise dates of other
+# trades we set U = H for a trade which cannot be exercised. Such additional
+# roll-back dates may change results within the accuracy of the method
+# (e.g. regressions in AMC) compared to pricing trades individually.
+class BermudanOptionPortfolio:
+
+    # Python constructor
+    def __init__(self, expiryTimesList, underlyingsList, method):
+        print('Bermudan portfolio pricing: |',end='', flush=True)
+        self.expiryTimesList = expiryTimesList # [ [T_E^1, ..., T_E^k] per trade ]
+        self.underlyingsList = underlyingsList # [ [U_1(x), ..., U_k(x)] per trade ]
+        self.method          = method          # the numerical method used for roll-back
+        expiryTimes = np.unique(np.concatenate([ np.asarray(e) for e in expiryTimesList ]))
+        for k in range(expiryTimes.shape[0],0,-1):
+            print(".",end='', flush=True)
+            if k==expiryTimes.shape[0]:
+                x = method.xSet(expiryTimes[k-1])
+                H = np.zeros([x.shape[0],len(underlyingsList)])
+            else:
+                [x, H] = method.rollBack(expiryTimes[k-1],expiryTimes[k],x,U,H)
+            U = H.copy()
+            for j in range(len(underlyingsList)):
+                idx = np.where(np.asarray(expiryTimesList[j])==expiryTimes[k-1])[0]
+                if idx.shape[0]>0:
+                    U[:,j] = underlyingsList[j][idx[0]].at(states(x))
+        [x, H] = method.rollBack(0.0,expiryTimes[0],x,U,H)
+        self.x = x
+        self.H = H
+        print('| Done.', flush=True)
+
+    def npv(self):
+        if self.H.shape[0]==1:
+            return self.H[0]
+        return np.array([ np.interp(0.0, self.x, self.H[:,j]) for j in range(self.H.shape[1]) ])
@@ -1,14 +1,13 @@
 #!/usr/bin/python
 
 import numpy as np
-from scipy.optimize import brentq
 
 from QuantLibWrapper.DensityIntegrations import CubicSplineExactIntegration, DensityIntegrationWithBreakEven, SimpsonIntegration
-from QuantLibWrapper.PDESolver import PDESolver
+from QuantLibWrapper.PDESolver import PDESolver, PDESolverToTolerance
 from QuantLibWrapper.Helpers import BachelierImpliedVol
-from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+from QuantLibWrapper.HullWhiteCalibration import HullWhiteCalibration
 from QuantLibWrapper.Payoffs import CouponBond
-from QuantLibWrapper.BermudanOption import BermudanOption
+from QuantLibWrapper.BermudanOption import BermudanOption, BermudanOptionPortfolio
 
 class BermudanSwaption:
 
@@ -21,18 +20,9 @@ class BermudanSwaption:
             self.model = model
         else:   # calibrate. this should not take long
             print('Calibrate HW Model: ',end='',flush=True)
-            volatilityTimes  = np.array( [swaption.bondOptionDetails()['expiryTime'] for swaption in self.europeanSwaptions] )
-            volatilityValues = np.array( [self.europeanSwaptions[0].normalVolatility for i in range(volatilityTimes.shape[0]) ])  # initial guess            
-            for k in range(volatilityValues.shape[0]):
-                print(str(k)+' ', end='', flush=True)
-                def objective(sigma):
-                    volatilityValues[k] = sigma
-                    model = HullWhiteModel(self.europeanSwaptions[0].underlyingSwap.discYieldCurve,self.meanReversion,volatilityTimes,volatilityValues)
-                    return self.europeanSwaptions[k].npvHullWhite(model,'p') - self.europeanSwaptions[k].npv()
-                sigma = brentq(objective,0.1*volatilityValues[k],5.0*volatilityValues[k],xtol=1.0e-8)
-                volatilityValues[k] = sigma
-            self.model = HullWhiteModel(self.europeanSwaptions[0].underlyingSwap.discYieldCurve,self.meanReversion,volatilityTimes,volatilityValues)
-            print('.')
+            self.calibration = HullWhiteCalibration(self.europeanSwaptions,self.meanReversion)
+            self.model = self.calibration.calibrate()
+            print(str(np.sum(self.calibration.iterations))+' iterations.')
         if method!=None:
             self.method = method
         else:
@@ -46,13 +36,38 @@ class BermudanSwaption:
     def bondOptionsNPV(self):
         return np.array([ swaption.npvHullWhite(self.model) for swaption in self.europeanSwaptions ])
 
-    def npv(self):
+    def underlyings(self):
         underlyings = []
         for swaption in self.europeanSwaptions:
             details = swaption.bondOptionDetails()
             underlying = CouponBond(self.model,details['expiryTime'],details['payTimes'],details['cashFlows']*details['callOrPut'])
             underlyings.append(underlying)
+        return underlyings
+
+    def npv(self):
+        underlyings = self.underlyings()
         expiryTimes = np.array([ underlying.observationTime for underlying in underlyings ])
         bondOption = BermudanOption(expiryTimes,underlyings,self.method)
         return bondOption.npv()
+
+    # PDE pricing to a given tolerance instead of a hand-tuned grid, the solver
+    # provides the coarsest grid and time step; see PDESolverToTolerance()
+    def npvToTolerance(self, tolerance, solver=None):
+        if solver==None:
+            solver = PDESolver(self.model,21,5,0.5,0.25,rannacherSteps=2,smoothPayoff=True)
+        underlyings = self.underlyings()
+        expiryTimes = np.array([ underlying.observationTime for underlying in underlyings ])
+        def price(method):
+            return BermudanOption(expiryTimes,underlyings,method).npv()
+        [npv, self.toleranceDetails] = PDESolverToTolerance(price,solver,tolerance)
+        return npv
+
+
+# Price Bermudan swaptions which share the same model in a single backward
+# induction; we use the method of the first swaption if none is provided
+def BermudanSwaptionsNPV(bermudanSwaptions, method=None):
+    underlyingsList = [ bermudan.underlyings() for bermudan in bermudanSwaptions ]
+    expiryTimesList = [ np.array([ underlying.observationTime for underlying in underlyings ]) for underlyings in underlyingsList ]
+    method = bermudanSwaptions[0].method if method==None else method
+    return BermudanOptionPortfolio(expiryTimesList,underlyingsList,method).npv()
     
\ No newline at end of file
@@ -4,30 +4,76 @@ import numpy as np
 from scipy.stats import norm
 from scipy import integrate
 from scipy.interpolate import CubicSpline
+from collections import OrderedDict
+
+from QuantLibWrapper.Grids import concentratedGrid
 
 class DensityIntegration:  # base class for other integration methods
 
     # Python constructor
-    def __init__(self, hwModel, nGridPoints=101, stdDevs=5):
+    def __init__(self, hwModel, nGridPoints=101, stdDevs=5, maxCacheBytes=2**28, concentrationPoints=[], concentrationWidth=0.1):
         self.hwModel     = hwModel
         self.nGridPoints = nGridPoints
         self.stdDevs     = stdDevs
+        # grid points x are concentrated around these states, e.g. strikes; a list
+        # or a function of expiryTime returning a list, see Grids.concentratedGrid()
+        self.concentrationPoints = concentrationPoints
+        self.concentrationWidth  = concentrationWidth
+        # transition kernels only depend on model state and grids but not on payoffs
+        self.maxCacheBytes = maxCacheBytes   # memory limit for cached kernels
+        self.clearKernelCache()
     
     def xSet(self,expityTime):
         sigma = np.sqrt(self.hwModel.varianceX(0.0,expityTime))
         if sigma==0:
             return np.array([0.0])
-        return np.linspace(-self.stdDevs*sigma,self.stdDevs*sigma,self.nGridPoints)
+        points = self.concentrationPoints(expityTime) if callable(self.concentrationPoints) else self.concentrationPoints
+        return concentratedGrid(-self.stdDevs*sigma,self.stdDevs*sigma,self.nGridPoints,points,self.concentrationWidth)
+
+    # kernels are cached per model state, call this to release memory
+    def clearKernelCache(self):
+        self.kernelCache      = OrderedDict()
+        self.kernelCacheBytes = 0
+
+    # get kernel matrices for a roll-back from x1 at T1 to xSet(T0), the function
+    # kernel() calculates a list of np.array if not yet cached; we evict least
+    # recently used kernels if cached kernels exceed maxCacheBytes
+    def cachedKernel(self, T0, T1, x1, kernel):
+        key = (self.hwModel.state(), T0, T1, self.xSet(T0).tobytes(), x1.tobytes())
+        if key in self.kernelCache:
+            self.kernelCache.move_to_end(key)
+            return self.kernelCache[key]
+        matrices = kernel()
+        self.kernelCache[key] = matrices
+        self.kernelCacheBytes += sum([ m.nbytes for m in matrices ])
+        while self.kernelCacheBytes>self.maxCacheBytes and len(self.kernelCache)>0:
+            evicted = self.kernelCache.popitem(last=False)[1]
+            self.kernelCacheBytes -= sum([ m.nbytes for m in evicted ])
+        return matrices
 
 
 class DensityIntegrationWithBreakEven(DensityIntegration):  # decorate method with break-even methodology
 
     # Python constructor
     def __init__(self, method):
-        DensityIntegration.__init__(self,method.hwModel,method.nGridPoints,method.stdDevs)
+        DensityIntegration.__init__(self,method.hwModel,method.nGridPoints,method.stdDevs,method.maxCacheBytes,
+                                    method.concentrationPoints,method.concentrationWidth)
         self.method = method
     
     def rollBack(self, T0, T1, x1, U1, H1):
+        if len(U1.shape)==2:  # break-even states and thus grids differ per trade, only
+            # trades without exercise on this date are rolled back together
+            exercise = np.any(U1!=H1, axis=0)
+            results = [ [ np.where(~exercise)[0], self.method.rollBack(T0,T1,x1,U1[:,~exercise],H1[:,~exercise]) ] ] \
+                      if not np.all(exercise) else []
+            results += [ [ j, self.rollBack(T0,T1,x1,U1[:,j],H1[:,j]) ] for j in np.where(exercise)[0] ]
+            x0 = results[0][1][0]
+            V0 = np.zeros([x0.shape[0],U1.shape[1]])
+            for [ j, result ] in results:
+                V0[:,j] = result[1]
+            return [x0, V0]
+        if np.all(U1==H1):  # nothing to exercise
+            return self.method.rollBack(T0,T1,x1,U1,H1)
         # find break-even state and split grid
         roots = CubicSpline(x1,U1-H1).roots(discontinuity=False, extrapolate=False)
         if roots.shape[0]==0:  # no break even point found
@@ -53,77 +99,76 @@ class DensityIntegrationWithBreakEven(DensityIntegration):  # decorate method wi
 class SimpsonIntegration(DensityIntegration):
 
     # Python constructor
-    def __init__(self, hwModel, nGridPoints=101, stdDevs=5):
-        DensityIntegration.__init__(self,hwModel,nGridPoints,stdDevs)
-    
-    def rollBack(self, T0, T1, x1, U1, H1):
+    def __init__(self, hwModel, nGridPoints=101, stdDevs=5, maxCacheBytes=2**28, concentrationPoints=[], concentrationWidth=0.1):
+        DensityIntegration.__init__(self,hwModel,nGridPoints,stdDevs,maxCacheBytes,concentrationPoints,concentrationWidth)
+
+    # V0 = K V with K[i,k] = P(T0,T1,x0[i]) density(x1[k] | x0[i]) w[k] and Simpson weights w
+    def kernel(self, T0, T1, x1):
         x0 = self.xSet(T0)
-        V0 = np.zeros(x0.shape[0])
         sigma = np.sqrt(self.hwModel.varianceX(T0,T1))
-        V = np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ])
-        for i in range(x0.shape[0]):
-            mu = self.hwModel.expectationX(T0, x0[i], T1)
-            fx = np.array([ V[k] * norm.pdf((x1[k]-mu)/sigma)/sigma for k in range(x1.shape[0])])
-            I = integrate.simps(fx, x1)
-            V0[i] = self.hwModel.zeroBond(T0,x0[i],T1) * I
+        mu = self.hwModel.expectationX(T0, x0, T1)
+        w = integrate.simpson(np.identity(x1.shape[0]), x=x1, axis=1)  # Simpson's rule is linear in f(x)
+        P = self.hwModel.zeroBonds(T0,x0,[T1])
+        return [ x0, P * norm.pdf((x1-mu[:,np.newaxis])/sigma)/sigma * w ]
+    
+    def rollBack(self, T0, T1, x1, U1, H1):
+        [x0, K] = self.cachedKernel(T0,T1,x1,lambda : self.kernel(T0,T1,x1))
+        V0 = K.dot(np.maximum(U1,H1))
         return [x0, V0]
 
     
 class HermiteIntegration(DensityIntegration):
 
     # Python constructor
-    def __init__(self, hwModel, degree, nGridPoints=101, stdDevs=5):
-        DensityIntegration.__init__(self,hwModel,nGridPoints,stdDevs)
+    def __init__(self, hwModel, degree, nGridPoints=101, stdDevs=5, concentrationPoints=[], concentrationWidth=0.1):
+        DensityIntegration.__init__(self,hwModel,nGridPoints,stdDevs,concentrationPoints=concentrationPoints,concentrationWidth=concentrationWidth)
         (self.hermX, self.hermW) = np.polynomial.hermite.hermgauss(degree)
 
     def rollBack(self, T0, T1, x1, U1, H1):
         x0 = self.xSet(T0)
-        V0 = np.zeros(x0.shape[0])
         sigma = np.sqrt(self.hwModel.varianceX(T0,T1))
-        V = CubicSpline(x1, np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ]))
-        for i in range(x0.shape[0]):
-            mu = self.hwModel.expectationX(T0, x0[i], T1)
-            I = 0.0
-            for k in range(self.hermX.shape[0]):
-                I += self.hermW[k] * V(np.sqrt(2.0)*sigma*self.hermX[k] + mu)
-            I /= np.sqrt(np.pi)
-            V0[i] = self.hwModel.zeroBond(T0,x0[i],T1) * I
+        V = CubicSpline(x1, np.maximum(U1,H1))
+        mu = self.hwModel.expectationX(T0, x0, T1)
+        # quadrature points for all x0[i] (rows)
+        I = np.tensordot(V(np.sqrt(2.0)*sigma*self.hermX + mu[:,np.newaxis]), self.hermW, axes=([1],[0])) / np.sqrt(np.pi)
+        V0 = (self.hwModel.zeroBonds(T0,x0,[T1])[:,0] * I.T).T  # I may be [len(x0),nTrades]
         return [x0, V0]
 
 
 class CubicSplineExactIntegration(DensityIntegration):
 
     # Python constructor
-    def __init__(self, hwModel, nGridPoints=101, stdDevs=5):
-        DensityIntegration.__init__(self,hwModel,nGridPoints,stdDevs)
+    def __init__(self, hwModel, nGridPoints=101, stdDevs=5, maxCacheBytes=2**28, concentrationPoints=[], concentrationWidth=0.1):
+        DensityIntegration.__init__(self,hwModel,nGridPoints,stdDevs,maxCacheBytes,concentrationPoints,concentrationWidth)
 
-    def rollBack(self, T0, T1, x1, U1, H1):
+    # moments P(T0,T1,x0[i]) I_j[i,k] of the density per spline segment k and x0[i]
+    def kernel(self, T0, T1, x1):
         x0 = self.xSet(T0)
-        V0 = np.zeros(x0.shape[0])
         sigma = np.sqrt(self.hwModel.varianceX(T0,T1))
-        V = CubicSpline(x1, np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ]))
-        for i in range(x0.shape[0]):
-            mu = self.hwModel.expectationX(T0, x0[i], T1)
-            # we need to setup all the coefficients
-            xBar     = np.array([ (x-mu)/sigma for x in V.x ])
-            Phi      = np.array([ norm.cdf(x) for x in xBar ])
-            PhiPrime = np.array([ norm.pdf(x) for x in xBar ])
-            F0 = Phi
-            F1 = -1.0*PhiPrime
-            F2 = Phi - xBar*PhiPrime
-            F3 = -1.0*(xBar**2 + 2.0)*PhiPrime
-            dF0 = F0[1:] - F0[:-1]
-            dF1 = F1[1:] - F1[:-1]
-            dF2 = F2[1:] - F2[:-1]
-            dF3 = F3[1:] - F3[:-1]
-            I0  = dF0
-            I1  = sigma*dF1 - sigma*xBar[:-1]*I0
-            I2  = (sigma**2)*dF2 - 2*sigma*xBar[:-1]*I1 - (sigma**2)*(xBar[:-1]**2)*I0
-            I3  = (sigma**3)*dF3 - 3*sigma*xBar[:-1]*I2 - 3*(sigma**2)*(xBar[:-1]**2)*I1 - (sigma**3)*(xBar[:-1]**3)*I0
-            # summing up
-            I = 0.0
-            for k in range(xBar.shape[0]-1):
-                I += V.c[3][k]*I0[k] + V.c[2][k]*I1[k] + V.c[1][k]*I2[k] + V.c[0][k]*I3[k]
-            V0[i] = self.hwModel.zeroBond(T0,x0[i],T1) * I
-        return [x0, V0]
+        mu = self.hwModel.expectationX(T0, x0, T1)
+        # we need to setup all the coefficients for x0[i] (rows) and spline knots (columns)
+        xBar     = (x1-mu[:,np.newaxis])/sigma
+        Phi      = norm.cdf(xBar)
+        PhiPrime = norm.pdf(xBar)
+        F0 = Phi
+        F1 = -1.0*PhiPrime
+        F2 = Phi - xBar*PhiPrime
+        F3 = -1.0*(xBar**2 + 2.0)*PhiPrime
+        dF0 = F0[:,1:] - F0[:,:-1]
+        dF1 = F1[:,1:] - F1[:,:-1]
+        dF2 = F2[:,1:] - F2[:,:-1]
+        dF3 = F3[:,1:] - F3[:,:-1]
+        xBar = xBar[:,:-1]
+        I0  = dF0
+        I1  = sigma*dF1 - sigma*xBar*I0
+        I2  = (sigma**2)*dF2 - 2*sigma*xBar*I1 - (sigma**2)*(xBar**2)*I0
+        I3  = (sigma**3)*dF3 - 3*sigma*xBar*I2 - 3*(sigma**2)*(xBar**2)*I1 - (sigma**3)*(xBar**3)*I0
+        P = self.hwModel.zeroBonds(T0,x0,[T1])
+        return [ x0, P*I0, P*I1, P*I2, P*I3 ]
 
+    def rollBack(self, T0, T1, x1, U1, H1):
+        [x0, I0, I1, I2, I3] = self.cachedKernel(T0,T1,x1,lambda : self.kernel(T0,T1,x1))
+        V = CubicSpline(x1, np.maximum(U1,H1))
+        # summing up over spline segments
+        V0 = I0.dot(V.c[3]) + I1.dot(V.c[2]) + I2.dot(V.c[1]) + I3.dot(V.c[0])
+        return [x0, V0]
@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+import numpy as np
+
+# Grids on [xMin, xMax] with n points concentrated around points c_i. We use
+# the grid density d(x) = sum_i 1 / sqrt(beta^2 + (x-c_i)^2) with beta = width
+# (xMax-xMin) and place grid points at equidistant levels of its integral
+#   F(x) = sum_i asinh((x-c_i)/beta).
+# For a single point this is the sinh-stretched grid
+#   x(u) = c + beta sinh(u F(xMax) + (1-u) F(xMin)), u in [0,1].
+# Smaller width means stronger concentration. Without concentration points
+# we return the uniform grid.
+
+def uniformGrid(xMin, xMax, nGridPoints):
+    return np.linspace(xMin,xMax,nGridPoints)
+
+
+def concentratedGrid(xMin, xMax, nGridPoints, concentrationPoints=[], width=0.1):
+    c = np.array([ p for p in concentrationPoints if xMin<=p and p<=xMax ], dtype=float)
+    if c.shape[0]==0 or nGridPoints<3 or xMax<=xMin:
+        return uniformGrid(xMin,xMax,nGridPoints)
+    beta = width * (xMax-xMin)
+    def F(x):
+        return np.sum(np.arcsinh((np.subtract.outer(x,c))/beta),axis=-1)
+    if c.shape[0]==1:  # closed form
+        u = np.linspace(0.0,1.0,nGridPoints)
+        x = c[0] + beta * np.sinh(u*F(xMax) + (1.0-u)*F(xMin))
+    else:  # invert F on a fine grid
+        xFine = np.linspace(xMin,xMax,100*nGridPoints)
+        x = np.interp(np.linspace(F(xMin),F(xMax),nGridPoints),F(xFine),xFine)
+    x[0], x[-1] = xMin, xMax  # avoid round-off at the boundaries
+    # move nearest interior grid points onto concentration points, e.g. strikes
+    for p in c:
+        i = np.argmin(np.abs(x-p))
+        if 0<i and i<nGridPoints-1: x[i] = p
+    return x
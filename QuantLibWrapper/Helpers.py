@@ -1,9 +1,13 @@
 #!/usr/bin/python
 
 from scipy.stats import norm
-from scipy.optimize import brentq
+from scipy.special import erfcx
 import numpy as np
 
+# Pricing functions accept floats or np.arrays (broadcast against each other).
+# Implied volatility functions *ImpliedVols() invert arrays of prices in one
+# call and return np.nan where no volatility exists; the scalar functions
+# *ImpliedVol() raise a ValueError instead.
 
 def BlackOverK(moneyness, stdDev, callOrPut):
     d1 = np.log(moneyness) / stdDev + stdDev / 2.0
@@ -12,14 +16,20 @@ def BlackOverK(moneyness, stdDev, callOrPut):
 
 def Black(strike, forward, sigma, T, callOrPut):
     nu = sigma*np.sqrt(T)
-    if nu<1.0e-12:   # assume zero
-        return max(callOrPut*(forward-strike),0.0)  # intrinsic value
-    return strike * BlackOverK(forward/strike,nu,callOrPut)
+    intrinsic = np.maximum(callOrPut*(forward-strike),0.0)
+    if np.ndim(nu)==0 and np.ndim(intrinsic)==0:
+        if nu<1.0e-12:   # assume zero
+            return intrinsic
+        return strike * BlackOverK(forward/strike,nu,callOrPut)
+    zero = nu<1.0e-12
+    nu = np.where(zero, 1.0, nu)  # avoid division by zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(zero, intrinsic, strike * BlackOverK(forward/strike,nu,callOrPut))
 
-def BlackImpliedVol(price, strike, forward, T, callOrPut):
-    def objective(sigma):
-        return Black(strike, forward, sigma, T, callOrPut) - price
-    return brentq(objective,0.01, 1.00, xtol=1.0e-8)
+def BlackVega(strike, forward, sigma, T):
+    nu = sigma*np.sqrt(T)
+    d1 = np.log(forward/strike) / nu + nu / 2.0
+    return forward * norm.pdf(d1) * np.sqrt(T)
 
 def BachelierRaw(moneyness, stdDev, callOrPut):
     h = callOrPut * moneyness / stdDev
@@ -34,8 +44,108 @@ def Bachelier(strike, forward, sigma, T, callOrPut):
 def BachelierVega(strike, forward, sigma, T):
     return BachelierVegaRaw(forward-strike,sigma*np.sqrt(T))*np.sqrt(T)
 
-def BachelierImpliedVol(price, strike, forward, T, callOrPut):
-    def objective(sigma):
-        return Bachelier(strike, forward, sigma, T, callOrPut) - price
-    return brentq(objective,1e-4, 1e-1, xtol=1.0e-8)
+# Batch implied volatilities. We remove the intrinsic value via put-call parity
+# and invert the out-of-the-money price v(s) in terms of the standard deviation
+# s = sigma sqrt(T). We solve for log v as function of log s via Halley's method
+# started at a lower bound of s (ATM bound or asymptotic guess). log v is
+# increasing and concave in log s, so Newton steps from below do not overshoot.
+
+def ImpliedStdDevs(otmPrice, logPriceWithSlope, s0, tolerance, maxIterations):
+    s = np.array(s0, dtype=float)
+    logV = np.log(otmPrice)
+    active = np.isfinite(s) & (s>0)
+    for iteration in range(maxIterations):
+        if not np.any(active): break
+        idx = np.nonzero(active)[0]
+        [ logP, slope, curvature ] = logPriceWithSlope(idx, s[idx])
+        step = (logV[idx] - logP) / slope
+        step = step / np.maximum(1.0 + 0.5 * step * curvature / slope, 0.5)  # Halley correction
+        step = np.where(np.isfinite(step), step, 0.5)  # price underflow, far from the root
+        s[idx] *= np.exp(step)
+        active[idx] = np.abs(step) > tolerance
+    return s
+
+def BachelierImpliedVols(price, strike, forward, T, callOrPut, tolerance=1.0e-12, maxIterations=100):
+    [ price, strike, forward, T, callOrPut ] = np.broadcast_arrays(*[ np.asarray(a, dtype=float) for a in [price, strike, forward, T, callOrPut] ])
+    shape = price.shape
+    [ price, strike, forward, T, callOrPut ] = [ a.flatten() for a in [price, strike, forward, T, callOrPut] ]
+    x = np.abs(forward - strike)
+    v = price - np.maximum(callOrPut*(forward-strike),0.0)   # OTM price
+    # v(s) = s [phi(h) - h Phi(-h)] = s phi(h) [1 - h R(h)] with h = x / s and Mills ratio R
+    def logPriceWithSlope(idx, s):
+        h = x[idx] / s
+        q = 1.0 - h * erfcx(h/np.sqrt(2.0)) * np.sqrt(np.pi/2.0)
+        return [ np.log(s) + norm.logpdf(h) + np.log(q), 1.0 / q, (1.0 + h*h - 1.0/q) / q ]
+    # OTM prices do not exceed ATM prices, i.e. v <= s phi(0); further
+    # 1 - h R(h) <= 1/h^2 yields v <= x phi(h)/h^3 and an upper bound for h
+    s0 = np.sqrt(2.0*np.pi) * v
+    with np.errstate(all='ignore'):
+        h = np.ones_like(x)
+        for k in range(5):
+            h = np.sqrt(np.maximum(-2.0*np.log(np.sqrt(2.0*np.pi) * v/x * h**3), 1.0))
+        s1 = x / h
+        valid = (x>0) & (v>0) & (s1>s0)
+        valid[valid] = logPriceWithSlope(np.nonzero(valid)[0],s1[valid])[0] < np.log(v[valid])
+        s0 = np.where(valid, s1, s0)
+        atm = (x==0) & (v>0)
+        active = (x>0) & (v>0)
+        s = np.full(x.shape, np.nan)
+        s[atm] = s0[atm]   # exact
+        if np.any(active):
+            activeIdx = np.nonzero(active)[0]
+            s[active] = ImpliedStdDevs(v[active],lambda idx, s : logPriceWithSlope(activeIdx[idx],s),
+                                       s0[active],tolerance,maxIterations)
+        s[(v==0) & (x>0)] = 0.0
+        return (s / np.sqrt(T)).reshape(shape)
 
+def BlackImpliedVols(price, strike, forward, T, callOrPut, tolerance=1.0e-12, maxIterations=100):
+    [ price, strike, forward, T, callOrPut ] = np.broadcast_arrays(*[ np.asarray(a, dtype=float) for a in [price, strike, forward, T, callOrPut] ])
+    shape = price.shape
+    [ price, strike, forward, T, callOrPut ] = [ a.flatten() for a in [price, strike, forward, T, callOrPut] ]
+    with np.errstate(all='ignore'):
+        # normalised OTM price b = v / sqrt(FK) only depends on x = -|log(F/K)| <= 0
+        v = price - np.maximum(callOrPut*(forward-strike),0.0)
+        beta = v / np.sqrt(forward*strike)
+        x = -np.abs(np.log(forward/strike))
+        # b = Phi(h+t) e^{x/2} - Phi(h-t) e^{-x/2} with h = x/s, t = s/2; for h+t < 1 we
+        # use Phi(-z) = erfcx(z/sqrt(2)) exp(-z^2/2) / 2 to avoid cancellation
+        def logPriceWithSlope(idx, s):
+            h, t = x[idx] / s, s / 2.0
+            z = (t - h) / np.sqrt(2.0)
+            tail = 0.5 * (erfcx(-(h+t)/np.sqrt(2.0)) - erfcx(z))
+            tail = np.where(h+t<1.0, tail, 1.0)  # avoid overflow
+            logB = np.where(h+t<1.0, np.log(tail) - (h*h+t*t)/2.0,
+                            np.log(norm.cdf(h+t)*np.exp(x[idx]/2.0) - norm.cdf(h-t)*np.exp(-x[idx]/2.0)))
+            # db/ds = phi(h) exp(-t^2/2)
+            slope = s * np.exp(norm.logpdf(h) - t*t/2.0 - logB)
+            return [ logB, slope, slope * (1.0 + h*h - t*t - slope) ]
+        # OTM prices do not exceed ATM prices 2 Phi(s/2) - 1 ~ s / sqrt(2 pi)
+        s0 = np.where(beta>1.0e-8, 2.0 * norm.ppf(0.5 + 0.5 * beta), np.sqrt(2.0*np.pi) * beta)
+        # deep OTM b ~ phi(h) exp{-t^2/2} s / (h^2 - t^2), we use this guess if it is a lower bound
+        s1 = -x / np.sqrt(np.maximum(-2.0*np.log(beta), 1.0))
+        for k in range(5):
+            h, t = x / s1, s1 / 2.0
+            s1 = -x / np.sqrt(np.maximum(-2.0*(np.log(beta) + t*t/2.0 - np.log(s1 / np.sqrt(2.0*np.pi) / np.abs(h*h-t*t))), 1.0))
+        valid = (x<0) & (beta>0) & (beta<1) & (s1>s0)
+        valid[valid] = logPriceWithSlope(np.nonzero(valid)[0],s1[valid])[0] < np.log(beta[valid])
+        s0 = np.where(valid, s1, s0)
+        active = (beta>0) & (beta<np.exp(x/2.0)) & (forward>0) & (strike>0)
+        s = np.full(v.shape, np.nan)
+        if np.any(active):
+            activeIdx = np.nonzero(active)[0]
+            s[active] = ImpliedStdDevs(beta[active],lambda idx, s : logPriceWithSlope(activeIdx[idx],s),
+                                       s0[active],tolerance,maxIterations)
+        s[(v==0) & (forward>0) & (strike>0)] = 0.0
+        return (s / np.sqrt(T)).reshape(shape)
+
+def BlackImpliedVol(price, strike, forward, T, callOrPut):
+    vol = BlackImpliedVols(price, strike, forward, T, callOrPut)
+    if not np.all(np.isfinite(vol)):
+        raise ValueError('No implied Black volatility for price ' + str(price))
+    return vol if np.ndim(vol)>0 else float(vol)
+
+def BachelierImpliedVol(price, strike, forward, T, callOrPut):
+    vol = BachelierImpliedVols(price, strike, forward, T, callOrPut)
+    if not np.all(np.isfinite(vol)):
+        raise ValueError('No implied normal volatility for price ' + str(price))
+    return vol if np.ndim(vol)>0 else float(vol)
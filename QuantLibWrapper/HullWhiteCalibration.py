@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+import numpy as np
+from scipy.stats import norm
+from scipy.optimize import brentq
+
+from QuantLibWrapper.Helpers import BlackOverK
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+
+class HullWhiteCalibration:
+    # We bootstrap piecewise flat Hull White volatilities with one bucket per
+    # swaption expiry. Bond option details, discount factors and G(T_E,T_i) are
+    # calculated once. Swaption k only depends on sigma_k via
+    #   y(T_k) = G'(T_k-1,T_k)^2 y(T_k-1) + sigma_k^2 [1 - exp{-2a(T_k - T_k-1)}] / (2a).
+    # We solve for sigma_k with a safeguarded Newton iteration using the
+    # analytic vega of Jamshidian's decomposition and update only bucket k (and
+    # the y(t) tail) of the model.
+
+    # Python constructor
+    def __init__(self, europeanSwaptions, meanReversion, yieldCurve=None):
+        self.europeanSwaptions = europeanSwaptions
+        yieldCurve = europeanSwaptions[0].underlyingSwap.discYieldCurve if yieldCurve==None else yieldCurve
+        # QuantLib cash flow iterations are done only once
+        self.details = [ swaption.bondOptionDetails() for swaption in europeanSwaptions ]
+        volatilityTimes  = np.array([ details['expiryTime'] for details in self.details ])
+        volatilityValues = np.array([ swaption.normalVolatility for swaption in europeanSwaptions ])  # initial guess
+        self.model = HullWhiteModel(yieldCurve,meanReversion,volatilityTimes,volatilityValues)
+        # P(0,T_E) and [DF, G] with DF = P(0,T_i)/P(0,T_E) per swaption
+        self.P0 = np.array([ yieldCurve.discount(T) for T in volatilityTimes ])
+        self.coefficients = [ self.model.zeroBondCoefficients(details['expiryTime'],details['payTimes'])[:2]
+                              for details in self.details ]
+        self.targetPrices = np.array([ swaption.npv() for swaption in europeanSwaptions ])
+        self.iterations = np.zeros(len(europeanSwaptions), dtype=int)
+        self.converged  = np.zeros(len(europeanSwaptions), dtype=bool)
+
+    # y(T_k) as function of sigma_k and dy/dsigma_k
+    def yWithDerivative(self, k, sigma):
+        a  = self.model.meanReversion
+        T1 = self.model.volatilityTimes[k]
+        T0 = 0.0 if k==0 else self.model.volatilityTimes[k-1]
+        y0 = 0.0 if k==0 else self.model.y_[k-1]
+        w  = (1.0 - np.exp(-2*a*(T1-T0))) / (2*a)
+        return [ self.model.GPrime(T0,T1)**2 * y0 + sigma**2 * w, 2*sigma*w ]
+
+    # coupon bond option of swaption k and vega dV/dy for y = y(T_k)
+    def bondOptionWithVega(self, k, y):
+        details = self.details[k]
+        [ DF, G ] = self.coefficients[k]
+        cashFlows = details['cashFlows']
+        def objective(x):
+            return (DF * np.exp(-G*x - 0.5*G**2*y)).dot(cashFlows) - details['strike']
+        xStar = brentq(objective,-1.0, 1.0, xtol=1.0e-12)
+        strikes = DF * np.exp(-G*xStar - 0.5*G**2*y)
+        nu = G * np.sqrt(y)
+        npv = self.P0[k] * (cashFlows*strikes*BlackOverK(DF/strikes,nu,details['callOrPut'])).sum()
+        # d1 is the same for call and put, strikes do not contribute since sum cf_i K_i = K
+        d1 = np.log(DF/strikes)/nu + nu/2
+        vega = self.P0[k] * (cashFlows * DF * norm.pdf(d1) * G / 2.0 / np.sqrt(y)).sum()
+        return [ npv, vega ]
+
+    def calibrate(self, targetPrices=None, tolerance=1.0e-10, maxIterations=50):
+        if targetPrices is not None:
+            self.targetPrices = np.array(targetPrices)
+        for k in range(len(self.details)):
+            sigma = self.model.volatilityValues[k]
+            lower, upper = 0.0, np.inf   # bracket, prices increase with sigma
+            converged = False
+            for iteration in range(maxIterations):
+                [ y, dy ] = self.yWithDerivative(k,sigma)
+                [ npv, vega ] = self.bondOptionWithVega(k,y)
+                objective = npv - self.targetPrices[k]
+                if objective>0: upper = sigma
+                else:           lower = sigma
+                sigmaNew = sigma - objective / (vega*dy) if vega*dy>0 else np.nan
+                if not (lower<sigmaNew and sigmaNew<upper):  # bisection or extend the bracket
+                    sigmaNew = 0.5*(lower+upper) if upper<np.inf else 2.0*sigma
+                converged = abs(sigmaNew-sigma)<tolerance
+                sigma = sigmaNew
+                if converged: break
+            self.iterations[k] = iteration+1
+            self.converged[k]  = converged
+            self.model.setVolatility(k,sigma)
+        if not np.all(self.converged):
+            print('WARNING: HullWhiteCalibration did not converge for swaptions ' + str(np.where(~self.converged)[0]))
+        return self.model
@@ -1,30 +1,52 @@
 #!/usr/bin/python
 
+import bisect
 import numpy as np
+from collections import OrderedDict
 from scipy.optimize import brentq
 from QuantLibWrapper.Helpers import Black, Bachelier, BachelierImpliedVol
 
 class HullWhiteModel:
 
     # Python constructor
-    def __init__(self, yieldCurve, meanReversion, volatilityTimes, volatilityValues):
+    def __init__(self, yieldCurve, meanReversion, volatilityTimes, volatilityValues, stepCoefficientsCacheSize=16):
         self.yieldCurve       = yieldCurve
         self.meanReversion    = meanReversion
-        self.volatilityTimes  = volatilityTimes    # assume positive and ascending
-        self.volatilityValues = volatilityValues
+        self.volatilityTimes  = np.array(volatilityTimes, dtype=float)    # assume positive and ascending
+        self.volatilityValues = np.array(volatilityValues, dtype=float)   # copy, see setVolatility()
         # pre-calculate y(t) on the time grid
-        # y(t) = G'(s,t)^2 y(s) + sigma^2 [1 - exp{-2a(t-s)}] / (2a)
-        t0 = 0.0
-        y0 = 0.0
         self.y_ = np.zeros(len(self.volatilityTimes))
-        for i in range(len(self.y_)):
+        self.updateY(0)
+        # simulation step coefficients per time grid, see stepCoefficientsTable()
+        self.volatilityVersion         = 0
+        self.stepCoefficientsCacheSize = stepCoefficientsCacheSize   # max. number of time grids
+        self.stepCoefficientsCache     = OrderedDict()
+        self.stepCoefficientsState = self.state()
+
+    # y(t) = G'(s,t)^2 y(s) + sigma^2 [1 - exp{-2a(t-s)}] / (2a) on the time grid;
+    # y_[i] only depends on volatilities up to i, thus we update from startIdx
+    def updateY(self, startIdx):
+        t0 = 0.0 if startIdx==0 else self.volatilityTimes[startIdx-1]
+        y0 = 0.0 if startIdx==0 else self.y_[startIdx-1]
+        for i in range(startIdx,len(self.y_)):
             self.y_[i] = (self.GPrime(t0,self.volatilityTimes[i])**2) * y0 +                   \
                          (self.volatilityValues[i]**2) *                                       \
                          (1.0 - np.exp(-2*self.meanReversion*(self.volatilityTimes[i]-t0))) /  \
                          (2.0 * self.meanReversion)
             t0 = self.volatilityTimes[i]
             y0 = self.y_[i]
-        
+
+    # change a single volatility bucket without re-building the model, e.g. for calibration
+    def setVolatility(self, idx, value):
+        self.volatilityValues[idx] = value
+        self.updateY(idx)
+        self.volatilityVersion += 1
+
+    # cached quantities (step coefficients, density kernels) are only valid for
+    # this state of yield curve and volatilities
+    def state(self):
+        return (getattr(self.yieldCurve,'version',0), self.volatilityVersion)
+
     # auxilliary methods
 
     def G(self, t, T):
@@ -33,13 +55,24 @@ class HullWhiteModel:
     def GPrime(self, t, T):
         return np.exp(-self.meanReversion*(T-t))
         
+    # find idx s.t. t[idx] < t <= t[idx+1], idx=-1 if t <= t[0]; t may be an np.array
+    def volatilityIndex(self,t):
+        if isinstance(t,(int,float)):  # bisect avoids the np.searchsorted overhead for scalar t
+            return bisect.bisect_left(self.volatilityTimes,t) - 1
+        return np.searchsorted(self.volatilityTimes,t,side='left') - 1
+
+    # y(t) = G'(t0,t)^2 y(t0) + sigma^2 [1 - exp{-2a(t-t0)}] / (2a) with t0 = t[idx]
+    def yParameters(self,idx):
+        if isinstance(idx,int):  # scalar look-up, avoid the overhead of np.where
+            s1 = self.volatilityValues[min(idx+1,len(self.volatilityValues)-1)]  # flat extrapolation
+            return [ 0.0, 0.0, s1 ] if idx<0 else [ self.volatilityTimes[idx], self.y_[idx], s1 ]
+        t0 = np.where(idx<0, 0.0, self.volatilityTimes[np.maximum(idx,0)])
+        y0 = np.where(idx<0, 0.0, self.y_[np.maximum(idx,0)])
+        s1 = self.volatilityValues[np.minimum(idx+1,len(self.volatilityValues)-1)]  # flat extrapolation
+        return [ t0, y0, s1 ]
+
     def y(self,t):
-        # find idx s.t. t[idx] < t < t[idx+1]
-        idxSet = np.where(self.volatilityTimes<t)[0]
-        idx = -1 if (idxSet.shape[0]==0) else idxSet[-1]
-        t0 = 0.0 if (idxSet.shape[0]==0) else self.volatilityTimes[idx]
-        y0 = 0.0 if (idxSet.shape[0]==0) else self.y_[idx]
-        s1 = self.volatilityValues[min(idx+1,len(self.volatilityValues)-1)]  # flat extrapolation
+        [ t0, y0, s1 ] = self.yParameters(self.volatilityIndex(t))
         y1 = (self.GPrime(t0,t)**2) * y0 +                      \
                 s1**2 * (1.0 - np.exp(-2*self.meanReversion*(t-t0))) /  \
                 (2.0 * self.meanReversion)
@@ -47,17 +80,20 @@ class HullWhiteModel:
 
     def riskNeutralExpectationX(self, t, xt, T):
         # E[x] = G'(t,T)x + \int_t^T G'(u,T)y(u)du
-        def f(u):
-            return self.GPrime(u,T)*self.y(u)
-        # use Simpson's rule to approximate integral, this should better be solved analytically
-        integral = (T-t) / 6 * (f(t) + 4*f((t+T)/2) + f(T)) 
-        return self.GPrime(t,T)*xt + integral
+        # we split [t,T] at volatility times and integrate y(u) exactly on each sub-interval
+        u = np.concatenate([ [t], [ s for s in self.volatilityTimes if t<s and s<T ], [T] ])
+        u0, u1 = u[:-1], u[1:]
+        [ t0, y0, s1 ] = self.yParameters(self.volatilityIndex(u1))
+        a = self.meanReversion
+        # y(u) = s1^2/(2a) + [y0 - s1^2/(2a)] exp{-2a(u-t0)}
+        integral = s1**2/(2*a) * (self.GPrime(u1,T) - self.GPrime(u0,T)) / a +  \
+                   (y0 - s1**2/(2*a)) * (self.GPrime(u0,T)*self.GPrime(t0,u0)**2 - self.GPrime(u1,T)*self.GPrime(t0,u1)**2) / a
+        return self.GPrime(t,T)*xt + np.sum(integral)
     
-    def sigma(self,t):   # Todo test this method
-        # find idx s.t. t[idx] < t < t[idx+1]
-        idxSet = np.where(self.volatilityTimes<t)[0]
-        idx = -1 if (idxSet.shape[0]==0) else idxSet[-1]
-        return self.volatilityValues[min(idx+1,len(self.volatilityValues)-1)]
+    def sigma(self,t):
+        idx = self.volatilityIndex(t)
+        if isinstance(idx,int): return self.volatilityValues[min(idx+1,len(self.volatilityValues)-1)]
+        return self.volatilityValues[np.minimum(idx+1,len(self.volatilityValues)-1)]
 
 
     # model methods
@@ -74,6 +110,19 @@ class HullWhiteModel:
         return self.yieldCurve.discount(T) / self.yieldCurve.discount(t) * \
             np.exp(-G*xt - 0.5 * G**2 * self.y(t) )
 
+    # P(t,T,x) = DF exp{-G x - G^2 y(t) / 2} with DF = P(0,T)/P(0,t), we calculate
+    # DF, G and G^2 y(t) / 2 for a vector of maturities T once
+    def zeroBondCoefficients(self, t, T):
+        T  = np.asarray(T)
+        DF = self.yieldCurve.discount(T) / self.yieldCurve.discount(t)
+        G  = self.G(t,T)
+        return [ DF, G, 0.5 * G**2 * self.y(t) ]
+
+    # zero bonds for states xt [n] and maturities T [m], returns a matrix [n,m]
+    def zeroBonds(self, t, xt, T):
+        [ DF, G, Gy ] = self.zeroBondCoefficients(t,T)
+        return DF * np.exp(-np.multiply.outer(xt,G) - Gy)
+
     def zeroBondOption(self, expiryTime, maturityTime, strikePrice, callOrPut):
         nu2 = self.G(expiryTime,maturityTime)**2 * self.y(expiryTime)
         P0  = self.yieldCurve.discount(expiryTime)
@@ -81,16 +130,14 @@ class HullWhiteModel:
         return P0 * Black(strikePrice,P1/P0,np.sqrt(nu2),1.0, callOrPut)
 
     def couponBondOption(self, expiryTime, payTimes, cashFlows, strikePrice, callOrPut):
+        [ DF, G, Gy ] = self.zeroBondCoefficients(expiryTime,payTimes)
         def objective(x):
-            bond = 0
-            for i in range(len(payTimes)):
-                bond += cashFlows[i] * self.zeroBond(expiryTime,x,payTimes[i])
-            return bond - strikePrice
+            return (DF * np.exp(-G*x - Gy)).dot(cashFlows) - strikePrice
         xStar = brentq(objective,-1.0, 1.0, xtol=1.0e-8)   # +/-30% might be too narrow in some situations
+        strikes = DF * np.exp(-G*xStar - Gy)
         bondOption = 0.0
         for i in range(len(payTimes)):
-            strike = self.zeroBond(expiryTime,xStar,payTimes[i])
-            bondOption += cashFlows[i] * self.zeroBondOption(expiryTime,payTimes[i],strike,callOrPut)
+            bondOption += cashFlows[i] * self.zeroBondOption(expiryTime,payTimes[i],strikes[i],callOrPut)
         return bondOption
 
     # future yield curve in terms of forward rates
@@ -107,42 +154,77 @@ class HullWhiteModel:
 
     def initialValues(self):
         return np.array([ 0.0, 0.0 ])
+
+    def vectorized(self):  # evolve also accepts X0[nPaths,size] and dW[nPaths,factors]
+        return True
     
+    # X is a state [size] or an array of states [n,size]
     def zeroBondPayoff(self, X, t, T):
-        return self.zeroBond(t, X[0], T)
+        return self.zeroBond(t, np.asarray(X)[...,0], T)
+
+    def zeroBondPayoffs(self, X, t, T):  # maturities T [m], returns [n,m] for states [n,size]
+        return self.zeroBonds(t, np.asarray(X)[...,0], T)
 
     def numeraire(self, X):
-        return np.exp(X[1])
+        return np.exp(np.asarray(X)[...,1])
 
     # evolve X(t0) -> X(t0+dt) using independent Brownian increments dW
-    # t0, dt are assumed float, X0, X1, dW are np.array
+    # t0, dt are assumed float, X0, X1, dW are np.array of shape [size] or
+    # [nPaths,size] and [factors] or [nPaths,factors] respectively
     def evolve(self, t0, X0, dt, dW):
-        x1 = self.riskNeutralExpectationX(t0,X0[0],t0+dt)
-        # x1 = X0[0] + (self.y(t0) - self.meanReversion*X0[0])*dt
+        return self.evolveWithCoefficients(self.stepCoefficients(t0,dt),X0,dW)
+
+    # a simulation step only depends on the path via
+    #   x1 = A x0 + B + nu dW  and  s1 = s0 + C + D x0 + E x1
+    # coefficients [A, B, nu, C, D, E] only depend on the time grid
+    def stepCoefficients(self, t0, dt):
+        # x1 = E[x] + nu dW with E[x] = G'(t0,t0+dt)x0 + \int_t0^t0+dt G'(u,t0+dt)y(u)du
+        A  = self.GPrime(t0,t0+dt)
+        B  = self.riskNeutralExpectationX(t0,0.0,t0+dt)
         nu = np.sqrt(self.varianceX(t0,t0+dt))
-        x1 = x1 + nu*dW[0]
         # s1 = s0 + \int_t0^t0+dt r dt via Trapezoidal rule
-        r0 = self.yieldCurve.forwardRate(t0)    + X0[0]
-        r1 = self.yieldCurve.forwardRate(t0+dt) + x1
-        s1 = X0[1] + (r0 + r1) * dt / 2
-        # gather results
-        return np.array([x1, s1])          
+        C  = (self.yieldCurve.forwardRate(t0) + self.yieldCurve.forwardRate(t0+dt)) * dt / 2
+        return np.array([ A, B, nu, C, dt / 2, dt / 2 ])
+
+    # coefficients for all steps of a time grid; we cache tables per grid
+    # such that subsequent simulations on the same grid can re-use them; least
+    # recently used grids are evicted
+    def stepCoefficientsTable(self, times):
+        if self.stepCoefficientsState!=self.state():  # curve or volatilities changed
+            self.stepCoefficientsCache.clear()
+            self.stepCoefficientsState = self.state()
+        key = tuple(np.asarray(times,dtype=float))
+        if key in self.stepCoefficientsCache:
+            self.stepCoefficientsCache.move_to_end(key)
+            return self.stepCoefficientsCache[key]
+        table = np.array([ self.stepCoefficients(key[j],key[j+1]-key[j]) for j in range(len(key)-1) ]).reshape(-1,6)
+        if self.stepCoefficientsCacheSize>0:
+            self.stepCoefficientsCache[key] = table
+            if len(self.stepCoefficientsCache)>self.stepCoefficientsCacheSize: self.stepCoefficientsCache.popitem(last=False)
+        return table
+
+    def evolveWithCoefficients(self, coefficients, X0, dW):
+        [ A, B, nu, C, D, E ] = coefficients
+        x1 = A*X0[...,0] + B + nu*dW[...,0]
+        s1 = X0[...,1] + C + D*X0[...,0] + E*x1
+        return np.stack([x1, s1], axis=-1)
         
 
 class HullWhiteModelWithDiscreteNumeraire(HullWhiteModel):
 
     # Python constructor
-    def __init__(self, yieldCurve, meanReversion, volatilityTimes, volatilityValues):
-        HullWhiteModel.__init__(self,yieldCurve,meanReversion,volatilityTimes,volatilityValues)
+    def __init__(self, yieldCurve, meanReversion, volatilityTimes, volatilityValues, stepCoefficientsCacheSize=16):
+        HullWhiteModel.__init__(self,yieldCurve,meanReversion,volatilityTimes,volatilityValues,stepCoefficientsCacheSize)
 
-    # evolve X(t0) -> X(t0+dt) using independent Brownian increments dW
-    # t0, dt are assumed float, X0, X1, dW are np.array,
     # simulation is done with discretely compounded bank account numeraire
-    # and rolling T-forward measure
-    def evolve(self, t0, X0, dt, dW):
-        x1 = self.expectationX(t0,X0[0],t0+dt)
+    # and rolling T-forward measure; evolve() is inherited and uses
+    #   x1 = E^T[x] + nu dW  and  s1 = s0 - log P(t0,t0+dt,x0)
+    def stepCoefficients(self, t0, dt):
+        G  = self.G(t0,t0+dt)
+        A  = self.GPrime(t0,t0+dt)
+        B  = self.expectationX(t0,0.0,t0+dt)
         nu = np.sqrt(self.varianceX(t0,t0+dt))
-        x1 = x1 + nu*dW[0]
-        s1 = X0[1] + np.log(1.0/self.zeroBond(t0,X0[0],t0+dt))
-        return np.array([x1, s1])          
+        # -log P(t0,t0+dt,x0) = -log[P(0,t0+dt)/P(0,t0)] + G x0 + G^2 y(t0) / 2
+        C  = np.log(self.yieldCurve.discount(t0) / self.yieldCurve.discount(t0+dt)) + 0.5 * G**2 * self.y(t0)
+        return np.array([ A, B, nu, C, G, 0.0 ])          
     
\ No newline at end of file
@@ -1,40 +1,309 @@
 #!/usr/bin/python
 
+import multiprocessing
 import numpy as np
+from scipy.stats import norm, qmc
 
-class MCSimulation:
+
+# Increment generators provide independent standard normal increments
+# dW[nPaths,len(times)-1,factors] via standardNormals(nPaths, times, factors)
+# and a standard error estimate for the mean of path values V[nPaths] via
+# standardError(V). Antithetic and (randomised) QMC generators draw all paths
+# at once; MCSimulationStreaming and MCSimulationParallel, which draw chunks
+# independently, only support PseudoRandomIncrements.
+
+class PseudoRandomIncrements:
+
+    # Python constructor
+    def __init__(self, seed=123):
+        self.seed = seed
+
+    def standardNormals(self, nPaths, times, factors):
+        return np.random.RandomState(self.seed).standard_normal([nPaths,len(times)-1,factors])
+
+    def standardError(self, V):
+        return np.std(V,ddof=1) / np.sqrt(V.shape[0])
+
+
+class AntitheticIncrements(PseudoRandomIncrements):
+    # paths m, ..., nPaths-1 use the negative increments of paths 0, ..., nPaths-m-1
+    # with m = (nPaths+1)/2; for odd nPaths path m-1 has no antithetic partner
+
+    def standardNormals(self, nPaths, times, factors):
+        dW = np.random.RandomState(self.seed).standard_normal([(nPaths+1)//2,len(times)-1,factors])
+        return np.concatenate([dW, -dW])[:nPaths]
+
+    def standardError(self, V):  # pairs are independent, an unpaired path is ignored
+        m = (V.shape[0]+1)//2
+        n = V.shape[0] - m
+        return PseudoRandomIncrements.standardError(self,0.5*(V[:n]+V[m:m+n]))
+
+
+# Brownian bridge across times; Z[nPaths,nSteps] are used in the order terminal
+# value W(T), then midpoints of index intervals level by level. Thus the first
+# (best distributed) QMC coordinates determine the coarse path shape. We return
+# standardised increments [W(t_j+1) - W(t_j)] / sqrt(t_j+1 - t_j)
+def brownianBridge(Z, times):
+    N = len(times) - 1
+    W = np.zeros([Z.shape[0],N+1])
+    W[:,N] = np.sqrt(times[N]-times[0]) * Z[:,0]
+    intervals = [ [0,N] ]
+    k = 1
+    while len(intervals)>0:
+        [l, r] = intervals.pop(0)
+        if r-l<2: continue
+        m = (l+r)//2
+        mean = ((times[r]-times[m])*W[:,l] + (times[m]-times[l])*W[:,r]) / (times[r]-times[l])
+        W[:,m] = mean + np.sqrt((times[m]-times[l])*(times[r]-times[m])/(times[r]-times[l])) * Z[:,k]
+        k += 1
+        intervals += [ [l,m], [m,r] ]
+    return np.diff(W,axis=1) / np.sqrt(np.diff(times))
+
+
+class SobolIncrements:
+    # (scrambled) Sobol points with dimension nSteps x factors mapped to normals
+    # via the inverse cumulative distribution; coordinate k*factors+f drives
+    # bridge point k of factor f. nPaths should be a power of 2. A single
+    # sequence does not provide an error estimate, see RandomisedQMCIncrements
 
     # Python constructor
-    def __init__(self, model, times, nPaths, seed=123):
+    def __init__(self, seed=123, scramble=True, brownianBridge=True):
+        self.seed           = seed
+        self.scramble       = scramble
+        self.brownianBridge = brownianBridge
+
+    def sobolNormals(self, nPaths, nSteps, factors, seed):
+        sobol = qmc.Sobol(d=nSteps*factors, scramble=self.scramble, seed=seed)
+        if not self.scramble: sobol.fast_forward(1)  # skip the origin
+        return norm.ppf(sobol.random(nPaths)).reshape([nPaths,nSteps,factors])
+
+    def increments(self, Z, times):
+        if not self.brownianBridge: return Z
+        return np.stack([ brownianBridge(Z[:,:,f],times) for f in range(Z.shape[2]) ], axis=-1)
+
+    def standardNormals(self, nPaths, times, factors):
+        return self.increments(self.sobolNormals(nPaths,len(times)-1,factors,self.seed),times)
+
+    def standardError(self, V):
+        return np.nan
+
+
+class RandomisedQMCIncrements(SobolIncrements):
+    # nScrambles independently scrambled Sobol sequences with nPaths/nScrambles
+    # points each (in consecutive blocks of paths); block means are i.i.d. and
+    # yield the standard error. nPaths must be a multiple of nScrambles
+
+    # Python constructor
+    def __init__(self, seed=123, nScrambles=16, brownianBridge=True):
+        SobolIncrements.__init__(self,seed,True,brownianBridge)
+        self.nScrambles = nScrambles
+
+    def blockSize(self, nPaths):
+        if nPaths<self.nScrambles or nPaths % self.nScrambles != 0:
+            raise ValueError('RandomisedQMCIncrements: nPaths must be a positive multiple of nScrambles=' + str(self.nScrambles))
+        return nPaths // self.nScrambles
+
+    def standardNormals(self, nPaths, times, factors):
+        blockSize = self.blockSize(nPaths)
+        seeds = [ np.random.default_rng(s) for s in np.random.SeedSequence(self.seed).spawn(self.nScrambles) ]
+        Z = np.concatenate([ self.sobolNormals(blockSize,len(times)-1,factors,s) for s in seeds ])
+        return self.increments(Z,times)
+
+    def standardError(self, V):
+        blockMeans = np.mean(V.reshape([self.nScrambles,self.blockSize(V.shape[0])]),axis=1)
+        return np.std(blockMeans,ddof=1) / np.sqrt(self.nScrambles)
+
+
+def incrementGenerator(increments, seed=123):
+    if increments is None or increments=='pseudo': return PseudoRandomIncrements(seed)
+    if increments=='antithetic': return AntitheticIncrements(seed)
+    if increments=='sobol':      return SobolIncrements(seed)
+    if increments=='rqmc':       return RandomisedQMCIncrements(seed)
+    return increments   # a generator object
+
+
+class MCSimulation:
+
+    # Python constructor; increments is 'pseudo' (default), 'antithetic',
+    # 'sobol', 'rqmc' or an increment generator object; streaming and parallel
+    # simulations only accept 'pseudo'
+    def __init__(self, model, times, nPaths, seed=123, increments=None):
         print('Start MC Simulation:', end='', flush=True)
         self.model  = model   # an object implementing stochastic process interface
         self.times  = times   # simulation times [0, ..., T], np.array
         self.nPaths = nPaths  # number of paths, long
         # random number generator
         print(' |dW\'s', end='', flush=True)
-        self.dW = np.random.RandomState(seed).standard_normal([self.nPaths,len(self.times)-1,model.factors()])
+        self.increments = incrementGenerator(increments,seed)
+        self.dW = self.increments.standardNormals(self.nPaths,self.times,model.factors())
         print('|', end='', flush=True)
         # simulate states
-        self.X = np.zeros([self.nPaths,len(self.times),model.size()])
-        for i in range(self.nPaths):
-            if i % max(int(self.nPaths/10),1) == 0 : print('s', end='', flush=True)
-            self.X[i][0] = self.model.initialValues()
-            for j in range(len(self.times)-1):
-                self.X[i][j+1] = model.evolve(self.times[j],self.X[i][j],times[j+1]-times[j],self.dW[i][j])
+        self.X = self.simulatePaths(self.times,self.dW)
         print('| Finished.', end='\n', flush=True)
 
+    # simulate states X[nPaths,len(times),size] for given increments dW[nPaths,len(times)-1,factors]
+    def simulatePaths(self, times, dW):
+        X = np.zeros([dW.shape[0],len(times),self.model.size()])
+        if hasattr(self.model,'vectorized') and self.model.vectorized():
+            # evolve all paths at once per time step
+            coefficients = None
+            if hasattr(self.model,'stepCoefficientsTable'):  # path-independent step details
+                coefficients = self.model.stepCoefficientsTable(times)
+            X[:,0,:] = self.model.initialValues()
+            for j in range(len(times)-1):
+                if coefficients is not None:
+                    X[:,j+1,:] = self.model.evolveWithCoefficients(coefficients[j],X[:,j,:],dW[:,j,:])
+                else:
+                    X[:,j+1,:] = self.model.evolve(times[j],X[:,j,:],times[j+1]-times[j],dW[:,j,:])
+        else:  # fall-back for models which only evolve individual paths
+            for i in range(dW.shape[0]):
+                X[i][0] = self.model.initialValues()
+                for j in range(len(times)-1):
+                    X[i][j+1] = self.model.evolve(times[j],X[i][j],times[j+1]-times[j],dW[i][j])
+        return X
+
+    # discounted payoffs per path for simulated states X on the grid times
+    def discountedPayoffs(self, payoff, X, times):
+        obsIdx = np.where(times==payoff.observationTime)[0][0]  # assume we simulated these dates
+        payIdx = np.where(times==payoff.payTime)[0][0]          # otherwise we get an exception
+        VT = payoff.at(X[:,obsIdx,:])                # simulated payoff at observation time
+        N0 = payoff.model.numeraire(X[:,0,:])        # numeraire at 0; should be 1
+        NT = payoff.model.numeraire(X[:,payIdx,:])   # simulated numeraire at pay time
+        return N0 * VT / NT                          # simulated discounted payoffs
+
     def npv(self, payoff):
         print('Calculate payoff...', end='', flush=True)
-        obsIdx = np.where(self.times==payoff.observationTime)[0][0]  # assume we simulated these dates
-        payIdx = np.where(self.times==payoff.payTime)[0][0]          # otherwise we get an exception
-        V0 = np.zeros([self.nPaths])   # simulated discounted payoffs
-        VT = np.zeros([self.nPaths])   # simulated payoff at observation time
-        N0 = np.zeros([self.nPaths])   # numeraire at 0; should be 1
-        NT = np.zeros([self.nPaths])   # simulated numeraire at pay time
-        for i in range(self.nPaths):
-            VT[i] = payoff.at(self.X[i][obsIdx])
-            N0[i] = payoff.model.numeraire(self.X[i][0])
-            NT[i] = payoff.model.numeraire(self.X[i][payIdx])
-            V0[i] = N0[i] * VT[i] / NT[i]
+        V0 = self.discountedPayoffs(payoff,self.X,self.times)
         print(' Done.', end='\n', flush=True)
         return np.mean(V0)
+
+    def stdError(self, payoff):  # Monte Carlo standard error of npv
+        return self.increments.standardError(self.discountedPayoffs(payoff,self.X,self.times))
+
+
+# combine running statistics [count, mean, sum of squared deviations] per
+# payoff of two path samples (Welford/Chan update), stats are np.array [nPayoffs,3]
+def mergeStatistics(stats, otherStats):
+    n = stats[:,0] + otherStats[:,0]
+    delta = otherStats[:,1] - stats[:,1]
+    weight = np.divide(otherStats[:,0], n, out=np.zeros(n.shape[0]), where=n>0)
+    mean = stats[:,1] + delta * weight
+    m2 = stats[:,2] + otherStats[:,2] + delta**2 * stats[:,0] * weight
+    return np.stack([n, mean, m2], axis=-1)
+
+
+class MCSimulationStreaming(MCSimulation):
+    # We simulate paths in chunks and evaluate the registered payoffs on the
+    # fly. Only running statistics of the discounted payoffs are kept. States
+    # are stored for the dates in retainTimes only (e.g. exercise dates for
+    # AMCSolver); then times and X refer to these dates and the full simulation
+    # grid is available as simulationTimes. Peak memory is bounded by
+    # chunkSize x len(simulationTimes) instead of nPaths x len(simulationTimes).
+    # Chunks are drawn independently, thus only pseudo random increments are
+    # supported; antithetic and QMC generators need all paths at once.
+
+    # Python constructor
+    def __init__(self, model, times, nPaths, payoffs=[], retainTimes=[], chunkSize=10000, seed=123, increments=None):
+        self.increments = incrementGenerator(increments,seed)
+        if type(self.increments) is not PseudoRandomIncrements:
+            raise ValueError('MCSimulationStreaming: only pseudo random increments are supported, got %s; use MCSimulation for antithetic or QMC increments' % type(self.increments).__name__)
+        print('Start MC Simulation (streaming):', end='', flush=True)
+        self.model           = model     # an object implementing stochastic process interface
+        self.simulationTimes = times     # simulation times [0, ..., T], np.array
+        self.nPaths          = nPaths    # number of paths, long
+        self.payoffs         = payoffs   # payoffs evaluated during simulation
+        self.chunkSize       = chunkSize # number of paths simulated at once
+        # we only keep states on retained dates, include 0.0 if you want to use npv() for other payoffs
+        self.retainIdx = np.array([ np.where(np.abs(times-t)<1.0e-8)[0][0] for t in retainTimes ], dtype=int)
+        self.times     = times[self.retainIdx]
+        self.X         = np.zeros([self.nPaths,self.retainIdx.shape[0],model.size()])
+        # running statistics [count, mean, sum of squared deviations] per payoff
+        self.statistics = np.zeros([len(self.payoffs),3])
+        print(' |', end='', flush=True)
+        self.simulate(seed)
+        print('| Finished.', end='\n', flush=True)
+
+    def chunks(self):
+        return [ [start, min(start+self.chunkSize,self.nPaths)] for start in range(0,self.nPaths,self.chunkSize) ]
+
+    def simulate(self, seed):
+        randomState = np.random.RandomState(seed)  # same random numbers as for MCSimulation
+        chunks = self.chunks()
+        for k in range(len(chunks)):
+            if k % max(int(len(chunks)/10),1) == 0 : print('c', end='', flush=True)
+            [start, end] = chunks[k]
+            dW = randomState.standard_normal([end-start,len(self.simulationTimes)-1,self.model.factors()])
+            [stats, X] = self.simulateChunk(dW)
+            self.statistics = mergeStatistics(self.statistics,stats)
+            self.X[start:end] = X
+
+    # simulate a chunk of paths and return payoff statistics and retained states
+    def simulateChunk(self, dW):
+        X = self.simulatePaths(self.simulationTimes,dW)
+        stats = np.zeros([len(self.payoffs),3])
+        for k in range(len(self.payoffs)):
+            V0 = self.discountedPayoffs(self.payoffs[k],X,self.simulationTimes)
+            stats[k] = [ V0.shape[0], np.mean(V0), np.sum((V0-np.mean(V0))**2) ]
+        return [ stats, X[:,self.retainIdx,:] ]
+
+    def payoffIndex(self, payoff):
+        for k in range(len(self.payoffs)):
+            if self.payoffs[k] is payoff: return k
+        return None
+
+    def npv(self, payoff):
+        k = self.payoffIndex(payoff)
+        if k is None:  # fall back to retained states
+            return MCSimulation.npv(self,payoff)
+        return self.statistics[k][1]
+
+    def stdError(self, payoff):  # Monte Carlo standard error of npv
+        k = self.payoffIndex(payoff)
+        if k is None:  # fall back to retained states
+            return MCSimulation.stdError(self,payoff)
+        [n, mean, m2] = self.statistics[k]
+        return np.sqrt(m2 / (n-1) / n)
+
+
+# simulation shared with forked worker processes; this avoids pickling
+# models which hold QuantLib objects
+parallelSimulation = None
+
+def simulateChunkInWorker(k):
+    return parallelSimulation.simulateChunkWithSubstream(k)
+
+
+class MCSimulationParallel(MCSimulationStreaming):
+    # We split paths into chunks of fixed size and simulate chunks in a pool
+    # of worker processes. Each chunk draws from its own substream spawned
+    # from np.random.SeedSequence(seed). Chunk statistics are merged in chunk
+    # order. Thus results only depend on seed and chunkSize but not on the
+    # number of workers. Random numbers differ from MCSimulation. As for
+    # MCSimulationStreaming only pseudo random increments are supported.
+
+    # Python constructor
+    def __init__(self, model, times, nPaths, payoffs=[], retainTimes=[], chunkSize=10000, seed=123, nWorkers=None, increments=None):
+        self.nWorkers = multiprocessing.cpu_count() if nWorkers==None else nWorkers
+        MCSimulationStreaming.__init__(self,model,times,nPaths,payoffs,retainTimes,chunkSize,seed,increments)
+
+    def simulate(self, seed):
+        global parallelSimulation
+        chunks = self.chunks()
+        self.substreams = np.random.SeedSequence(seed).spawn(len(chunks))
+        if self.nWorkers>1 and 'fork' in multiprocessing.get_all_start_methods():
+            parallelSimulation = self
+            with multiprocessing.get_context('fork').Pool(min(self.nWorkers,len(chunks))) as pool:
+                results = pool.map(simulateChunkInWorker,range(len(chunks)))
+            parallelSimulation = None
+        else:  # serial fall-back
+            results = [ self.simulateChunkWithSubstream(k) for k in range(len(chunks)) ]
+        print('c', end='', flush=True)
+        for k in range(len(chunks)):
+            [stats, X] = results[k]
+            self.statistics = mergeStatistics(self.statistics,stats)
+            self.X[chunks[k][0]:chunks[k][1]] = X
+
+    def simulateChunkWithSubstream(self, k):
+        [start, end] = self.chunks()[k]
+        dW = np.random.default_rng(self.substreams[k]).standard_normal([end-start,len(self.simulationTimes)-1,self.model.factors()])
+        return self.simulateChunk(dW)
@@ -1,74 +1,242 @@
 #!/usr/bin/python
 
+import copy
 import numpy as np
 from scipy.sparse import diags
 
-from QuantLibWrapper.ThetaMethod import thetaStep
+from QuantLibWrapper.ThetaMethod import thetaStep, thetaFactors
+from QuantLibWrapper.Grids import concentratedGrid
+
+# three-point finite difference weights [D1, D2] for first and second derivatives at
+# interior points x[1:-1] of a (non-uniform) grid x; D[0], D[1], D[2] multiply
+# V[i-1], V[i] and V[i+1] respectively
+def differenceWeights(x):
+    hm = x[1:-1] - x[:-2]
+    hp = x[2:] - x[1:-1]
+    D1 = [ -hp/hm/(hm+hp), (hp-hm)/hm/hp, hm/hp/(hm+hp) ]
+    D2 = [ 2.0/hm/(hm+hp), -2.0/hm/hp,    2.0/hp/(hm+hp) ]
+    return [ D1, D2 ]
+
+
+# max(U,H) on a grid x where we replace values next to a sign change of U-H by
+# averages of max(U,H) over the cells [x[i-1]+x[i], x[i]+x[i+1]]/2 using linear
+# interpolation; this removes the dependence of the error on the position of
+# the kink relative to the grid. U and H may be matrices [n,nTrades]
+def smoothedMaximum(x, U, H):
+    V = np.maximum(U,H)
+    D = U - H
+    x = x.reshape(x.shape + (1,)*(len(D.shape)-1))
+    def integral(d0, d1, L):  # \int max(d,0) for linear d on an interval of length L
+        dMax = np.maximum(d0,d1)
+        return np.where(np.minimum(d0,d1)>=0, (d0+d1)/2*L,
+               np.where(dMax>0, dMax**2/2/np.maximum(np.abs(d1-d0),1.0e-300)*L, 0.0))
+    Lm = (x[1:-1]-x[:-2])/2
+    Lp = (x[2:]-x[1:-1])/2
+    average = ( integral((D[:-2]+D[1:-1])/2,D[1:-1],Lm) + integral(D[1:-1],(D[1:-1]+D[2:])/2,Lp) ) / (Lm+Lp)
+    kink = (D[:-2]*D[1:-1]<0) | (D[1:-1]*D[2:]<0)
+    V[1:-1] = np.where(kink, H[1:-1]+average, V[1:-1])
+    return V
+
 
 class PDESolver:
 
     # Python constructor
-    def __init__(self, hwModel, nGridPoints=101, stdDevs=5, theta=0.5, timeStepSize=1.0/12.0, lambda0N=None):
+    def __init__(self, hwModel, nGridPoints=101, stdDevs=5, theta=0.5, timeStepSize=1.0/12.0, lambda0N=None, freezePeriod=None, concentrationPoints=[], concentrationWidth=0.1, rannacherSteps=0, smoothPayoff=False):
         self.hwModel      = hwModel
         self.nGridPoints  = nGridPoints
         self.stdDevs      = stdDevs
         self.theta        = theta
         self.timeStepSize = timeStepSize
         self.lambda0N     = lambda0N   # for boundary condition
+        # grid points x are concentrated around these states, e.g. strikes; a list
+        # or a function of expiryTime returning a list, see Grids.concentratedGrid()
+        self.concentrationPoints = concentrationPoints
+        self.concentrationWidth  = concentrationWidth
+        # By default the operator is re-built per time step; LU factors are only
+        # re-used if all coefficients [f, sigma, y, lambda0, lambdaN] are exactly
+        # unchanged. Since y(t) increases with t (and lambda depends on V) this
+        # rarely happens. If freezePeriod is provided we evaluate the coefficients
+        # once per sub-period of length freezePeriod and all time steps of a
+        # sub-period share one operator. This is an approximation: y(t), sigma(t)
+        # and f(t) vary within a sub-period and prices change accordingly (e.g.
+        # by a few 1e-6 for freezePeriod=1 and monthly steps)
+        self.freezePeriod = freezePeriod
+        # number of time steps after each exercise date which are replaced by two
+        # implicit Euler half-steps; this damps Crank-Nicolson oscillations at the kink
+        self.rannacherSteps = rannacherSteps
+        # average max(U,H) around the exercise boundary, see smoothedMaximum()
+        self.smoothPayoff = smoothPayoff
+        # the last operator [key, ht, l, c, u, factors] is re-used if coefficients are unchanged
+        self.operator = None
+        # LU factorizations and re-uses in rollBackOneStep(), reset by rollBack()
+        self.factorizations = 0
+        self.reuses         = 0
+        # [T0, T1, factorizations, reuses] per call of rollBack()
+        self.rollBackStatistics = []
+
+    # a solver with the same settings but different grid and time step size
+    def withResolution(self, nGridPoints, timeStepSize):
+        solver = copy.copy(self)
+        solver.nGridPoints        = nGridPoints
+        solver.timeStepSize       = timeStepSize
+        solver.operator           = None
+        solver.factorizations     = 0
+        solver.reuses             = 0
+        solver.rollBackStatistics = []
+        return solver
 
     def xSet(self,expityTime):
         sigma = np.sqrt(self.hwModel.varianceX(0.0,expityTime))
-        return np.linspace(-self.stdDevs*sigma,self.stdDevs*sigma,self.nGridPoints)
+        points = self.concentrationPoints(expityTime) if callable(self.concentrationPoints) else self.concentrationPoints
+        return concentratedGrid(-self.stdDevs*sigma,self.stdDevs*sigma,self.nGridPoints,points,self.concentrationWidth)
 
     def rollBack(self, T0, T1, x1, U1, H1):
         # first we calculate the payoff
-        V = np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ])
-        # now we need to determine the time grid
-        M = int((T1-T0)/self.timeStepSize)
-        tGrid = np.linspace(T1,T1-M*self.timeStepSize,M+1)
-        if tGrid[-1]>T0: np.append(tGrid,[T0])
+        V = smoothedMaximum(x1,U1,H1) if self.smoothPayoff else np.maximum(U1,H1)
+        # now we need to determine the time grid, equidistant steps not larger than timeStepSize
+        M = int(np.ceil((T1-T0)/self.timeStepSize - 1.0e-8))
+        tGrid = np.linspace(T1,T0,M+1)
+        self.factorizations = 0
+        self.reuses         = 0
+        coefficients = None
         for k in range(tGrid.shape[0]-1):
+            if self.freezePeriod!=None and (coefficients is None or tGrid[k] < tFrozen - self.freezePeriod + 1.0e-8):
+                tFrozen = tGrid[k]  # start a new sub-period
+                coefficients = self.coefficients(max(tFrozen-self.freezePeriod,tGrid[-1]),tFrozen,x1,V)
             # then we roll back individual time steps
-            V = self.rollBackOneStep(tGrid[k+1],tGrid[k],x1,V)
+            if k<self.rannacherSteps and self.theta<1.0:
+                tMid = (tGrid[k]+tGrid[k+1])/2.0
+                V = self.rollBackOneStep(tMid,tGrid[k],x1,V,coefficients,1.0)
+                V = self.rollBackOneStep(tGrid[k+1],tMid,x1,V,coefficients,1.0)
+            else:
+                V = self.rollBackOneStep(tGrid[k+1],tGrid[k],x1,V,coefficients)
+        self.rollBackStatistics.append([T0, T1, self.factorizations, self.reuses])
         return [x1, V]
 
-    def rollBackOneStep(self, T0, T1, x, V):
-        # time and space discretisations
-        ht = T1 - T0
-        hx = (x[-1]-x[0])/(x.shape[0]-1)  # assume equidistant grid
+    # PDE coefficients [f, sigma, y, lambda0, lambdaN] for a roll-back from T1 to T0
+    def coefficients(self, T0, T1, x, V, theta=None):
+        theta = self.theta if theta==None else theta
         # theta estimation point
-        t     = self.theta*T0 + (1-self.theta)*T1
-        f     = self.hwModel.forwardRate(0.0,0.0,t)
+        t     = theta*T0 + (1-theta)*T1
+        if T1>T0:  # average forward rate, forward curves may jump within [T0,T1]
+            f = np.log(self.hwModel.yieldCurve.discount(T0)/self.hwModel.yieldCurve.discount(T1)) / (T1-T0)
+        else:
+            f = self.hwModel.forwardRate(0.0,0.0,t)
         sigma = self.hwModel.sigma(t)
         y     = self.hwModel.y(t)
-        a     = self.hwModel.meanReversion
-        # linear operator v' = M v. Note, x is an array
-        c = (sigma**2/hx**2 + f) + x
-        l = -sigma**2/2.0/hx**2 + (1.0/2.0/hx)*(y-a*x)
-        u = -sigma**2/2.0/hx**2 - (1.0/2.0/hx)*(y-a*x)
         # adjust for boundary conditions
         # lanbda approximation
         if self.lambda0N!=None:  # fall-back if provided by user, typically lambda0N=0
             lambda0 = self.lambda0N
             lambdaN = self.lambda0N
-        else:
-            Vx0  = (V[2]-V[0])/2.0/hx
-            Vxx0 = (V[2]-2*V[1]+V[0])/hx/hx
-            lambda0 = Vxx0/Vx0 if abs(Vx0)>1.0e-8 else 0.0
-            VxN  = (V[-1]-V[-3])/2.0/hx
-            VxxN = (V[-1]-2*V[-2]+V[-3])/hx/hx
-            lambdaN = VxxN/VxN if abs(VxN)>1.0e-8 else  0.0
+        else:  # V may be a matrix [n,nTrades], then lambda0 and lambdaN are arrays [nTrades]
+            [ D1, D2 ] = differenceWeights(x)
+            Vx0  = D1[0][0]*V[0] + D1[1][0]*V[1] + D1[2][0]*V[2]
+            Vxx0 = D2[0][0]*V[0] + D2[1][0]*V[1] + D2[2][0]*V[2]
+            lambda0 = np.divide(Vxx0, Vx0, out=np.zeros(np.shape(Vx0)), where=np.abs(Vx0)>1.0e-8)
+            VxN  = D1[0][-1]*V[-3] + D1[1][-1]*V[-2] + D1[2][-1]*V[-1]
+            VxxN = D2[0][-1]*V[-3] + D2[1][-1]*V[-2] + D2[2][-1]*V[-1]
+            lambdaN = np.divide(VxxN, VxN, out=np.zeros(np.shape(VxN)), where=np.abs(VxN)>1.0e-8)
+            # keep 2 + lambda h away from zero, this matters for coarse boundary cells
+            lambda0 = np.maximum(lambda0, -1.0/(x[1]-x[0]))
+            lambdaN = np.maximum(lambdaN, -1.0/(x[-1]-x[-2]))
             #print('Vx0 = '+str('%10.6f'%Vx0)+', Vxx0 = '+str('%10.6f'%Vxx0)+', l0 = '+str('%10.6f'%lambda0)+ \
             #    ', VxN = '+str('%10.6f'%VxN)+', VxxN = '+str('%10.6f'%VxxN)+', lN = '+str('%10.6f'%lambdaN)  )
-        c[0]  =  2.0*(y-a*x[0] +lambda0*sigma**2/2.0)/(2.0+lambda0*hx)/hx + x[0]  + f
-        c[-1] = -2.0*(y-a*x[-1]+lambdaN*sigma**2/2.0)/(2.0+lambdaN*hx)/hx + x[-1] + f
-        u[0]  = -2.0*(y-a*x[0] +lambda0*sigma**2/2.0)/(2.0+lambda0*hx)/hx
-        l[-1] =  2.0*(y-a*x[-1]+lambdaN*sigma**2/2.0)/(2.0+lambdaN*hx)/hx
+        return [ f, sigma, y, lambda0, lambdaN ]
+
+    def rollBackOneStep(self, T0, T1, x, V, coefficients=None, theta=None):
+        theta = self.theta if theta==None else theta
+        if coefficients is None:
+            coefficients = self.coefficients(T0,T1,x,V,theta)
+        [ f, sigma, y, lambda0, lambdaN ] = coefficients
+        # time discretisation, x may be a non-uniform grid
+        ht = T1 - T0
+        # re-use diagonals and LU factors if the operator did not change
+        key = (round(ht,12), theta, x.tobytes(), f, sigma, y, np.asarray(lambda0).tobytes(), np.asarray(lambdaN).tobytes())
+        if self.operator is not None and self.operator[0]==key:
+            self.reuses += 1
+            [_, ht, l, c, u, factors] = self.operator
+            return thetaStep(l[1:], c, u[:-1],V,ht,theta,factors)
+        a  = self.hwModel.meanReversion
+        mu = y - a*x
+        # linear operator v' = M v with M = -mu D1 - sigma^2/2 D2 + (f + x). Note, x is
+        # an array; diagonals are matrices [n,nTrades] if boundary conditions differ per trade
+        [ D1, D2 ] = differenceWeights(x)
+        shape = x.shape + np.shape(lambda0)
+        def columns(diagonal):
+            return diagonal.reshape(diagonal.shape + (1,)*len(np.shape(lambda0)))
+        l = np.zeros(shape)
+        c = np.zeros(shape)
+        u = np.zeros(shape)
+        l[1:-1] = columns(-mu[1:-1]*D1[0] - sigma**2/2.0*D2[0])
+        c[1:-1] = columns(-mu[1:-1]*D1[1] - sigma**2/2.0*D2[1] + f + x[1:-1])
+        u[1:-1] = columns(-mu[1:-1]*D1[2] - sigma**2/2.0*D2[2])
+        # one-sided differences at the boundaries with V'' = lambda V'
+        h0 = x[1] - x[0]
+        hN = x[-1] - x[-2]
+        c[0]  =  2.0*(mu[0] +lambda0*sigma**2/2.0)/(2.0+lambda0*h0)/h0 + x[0]  + f
+        c[-1] = -2.0*(mu[-1]+lambdaN*sigma**2/2.0)/(2.0+lambdaN*hN)/hN + x[-1] + f
+        u[0]  = -2.0*(mu[0] +lambda0*sigma**2/2.0)/(2.0+lambda0*h0)/h0
+        l[-1] =  2.0*(mu[-1]+lambdaN*sigma**2/2.0)/(2.0+lambdaN*hN)/hN
         # solve one step via theta method
         # M = diags([l[1:], c, u[:-1] ],[-1, 0, 1])
-        V = thetaStep(l[1:], c, u[:-1],V,ht,self.theta)
-        return V
-
-
+        factors = thetaFactors(l[1:], c, u[:-1], ht, theta)
+        self.factorizations += 1
+        self.operator = [key, ht, l, c, u, factors]
+        return thetaStep(l[1:], c, u[:-1],V,ht,theta,factors)
 
 
+# We price to a given tolerance via Richardson extrapolation. The function
+# price(method) returns an npv for a PDESolver method, e.g.
+#   lambda method : BermudanOption(expiryTimes,underlyings,method).npv()
+# We assume errors V(n,h) = V + a h^p + b dx^q and estimate a h^p and b dx^q
+# from V(n,h/2) and V(2n-1,h). The orders start at p = q = 2 (Crank-Nicolson
+# with Rannacher steps) and are updated from consecutive differences once a
+# dimension has been refined. On each level we refine the dimension with the
+# larger error until consecutive extrapolated prices differ by less than
+# safetyFactor x tolerance; this error estimate tends to be optimistic if the
+# orders are not yet in the asymptotic range. Returns [npv, details] with the base resolution of the last
+# level, the estimated orders and all prices V(n,h) calculated.
+def PDESolverToTolerance(price, solver, tolerance, maxLevels=8, safetyFactor=0.5):
+    prices = {}
+    def V(n, h):
+        if (n,h) not in prices:
+            prices[(n,h)] = price(solver.withResolution(n,h))
+        return prices[(n,h)]
+    def order(previousDifference, difference):
+        if previousDifference==None or previousDifference*difference<=0:
+            return 2.0
+        return min(max(np.log2(previousDifference/difference),1.0),4.0)
+    n = solver.nGridPoints
+    h = solver.timeStepSize
+    previous = None
+    [ coarserT, coarserX ] = [ None, None ]   # differences before the last refinement
+    for level in range(maxLevels):
+        V0 = V(n,h)
+        diffT = V0 - V(n,h/2)
+        diffX = V0 - V(2*n-1,h)
+        p = order(coarserT,diffT)
+        q = order(coarserX,diffX)
+        errorT = diffT * 2**p / (2**p - 1)   # a h^p
+        errorX = diffX * 2**q / (2**q - 1)   # b dx^q
+        npv = V0 - errorT - errorX
+        error = abs(errorT) + abs(errorX) if previous==None else abs(npv - previous)
+        converged = error<safetyFactor*tolerance
+        if converged or level==maxLevels-1:
+            break   # n and h are the resolution actually priced
+        previous = npv
+        if abs(errorT)>abs(errorX):
+            h = h/2
+            coarserT = diffT
+        else:
+            n = 2*n-1
+            coarserX = diffX
+    if not converged: print('WARNING: PDESolverToTolerance did not converge, error ' + str(error))
+    details = { 'nGridPoints'  : n,
+                'timeStepSize' : h,
+                'orders'       : [ p, q ],
+                'error'        : error,
+                'converged'    : converged,
+                'levels'       : level+1,
+                'prices'       : prices }
+    return [ npv, details ]
@@ -2,6 +2,9 @@
 
 import numpy as np
 
+# Payoffs are evaluated via at(x) for a single state x = [x_0, ..., x_size-1]
+# or for an array of states x[n,size]; then at(x) returns an array of shape [n]
+
 class Pay:
     # Python constructor
     def __init__(self, payoff, payTime):
@@ -15,11 +18,11 @@ class Pay:
 
 class Zero:
     def at(self,x):
-        return 0.0
+        return np.zeros(np.shape(x)[:-1])
 
 class One:
     def at(self,x):
-        return 1.0
+        return np.ones(np.shape(x)[:-1])
 
 class Max:
     # Python constructor
@@ -28,7 +31,7 @@ class Max:
         self.second = second
 
     def at(self,x):
-        return max(self.first.at(x),self.second.at(x),)
+        return np.maximum(self.first.at(x),self.second.at(x))
     
 
 class VanillaOption:
@@ -41,7 +44,7 @@ class VanillaOption:
         self.strike     = strike
         self.callOrPut  = callOrPut
     def at(self, x):
-        return max(self.callOrPut*(self.underlying.at(x)-self.strike),0.0)
+        return np.maximum(self.callOrPut*(self.underlying.at(x)-self.strike),0.0)
 
 class CouponBond:
     # Python constructor
@@ -53,10 +56,7 @@ class CouponBond:
         self.cashFlows = cashFlows
     # function    
     def at(self, x):
-        bond = 0
-        for i in range(len(self.payTimes)):
-            bond += self.cashFlows[i] * self.model.zeroBondPayoff(x,self.observationTime,self.payTimes[i])
-        return bond
+        return self.model.zeroBondPayoffs(x,self.observationTime,self.payTimes).dot(self.cashFlows)
 
 class SwapRate:
     # Python constructor
@@ -70,14 +70,15 @@ class SwapRate:
         tmp = [startTime+k for k in range(int(endTime-startTime)+1)]
         if tmp[-1]<endTime : tmp = tmp + [endTime]
         self.annuityTimes = np.array(tmp)
+        # swap rate = P(T_0) - P(T_n) / sum tau_i P(T_i)
+        self.annuityWeights  = np.append([0.0], self.annuityTimes[1:]-self.annuityTimes[:-1])
+        self.floatLegWeights = np.zeros(self.annuityTimes.shape[0])
+        self.floatLegWeights[0]  =  1.0
+        self.floatLegWeights[-1] = -1.0
 
     # function    
     def at(self, x):
-        annuity = 0
-        for i in range(1,self.annuityTimes.shape[0]):
-            annuity += (self.annuityTimes[i]-self.annuityTimes[i-1]) * self.model.zeroBondPayoff(x,self.observationTime,self.annuityTimes[i])
-        floatLeg = self.model.zeroBondPayoff(x,self.observationTime,self.startTime) -  \
-                   self.model.zeroBondPayoff(x,self.observationTime,self.endTime)
-        return floatLeg / annuity
+        bonds = self.model.zeroBondPayoffs(x,self.observationTime,self.annuityTimes)
+        return bonds.dot(self.floatLegWeights) / bonds.dot(self.annuityWeights)
 
 
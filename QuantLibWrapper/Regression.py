@@ -1,29 +1,218 @@
 #!/usr/bin/python
 
+import copy
 import numpy as np
-from scipy.linalg import lstsq
+from scipy.linalg import lstsq, solve_triangular
 
 def MultiIndexSet(n, k):
     if n==1: return [ [i] for i in range(k) ]
     return [ [i]+s for i in range(k) for s in MultiIndexSet(n-1,k-i)]
 
+
+# Bases map controls [n,d] to basis functions [n,k]. setUp(controls) is called
+# with the first chunk of training controls and may fix data-dependent details.
+# The first basis function is the constant 1 (not penalised by ridge solvers).
+# Polynomial bases with maxPolynomialDegree=None take the degree of the
+# Regression (or AMCSolver) they are used with.
+
+class MonomialBasis:
+
+    # Python constructor
+    def __init__(self, maxPolynomialDegree=None):
+        self.maxPolynomialDegree = maxPolynomialDegree
+        self.multiIdxSet = None
+
+    def setUp(self, controls):
+        if self.maxPolynomialDegree is None: self.maxPolynomialDegree = 2
+        if self.multiIdxSet is None:
+            self.multiIdxSet = np.array(MultiIndexSet(np.shape(controls)[-1],self.maxPolynomialDegree+1))
+
+    # p[...,j,e] = P_e(controls[...,j]) for e = 0, ..., maxPolynomialDegree
+    def polynomials(self, controls):
+        powers = np.ones(controls.shape + (self.maxPolynomialDegree+1,))
+        for e in range(1,self.maxPolynomialDegree+1):
+            powers[...,e] = powers[...,e-1] * controls
+        return powers
+
+    # basis functions for a control [d] or controls [n,d], returns [k] or [n,k]
+    def functions(self, controls):
+        p = self.polynomials(np.asarray(controls, dtype=float))
+        # x[...,i] = prod_j P_{multiIdxSet[i][j]}(controls[...,j])
+        return np.prod(p[...,np.arange(self.multiIdxSet.shape[1]),self.multiIdxSet], axis=-1)
+
+
+class LaguerreBasis(MonomialBasis):
+    # Laguerre polynomials of standardised controls (x - shift) / scale with
+    # total degree up to maxPolynomialDegree. By default shift and scale are the
+    # minimum and standard deviation of the first training chunk. If weighted
+    # we use exp{-x/2} L_e(x) for e > 0 (Longstaff/Schwartz).
+
+    # Python constructor
+    def __init__(self, maxPolynomialDegree=None, shift=None, scale=None, weighted=False):
+        MonomialBasis.__init__(self,maxPolynomialDegree)
+        self.shift    = shift
+        self.scale    = scale
+        self.weighted = weighted
+
+    def setUp(self, controls):
+        MonomialBasis.setUp(self,controls)
+        if self.shift is None: self.shift = np.min(controls,axis=0)
+        if self.scale is None: self.scale = np.maximum(np.std(controls,axis=0),1.0e-12)
+
+    def polynomials(self, controls):
+        x = (controls - self.shift) / self.scale
+        L = np.ones(x.shape + (self.maxPolynomialDegree+1,))
+        if self.maxPolynomialDegree>0: L[...,1] = 1.0 - x
+        for e in range(1,self.maxPolynomialDegree):
+            L[...,e+1] = ((2*e+1-x)*L[...,e] - e*L[...,e-1]) / (e+1)
+        if self.weighted:
+            L[...,1:] *= np.exp(-x/2)[...,np.newaxis]
+        return L
+
+
+class PiecewiseLinearBasis:
+    # additive basis 1, x_j and [x_j - b]^+ for break points b per dimension j;
+    # by default break points are nBreakPoints quantiles of the first training chunk
+
+    # Python constructor
+    def __init__(self, nBreakPoints=4, breakPoints=None):
+        self.nBreakPoints = nBreakPoints
+        self.breakPoints  = breakPoints   # np.array [d,nBreakPoints]
+
+    def setUp(self, controls):
+        if self.breakPoints is None:
+            q = np.arange(1,self.nBreakPoints+1) / (self.nBreakPoints+1)
+            self.breakPoints = np.quantile(controls,q,axis=0).T
+
+    def functions(self, controls):
+        x = np.asarray(controls, dtype=float)
+        hinges = np.maximum(x[...,np.newaxis] - self.breakPoints, 0.0)
+        hinges = hinges.reshape(x.shape[:-1] + (-1,))
+        return np.concatenate([ np.ones(x.shape[:-1] + (1,)), x, hinges ], axis=-1)
+
+
+# Solvers accumulate chunks of basis functions A [n,k] and observations
+# y [n] or [n,m] via add(A, y) and return coefficients via solve().
+
+class DenseSolver:
+    # keep the full design matrix and use a least-squares solver
+
+    # Python constructor
+    def __init__(self):
+        self.A = []
+        self.y = []
+
+    def add(self, A, y):
+        self.A.append(A)
+        self.y.append(y)
+
+    def solve(self):
+        # QR with column pivoting is much faster than the SVD-based default for many paths
+        p, res, rnk, s = lstsq(np.concatenate(self.A), np.concatenate(self.y), lapack_driver='gelsy')  # res, rnk, s for debug purposes
+        return p
+
+
+class NormalEquationsSolver:
+    # accumulate A^T A and A^T y over chunks; memory does not depend on the
+    # number of paths. We minimise |A beta - y|^2 / n + ridge |beta[1:]|^2;
+    # note that ridge depends on the scaling of the basis functions
+
+    # Python constructor
+    def __init__(self, ridge=0.0):
+        self.ridge = ridge
+        self.AtA   = None
+        self.Aty   = None
+        self.n     = 0
+
+    def add(self, A, y):
+        if self.AtA is None:
+            self.AtA = np.zeros([A.shape[1],A.shape[1]])
+            self.Aty = np.zeros((A.shape[1],) + np.shape(y)[1:])
+        self.AtA += A.T.dot(A)
+        self.Aty += A.T.dot(y)
+        self.n   += A.shape[0]
+
+    def solve(self):
+        M = self.AtA.copy()
+        M[np.arange(1,M.shape[0]),np.arange(1,M.shape[0])] += self.n * self.ridge
+        # we scale M to unit diagonal, basis functions may differ by orders of magnitude
+        d = 1.0 / np.sqrt(np.maximum(np.diag(M),1.0e-300))
+        M = d[:,np.newaxis] * M * d[np.newaxis,:]
+        b = d.reshape(d.shape + (1,)*(len(self.Aty.shape)-1)) * self.Aty
+        # M is small, a pivoted QR solve also copes with collinear basis functions
+        z = lstsq(M, b, lapack_driver='gelsy')[0]
+        return d.reshape(b.shape[:1] + (1,)*(len(b.shape)-1)) * z
+
+
+class QRUpdateSolver:
+    # keep the triangular factor R of the augmented matrix [A | y] and update it
+    # per chunk via QR of [R; A_chunk | y_chunk]; this avoids squaring the
+    # condition number as in the normal equations
+
+    # Python constructor
+    def __init__(self, ridge=0.0):
+        self.ridge = ridge
+        self.R     = None
+        self.n     = 0
+
+    def add(self, A, y):
+        self.k = A.shape[1]
+        self.vector = (len(np.shape(y))==1)
+        Ay = np.hstack([ A, np.reshape(y,[A.shape[0],-1]) ])
+        if self.R is not None: Ay = np.vstack([ self.R, Ay ])
+        self.R = np.linalg.qr(Ay, mode='r')
+        if self.R.shape[0]<Ay.shape[1]:  # fewer rows than columns so far, pad R with zero rows
+            self.R = np.vstack([ self.R, np.zeros([Ay.shape[1]-self.R.shape[0],Ay.shape[1]]) ])
+        self.n += A.shape[0]
+
+    def solve(self):
+        R  = self.R[:self.k,:self.k]
+        Qy = self.R[:self.k,self.k:]
+        if self.ridge>0:  # add rows sqrt(n ridge) e_i for i > 0
+            penalty = np.sqrt(self.n*self.ridge) * np.identity(self.k)[1:]
+            R = np.linalg.qr(np.vstack([ np.hstack([R,Qy]), np.hstack([penalty,np.zeros([self.k-1,Qy.shape[1]])]) ]), mode='r')
+            [ R, Qy ] = [ R[:self.k,:self.k], R[:self.k,self.k:] ]
+        diag = np.abs(np.diag(R))
+        if np.min(diag) > 1.0e-12 * np.max(diag):
+            beta = solve_triangular(R, Qy)
+        else:  # (nearly) collinear basis functions
+            beta = lstsq(R, Qy, lapack_driver='gelsy')[0]
+        return beta[:,0] if self.vector else beta
+
+
 class Regression:
+    # We fit observations ~ basis(controls) . beta. Basis and solver are
+    # prototypes which are copied per regression. Controls and observations
+    # are processed in chunks of chunkSize paths. For data which does not fit
+    # into memory use Regression(basis=..., solver=...), then addChunk() per
+    # chunk and finally solve().
 
     # Python constructor
-    def __init__(self, controls, observations, maxPolynomialDegree=2):
+    def __init__(self, controls=None, observations=None, maxPolynomialDegree=2, basis=None, solver=None, chunkSize=100000):
         self.maxPolynomialDegree = maxPolynomialDegree
-        self.multiIdxSet = np.array(MultiIndexSet(controls.shape[1],maxPolynomialDegree+1))
-        A = np.array([ self.monomials(c) for c in controls ])
-        p, res, rnk, s = lstsq(A, observations)   # res, rnk, s for debug purposes
-        self.beta = p
+        self.basis  = copy.deepcopy(MonomialBasis(maxPolynomialDegree) if basis==None else basis)
+        if getattr(self.basis,'maxPolynomialDegree',0) is None: self.basis.maxPolynomialDegree = maxPolynomialDegree
+        self.solver = copy.deepcopy(DenseSolver() if solver==None else solver)
+        self.isSetUp = False
+        if controls is not None:
+            for start in range(0,controls.shape[0],chunkSize):
+                self.addChunk(controls[start:start+chunkSize],observations[start:start+chunkSize])
+            self.solve()
+
+    def addChunk(self, controls, observations):
+        if not self.isSetUp:
+            self.basis.setUp(controls)
+            self.isSetUp = True
+        self.solver.add(self.basis.functions(controls),observations)
 
-    def monomials(self, control):
-        x = np.ones(self.multiIdxSet.shape[0])
-        for i in range(self.multiIdxSet.shape[0]):
-            for j in range(self.multiIdxSet.shape[1]):
-                x[i] *= control[j]**self.multiIdxSet[i][j]
-        return x
+    def solve(self):
+        self.beta = self.solver.solve()
+        return self
 
-    def value(self, control):
-        return self.monomials(control).dot(self.beta)
+    # basis functions for a control [d] or controls [n,d], returns [k] or [n,k]
+    def monomials(self, controls):
+        return self.basis.functions(controls)
 
+    # regression value for a control [d] or all controls [n,d]
+    def value(self, controls):
+        return self.basis.functions(controls).dot(self.beta)
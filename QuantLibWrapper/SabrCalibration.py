@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import time
+import multiprocessing
+import numpy as np
+import pandas
+
+from QuantLibWrapper.SabrModel import SabrModel
+
+# calibration shared with forked worker processes
+parallelCalibration = None
+
+def calibrateTenorInWorker(j):
+    return parallelCalibration.calibrateTenor(j)
+
+
+class SabrCalibration:
+    # We fit alpha, rho and nu (fixed beta and shift) per smile of a swaption
+    # cube [nExpiries,nTenors,nStrikes] to market normal volatilities via
+    # Levenberg-Marquardt. Parameters are transformed to
+    #   alpha = exp(p0), rho = tanh(p1), nu = exp(p2)
+    # to avoid constraints. Residuals for all strikes are calculated in one
+    # call of SabrModel.normalVolatility(); the Jacobian is calculated in the
+    # same call via complex-step differentiation (no cancellation, exact to
+    # machine precision). Along a tenor we warm-start from the previous expiry;
+    # tenors may be calibrated in parallel processes.
+
+    # Python constructor
+    def __init__(self, forwards, expiryTimes, strikes, marketVols, beta=0.5, shift=0.0, weights=None):
+        self.marketVols  = np.array(marketVols, dtype=float)   # [nExpiries,nTenors,nStrikes]
+        shape = self.marketVols.shape
+        self.forwards    = np.array(np.broadcast_to(forwards,shape[:2]), dtype=float)
+        self.expiryTimes = np.array(np.broadcast_to(np.reshape(expiryTimes,[-1,1]) if np.ndim(expiryTimes)==1 else expiryTimes,shape[:2]), dtype=float)
+        self.strikes     = np.array(np.broadcast_to(strikes,shape), dtype=float)
+        self.beta        = np.array(np.broadcast_to(beta,shape[:2]), dtype=float)
+        self.shift       = np.array(np.broadcast_to(shift,shape[:2]), dtype=float)
+        weights = np.ones(shape) if weights is None else np.array(np.broadcast_to(weights,shape), dtype=float)
+        self.weights     = np.where(np.isnan(self.marketVols), 0.0, weights)  # missing quotes
+        self.marketVols  = np.where(np.isnan(self.marketVols), 0.0, self.marketVols)
+        # results per smile
+        self.alpha      = np.zeros(shape[:2])
+        self.rho        = np.zeros(shape[:2])
+        self.nu         = np.zeros(shape[:2])
+        self.rmse       = np.zeros(shape[:2])   # weighted root mean squared error of vols
+        self.iterations = np.zeros(shape[:2], dtype=int)
+        self.seconds    = np.zeros(shape[:2])  # fit time per smile
+
+    @staticmethod
+    def parameters(p):
+        return [ np.exp(p[...,0]), np.tanh(p[...,1]), np.exp(p[...,2]) ]
+
+    # weighted residuals [nStrikes] and Jacobian [nStrikes,3] w.r.t. transformed parameters
+    def residualsAndJacobian(self, e, j, p, h=1.0e-20):
+        P = np.vstack([ p, p + 1j*h*np.identity(3) ])   # base point and complex steps
+        [ alpha, rho, nu ] = self.parameters(P)
+        model = SabrModel(self.forwards[e,j],self.expiryTimes[e,j],alpha[:,np.newaxis],self.beta[e,j],
+                          nu[:,np.newaxis],rho[:,np.newaxis],self.shift[e,j])
+        vols = model.normalVolatility(self.strikes[e,j])   # [4,nStrikes]
+        residuals = self.weights[e,j] * (vols[0].real - self.marketVols[e,j])
+        jacobian  = self.weights[e,j][:,np.newaxis] * vols[1:].imag.T / h
+        return [ residuals, jacobian ]
+
+    def initialValues(self, e, j):
+        # alpha from ATM vol (interpolated over quoted strikes), no skew, moderate vol of vol
+        quoted = (self.weights[e,j]>0) & (self.marketVols[e,j]>0)
+        if not np.any(quoted):
+            raise ValueError('SabrCalibration: no quotes for smile ' + str((e,j)))
+        strikes = self.strikes[e,j][quoted]
+        order = np.argsort(strikes)
+        sigmaATM = np.interp(self.forwards[e,j],strikes[order],self.marketVols[e,j][quoted][order])
+        model = SabrModel(self.forwards[e,j],self.expiryTimes[e,j],0.0,self.beta[e,j],0.3,0.0,self.shift[e,j])
+        return np.array([ np.log(sigmaATM / model.localVolC(self.forwards[e,j])), 0.0, np.log(0.3) ])
+
+    def calibrateSmile(self, e, j, p0=None, tolerance=1.0e-10, maxIterations=100):
+        start = time.perf_counter()
+        # a warm start p0 (e.g. the neighbouring smile) is only used if it fits
+        # better than the default initial values; we use the ATM alpha for p0 as well
+        candidates = [ self.initialValues(e,j) ]
+        if p0 is not None:
+            candidates += [ np.array(p0), np.array([ candidates[0][0], p0[1], p0[2] ]) ]
+        costs = [ np.sum(self.residualsAndJacobian(e,j,c)[0]**2) for c in candidates ]
+        if np.all(np.isnan(costs)):
+            raise ValueError('SabrCalibration: no valid initial values for smile ' + str((e,j)))
+        p = candidates[np.nanargmin(costs)]
+        [ r, J ] = self.residualsAndJacobian(e,j,p)
+        cost = r.dot(r)
+        lam = 1.0e-3
+        for iteration in range(maxIterations):
+            A = J.T.dot(J)
+            g = J.T.dot(r)
+            if np.max(np.abs(g)) < tolerance**2: break   # stationary point
+            try:
+                dp = np.linalg.solve(A + lam*np.diag(np.maximum(np.diag(A),1.0e-12)), -g)
+            except np.linalg.LinAlgError:
+                lam *= 10.0
+                continue
+            [ rNew, JNew ] = self.residualsAndJacobian(e,j,p+dp)
+            costNew = rNew.dot(rNew)
+            if np.isfinite(costNew) and costNew < cost:   # accept step
+                p, r, J, cost = p + dp, rNew, JNew, costNew
+                lam = max(lam / 3.0, 1.0e-12)
+                if np.max(np.abs(dp)) < tolerance: break
+            else:
+                lam *= 2.0
+                if lam > 1.0e12: break
+        [ alpha, rho, nu ] = self.parameters(p)
+        rmse = np.sqrt(cost / max(np.sum(self.weights[e,j]>0),1))
+        return [ alpha, rho, nu, iteration+1, rmse, time.perf_counter()-start, p ]
+
+    # calibrate all expiries of tenor j, warm-start from the previous expiry
+    def calibrateTenor(self, j):
+        results = []
+        p = None
+        for e in range(self.marketVols.shape[0]):
+            result = self.calibrateSmile(e,j,p)
+            p = result[-1]
+            results.append(result[:-1])
+        return results
+
+    def calibrate(self, nWorkers=1):
+        global parallelCalibration
+        nTenors = self.marketVols.shape[1]
+        if nWorkers>1 and nTenors>1 and 'fork' in multiprocessing.get_all_start_methods():
+            parallelCalibration = self
+            with multiprocessing.get_context('fork').Pool(min(nWorkers,nTenors)) as pool:
+                results = pool.map(calibrateTenorInWorker,range(nTenors))
+            parallelCalibration = None
+        else:  # serial fall-back
+            results = [ self.calibrateTenor(j) for j in range(nTenors) ]
+        for j in range(nTenors):
+            for e in range(len(results[j])):
+                [ self.alpha[e,j], self.rho[e,j], self.nu[e,j], self.iterations[e,j],
+                  self.rmse[e,j], self.seconds[e,j] ] = results[j][e]
+        return self
+
+    def model(self, e, j):
+        return SabrModel(self.forwards[e,j],self.expiryTimes[e,j],self.alpha[e,j],self.beta[e,j],
+                         self.nu[e,j],self.rho[e,j],self.shift[e,j])
+
+    # model normal volatilities for the whole cube [nExpiries,nTenors,nStrikes]
+    def modelVols(self):
+        model = SabrModel(self.forwards[...,np.newaxis],self.expiryTimes[...,np.newaxis],self.alpha[...,np.newaxis],
+                          self.beta[...,np.newaxis],self.nu[...,np.newaxis],self.rho[...,np.newaxis],self.shift[...,np.newaxis])
+        return model.normalVolatility(self.strikes)
+
+    def report(self):
+        table = pandas.DataFrame( [ [ e, j, self.expiryTimes[e,j], self.alpha[e,j], self.rho[e,j], self.nu[e,j],
+                                      self.rmse[e,j], self.iterations[e,j], self.seconds[e,j] ]
+                                    for e in range(self.alpha.shape[0]) for j in range(self.alpha.shape[1]) ] )
+        table.columns = [ 'Expiry', 'Tenor', 'ExpiryTime', 'alpha', 'rho', 'nu', 'RMSE', 'Iterations', 'Seconds' ]
+        return table
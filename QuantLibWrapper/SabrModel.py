@@ -2,12 +2,12 @@
 
 import numpy as np
 from scipy.optimize import brentq
-from QuantLibWrapper.Helpers import Bachelier, BachelierImpliedVol
+from QuantLibWrapper.Helpers import Bachelier, BachelierImpliedVols
 
 class SabrModel:
 
     # Python constructor
-    def __init__(self, forward, timeToExpiry, alpha, beta, nu, rho, shift=0.0):
+    def __init__(self, forward, timeToExpiry, alpha, beta, nu, rho, shift=0.0, boundary=None):
         self.forward      = forward
         self.timeToExpiry = timeToExpiry
         self.alpha        = alpha
@@ -15,13 +15,16 @@ class SabrModel:
         self.nu           = nu
         self.rho          = rho
         self.shift        = shift
+        self.boundary     = boundary   # None, 'absorb' or 'reflect' at rate -shift for MC simulation
         
-    # helpers
+    # helpers; rate may be a float or an np.array
     def localVolC(self, rate):
-        return np.power(rate+self.shift,self.beta) if rate>-self.shift else 0.0
+        shiftedRate = np.where(rate>-self.shift, rate+self.shift, 1.0)  # avoid invalid powers
+        return np.where(rate>-self.shift, np.power(shiftedRate,self.beta), 0.0)
         
     def localVolCPrime(self, rate):  # for Milstein method
-        return self.beta * np.power(rate+self.shift,self.beta-1) if rate>-self.shift else 0.0
+        shiftedRate = np.where(rate>-self.shift, rate+self.shift, 1.0)
+        return np.where(rate>-self.shift, self.beta * np.power(shiftedRate,self.beta-1), 0.0)
         
     def sAverage(self, strike, forward):
         return (strike + forward) / 2.0
@@ -33,20 +36,26 @@ class SabrModel:
     def chi(self, zeta):
         return np.log((np.sqrt(1-2*self.rho*zeta+zeta*zeta)-self.rho+zeta)/(1-self.rho))
      
-    # approximate implied normal volatility formula 
-    def normalVolatility(self,strike):
-        Sav     = self.sAverage(strike,self.forward)
+    # approximate implied normal volatility formula; strike, forward and
+    # timeToExpiry may be floats or np.arrays which are broadcast against each
+    # other, e.g. strikes [nStrikes] and forwards [nExpiries,nTenors,1]. Model
+    # parameters may be np.arrays of a compatible shape as well. By default we
+    # use the model's forward and time to expiry
+    def normalVolatility(self, strike, forward=None, timeToExpiry=None):
+        forward      = self.forward if forward is None else forward
+        timeToExpiry = self.timeToExpiry if timeToExpiry is None else timeToExpiry
+        Sav     = self.sAverage(strike,forward)
         CSav    = self.localVolC(Sav)
         gamma1  = self.beta / (Sav+self.shift)
         gamma2  = self.beta * (self.beta-1) / (Sav+self.shift) / (Sav+self.shift)
         I1      = (2*gamma2 - gamma1*gamma1) / 24 * self.alpha * self.alpha * CSav * CSav
         I1      = I1 + self.rho * self.nu * self.alpha * gamma1 / 4 * CSav
         I1      = I1 + (2 - 3*self.rho*self.rho) / 24 * self.nu * self.nu
-        sigmaN  = self.alpha * CSav  # default, if close to ATM
-        if np.fabs(strike-self.forward)>1.0e-8:  # actual calculation for I0
-            sigmaN = self.nu * (self.forward - strike) / self.chi(self.zeta(strike,self.forward))
-        sigmaN  = sigmaN * (1 + I1*self.timeToExpiry)  # higher order adjustment
-        return sigmaN
+        atm     = np.fabs(strike-forward)<=1.0e-8  # default alpha C(Sav), if close to ATM
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigmaN = np.where(atm, self.alpha * CSav, self.nu * (forward - strike) / self.chi(self.zeta(strike,forward)))
+        sigmaN  = sigmaN * (1 + I1*timeToExpiry)  # higher order adjustment
+        return sigmaN if np.ndim(sigmaN)>0 else float(sigmaN)
 
     def calibrateATM(self, sigmaATM):
         def objective(alpha):
@@ -57,17 +66,19 @@ class SabrModel:
         return self.alpha
 
 
-    def vanillaPrice(self, strike, callOrPut):
-        sigmaN = self.normalVolatility(strike)
-        return Bachelier(strike,self.forward,sigmaN,self.timeToExpiry,callOrPut)
+    def vanillaPrice(self, strike, callOrPut, forward=None, timeToExpiry=None):
+        forward      = self.forward if forward is None else forward
+        timeToExpiry = self.timeToExpiry if timeToExpiry is None else timeToExpiry
+        sigmaN = self.normalVolatility(strike,forward,timeToExpiry)
+        return Bachelier(strike,forward,sigmaN,timeToExpiry,callOrPut)
 
-    def density(self, rate):
+    def density(self, rate, forward=None, timeToExpiry=None):
+        forward = self.forward if forward is None else forward
         eps = 1.0e-4
-        cop = 1.0
-        if (rate<self.forward):
-            cop = -1.0
-        dens = (self.vanillaPrice(rate-eps,cop) - 2*self.vanillaPrice(rate,cop) + self.vanillaPrice(rate+eps,cop))/eps/eps
-        return dens
+        cop = np.where(rate<forward, -1.0, 1.0)
+        dens = (self.vanillaPrice(rate-eps,cop,forward,timeToExpiry) - 2*self.vanillaPrice(rate,cop,forward,timeToExpiry) +
+                self.vanillaPrice(rate+eps,cop,forward,timeToExpiry))/eps/eps
+        return dens if np.ndim(dens)>0 else float(dens)
 
     # stochastic process interface
     
@@ -79,37 +90,72 @@ class SabrModel:
 
     def initialValues(self):
         return np.array([ self.forward, self.alpha ])
+
+    def vectorized(self):  # evolve also accepts X0[nPaths,size] and dW[nPaths,factors]
+        return True
     
     # evolve X(t0) -> X(t0+dt) using independent Brownian increments dW
-    # t0, dt are assumed float, X0, X1, dW are np.array
+    # t0, dt are assumed float, X0, X1, dW are np.array of shape [size] or
+    # [nPaths,size] and [factors] or [nPaths,factors] respectively
     def evolve(self, t0, X0, dt, dW):
         # first simulate stochastic volatility exact
-        dZ = self.rho * dW[0] + np.sqrt(1-self.rho*self.rho)*dW[1]
-        alpha0 = X0[1]
+        dZ = self.rho * dW[...,0] + np.sqrt(1-self.rho*self.rho)*dW[...,1]
+        alpha0 = X0[...,1]
         alpha1 = alpha0*np.exp(-self.nu*self.nu/2*dt+self.nu*dZ*np.sqrt(dt))
         alpha01 = np.sqrt(alpha0*alpha1)   # average vol [t0, t0+dt]
         # simulate S via Milstein
-        S0 = X0[0]
-        S1 = S0 + alpha01*self.localVolC(S0)*dW[0]*np.sqrt(dt) \
-                + 0.5*alpha01*self.localVolC(S0)*alpha01*self.localVolCPrime(S0)*(dW[0]*dW[0]-1)*dt 
+        S0 = X0[...,0]
+        C  = self.localVolC(S0)
+        CP = self.localVolCPrime(S0)
+        S1 = S0 + alpha01*C*dW[...,0]*np.sqrt(dt) \
+                + 0.5*alpha01*C*alpha01*CP*(dW[...,0]*dW[...,0]-1)*dt 
+        # boundary at -shift, otherwise paths stay where they crossed -shift
+        if self.boundary=='absorb':
+            S1 = np.where(S0>-self.shift, np.maximum(S1,-self.shift), -self.shift)
+        elif self.boundary=='reflect':
+            S1 = np.abs(S1+self.shift) - self.shift
         # gather results
-        return np.array([S1, alpha1])          
-        
-# calculate normal volatility smile from a MC simulation
+        return np.stack([S1, alpha1], axis=-1)
+
+    # simulate X(T) [nPaths,size] on the time grid times without storing paths;
+    # optionally we use antithetic increments and match first and
+    # second moments of the increments per time step
+    def simulateTerminalStates(self, times, nPaths, seed=123, antithetic=True, momentMatching=True):
+        generator = np.random.default_rng(seed)
+        X = np.tile(self.initialValues(), [nPaths,1])
+        for j in range(len(times)-1):
+            # we draw [factors,nPaths] for contiguous per-factor operations
+            dW = generator.standard_normal([self.factors(),(nPaths+1)//2 if antithetic else nPaths])
+            if antithetic:  # for odd nPaths the last mirrored path is dropped
+                dW = np.concatenate([dW, -dW], axis=1)[:,:nPaths]
+            if momentMatching:
+                dW = (dW - np.mean(dW,axis=1,keepdims=True)) / np.std(dW,axis=1,keepdims=True)
+            X = self.evolve(times[j],X,times[j+1]-times[j],dW.T)
+        return X
+
+    # normal volatility smile from simulated rates S(T); we adjust S(T) to match
+    # the forward and evaluate OTM options for all strikes via sorted cumulative sums
+    def impliedNormalVolsFromSamples(self, S, T, strikes, fullOutput=False):
+        strikes = np.array(strikes, dtype=float)
+        S = np.sort(S + self.forward - np.mean(S))
+        n = S.shape[0]
+        sums = np.append([0.0], np.cumsum(S))      # sums[k] = S[0] + ... + S[k-1]
+        idx = np.searchsorted(S,strikes,side='right')  # number of samples <= strike
+        calls = (sums[-1] - sums[idx] - strikes*(n-idx)) / n
+        puts  = (strikes*idx - sums[idx]) / n
+        cops    = np.where(strikes>self.forward, 1.0, -1.0)
+        options = np.where(cops>0, calls, puts)
+        vols = BachelierImpliedVols(options,strikes,self.forward,T,cops)
+        vols = np.where(np.isfinite(vols), vols, 0.0)
+        return vols if not fullOutput else np.array([strikes, options, vols])
+
+    # calculate normal volatility smile from a MC simulation
     def monteCarloImpliedNormalVol(self, mcSimulation, strikes, fullOutput=False):
         if mcSimulation.times[-1]!=self.timeToExpiry: print('WARNING: times do not match.')
-        # forward adjuster
-        Sav = 0.0
-        for j in range(mcSimulation.nPaths): Sav += mcSimulation.X[j][-1][0]
-        Sav /= mcSimulation.nPaths
-        S = np.array([(mcSimulation.X[j][-1][0]+self.forward-Sav) for j in range(mcSimulation.nPaths) ])
-        options = np.zeros(len(strikes))
-        vols    = np.zeros(len(strikes))
-        for i in range(len(strikes)):
-            cop = 1.0 if strikes[i]>self.forward else -1.0
-            for j in range(mcSimulation.nPaths):
-                options[i] += np.max([cop*(S[j]-strikes[i]), 0.0])
-            options[i] /= mcSimulation.nPaths
-            try:     vols[i] = BachelierImpliedVol(options[i],strikes[i],self.forward,mcSimulation.times[-1],cop)
-            except:  vols[i] = 0.0
-        return vols if not fullOutput else np.array(strikes, options, vols)
+        return self.impliedNormalVolsFromSamples(mcSimulation.X[:,-1,0],mcSimulation.times[-1],strikes,fullOutput)
+
+    # MC smile without MCSimulation, e.g. as benchmark for the Hagan approximation
+    def monteCarloSmile(self, strikes, nSteps=100, nPaths=100000, seed=123, antithetic=True, momentMatching=True, fullOutput=False):
+        times = np.linspace(0.0,self.timeToExpiry,nSteps+1)
+        X = self.simulateTerminalStates(times,nPaths,seed,antithetic,momentMatching)
+        return self.impliedNormalVolsFromSamples(X[:,0],self.timeToExpiry,strikes,fullOutput)
@@ -15,10 +15,9 @@ class Swap:
         self.discYieldCurve = discYieldCurve
         self.projYieldCurve = projYieldCurve
         # we need handles of the yield curves...        
-        self.discHandle = ql.RelinkableYieldTermStructureHandle()
-        self.projHandle = ql.RelinkableYieldTermStructureHandle()
-        self.discHandle.linkTo(discYieldCurve.yts)
-        self.projHandle.linkTo(projYieldCurve.yts)  
+        # these follow YieldCurve.update()
+        self.discHandle = discYieldCurve.handle()
+        self.projHandle = projYieldCurve.handle()
         # schedule generation details
         fixedLegTenor = ql.Period('1y')
         floatLegTenor = ql.Period('6m')
@@ -4,12 +4,11 @@ import pandas
 import QuantLib as ql
 
 import numpy as np
-from scipy.optimize import brentq
 
 from QuantLibWrapper.Helpers import Bachelier, BachelierImpliedVol, BachelierVega
 from QuantLibWrapper.Swap import Swap
 from QuantLibWrapper.Payoffs import CouponBond
-from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+from QuantLibWrapper.HullWhiteCalibration import HullWhiteCalibration
 
 class Swaption:
 
@@ -23,6 +22,29 @@ class Swaption:
         volHandle = ql.QuoteHandle(volQuote)
         initialEngine = ql.BachelierSwaptionEngine(self.underlyingSwap.discHandle,volHandle,ql.Actual365Fixed())
         self.swaption.setPricingEngine(initialEngine)
+        # cash flow details are extracted once and cached; we clear the cache if
+        # the curve handles notify (relinking, curve changes) or if the
+        # evaluation date changed (this is not observable from Python)
+        self.detailsCache = {}
+        self.detailsObserver = ql.Observer(self.clearDetailsCache)
+        self.detailsObserver.registerWith(self.underlyingSwap.discHandle)
+        self.detailsObserver.registerWith(self.underlyingSwap.projHandle)
+
+    def clearDetailsCache(self):
+        self.detailsCache.clear()
+
+    # return cached details or calculate and cache them as read-only arrays
+    def cachedDetails(self, key, function):
+        evaluationDate = ql.Settings.instance().evaluationDate.serialNumber()
+        if self.detailsCache.get('evaluationDate')!=evaluationDate:
+            self.detailsCache.clear()
+            self.detailsCache['evaluationDate'] = evaluationDate
+        if key not in self.detailsCache:
+            details = function()
+            for value in details.values():
+                if isinstance(value,np.ndarray): value.setflags(write=False)
+            self.detailsCache[key] = details
+        return dict(self.detailsCache[key])  # callers may add or replace items
 
     def npv(self):
         return self.swaption.NPV()
@@ -47,6 +69,12 @@ class Swaption:
         return self.annuity() * BachelierVega(self.underlyingSwap.fixedRate,self.fairRate(),self.normalVolatility,T) * 1.0e-4  # 1bp scaling
 
     def bondOptionDetails(self):
+        return self.cachedDetails('bondOption',self.calculateBondOptionDetails)
+
+    def swaptionDetails(self):
+        return self.cachedDetails('swaption',self.calculateSwaptionDetails)
+
+    def calculateBondOptionDetails(self):
         # calculate expiryTime, (coupon) startTims, payTimes, cashFlows, strike and
         # c/p flag as inputs to Hull White analytic formula
         details = {}
@@ -78,7 +106,7 @@ class Swaption:
         details['cashFlows'] = np.array(caschflows)
         return details
 
-    def swaptionDetails(self):
+    def calculateSwaptionDetails(self):
         # calculate times and cash flows as input to (cash-settled) swaption valuation
         details = {}
         details['callOrPut']  = 1.0 if self.underlyingSwap.payerOrReceiver==ql.VanillaSwap.Receiver else -1.0
@@ -131,15 +159,7 @@ def createSwaption(expiryTerm, swapTerm, discCurve, projCurve, strike='ATM', pay
 
 
 def HullWhiteModelFromSwaption(swaption, meanReversion=0.01):
-    volatilityTimes  = np.array( [ swaption.bondOptionDetails()['expiryTime'] ] )
-    volatilityValues = np.array( [ swaption.normalVolatility ] )  # initial guess            
-    def objective(sigma):
-        volatilityValues[0] = sigma
-        model = HullWhiteModel(swaption.underlyingSwap.discYieldCurve,meanReversion,volatilityTimes,volatilityValues)
-        return swaption.npvHullWhite(model,'p') - swaption.npv()
-    sigma = brentq(objective,0.01*volatilityValues[0],10.0*volatilityValues[0],xtol=1.0e-8)
-    volatilityValues[0] = sigma
-    return HullWhiteModel(swaption.underlyingSwap.discYieldCurve,meanReversion,volatilityTimes,volatilityValues)
+    return HullWhiteCalibration([ swaption ],meanReversion).calibrate()
 
 class CashSettledSwaptionPayoff:
     # A Swaption is a priori assumed physically settled. However, we also want
@@ -158,16 +178,13 @@ class CashSettledSwaptionPayoff:
         print(self.tau)
 
     def at(self, x):
-        annuity = 0.0
-        for cf in self.details['annuityLeg']:
-            annuity += cf[1] * self.model.zeroBondPayoff(x,self.details['expiryTime'],cf[0]) 
-        floatLeg = 0.0        
-        for cf in self.details['floatLeg']: # unfortunately, this only contains spread coupons
-            floatLeg += cf[1] * self.model.zeroBondPayoff(x,self.details['expiryTime'],cf[0])
+        annuityLeg = self.details['annuityLeg']
+        floatLeg   = self.details['floatLeg']  # unfortunately, this only contains spread coupons
+        annuity  = self.model.zeroBondPayoffs(x,self.details['expiryTime'],annuityLeg[:,0]).dot(annuityLeg[:,1])
+        floatLeg = self.model.zeroBondPayoffs(x,self.details['expiryTime'],floatLeg[:,0]).dot(floatLeg[:,1])
         swapRate = floatLeg / annuity
-        cashAnnuity = 0.0  #
-        for k in range(self.details['annuityLeg'].shape[0]):
-            cashAnnuity += self.tau / np.power(1.0 + self.tau*swapRate, k+1)
+        periods  = np.arange(1,annuityLeg.shape[0]+1)
+        cashAnnuity = np.sum(self.tau / np.power(1.0 + self.tau*np.expand_dims(swapRate,-1), periods), axis=-1)
         return self.details['notional'] * cashAnnuity * self.details['callOrPut'] * \
                (swapRate - self.details['strikeRate'])
 
@@ -185,16 +202,13 @@ class CashPhysicalSwitchPayoff:
         self.tau = round(4.0*self.details['annuityLeg'][-1][1])/4.0
 
     def at(self, x):
-        annuity = 0.0
-        for cf in self.details['annuityLeg']:
-            annuity += cf[1] * self.model.zeroBondPayoff(x,self.details['expiryTime'],cf[0]) 
-        floatLeg = 0.0        
-        for cf in self.details['floatLeg']: # unfortunately, this only contains spread coupons
-            floatLeg += cf[1] * self.model.zeroBondPayoff(x,self.details['expiryTime'],cf[0])
+        annuityLeg = self.details['annuityLeg']
+        floatLeg   = self.details['floatLeg']  # unfortunately, this only contains spread coupons
+        annuity  = self.model.zeroBondPayoffs(x,self.details['expiryTime'],annuityLeg[:,0]).dot(annuityLeg[:,1])
+        floatLeg = self.model.zeroBondPayoffs(x,self.details['expiryTime'],floatLeg[:,0]).dot(floatLeg[:,1])
         swapRate = floatLeg / annuity
-        cashAnnuity = 0.0  #
-        for k in range(self.details['annuityLeg'].shape[0]):
-            cashAnnuity += self.tau / np.power(1.0 + self.tau*swapRate, k+1)
+        periods  = np.arange(1,annuityLeg.shape[0]+1)
+        cashAnnuity = np.sum(self.tau / np.power(1.0 + self.tau*np.expand_dims(swapRate,-1), periods), axis=-1)
         return self.details['notional'] * (annuity-cashAnnuity) * \
                np.abs(swapRate - self.details['strikeRate'])
 
@@ -1,39 +1,93 @@
 #!/usr/bin/python
 
-from scipy.sparse import diags, identity
+from scipy.linalg import lapack
 import numpy as np
 
+# Tridiagonal matrices M = diag[l, c, u] are represented by their diagonals with
+# l = M[i+1,i], c = M[i,i] and u = M[i,i+1]. Vectors x may be matrices [n,m] of
+# m right-hand sides. Diagonals are either arrays [n] (or [n-1]) which are shared
+# by all right-hand sides, or matrices [n,m] (or [n-1,m]) with one matrix per column.
+
+def asColumns(diagonal, x):
+    # broadcast a shared diagonal against matrix-valued x
+    diagonal = np.asarray(diagonal)
+    return diagonal.reshape(diagonal.shape + (1,)*(x.ndim-diagonal.ndim))
+
+
+def tridiagonalProduct(arrayL, arrayC, arrayU, x):
+    # y = M x via a three-term stencil
+    y = asColumns(arrayC,x) * x
+    y[1:]  += asColumns(arrayL,x) * x[:-1]
+    y[:-1] += asColumns(arrayU,x) * x[1:]
+    return y
+
+
+def blockDiagonals(arrayL, arrayC, arrayU):
+    # m matrices [n,m] as one block-diagonal tridiagonal matrix of size n*m, blocks are
+    # the columns; sub- and super-diagonal entries between blocks are zero
+    [n, m] = np.shape(arrayC)
+    L = np.zeros([m,n])
+    U = np.zeros([m,n])
+    L[:,:-1] = np.transpose(arrayL)
+    U[:,:-1] = np.transpose(arrayU)
+    return [ L.ravel()[:-1], np.transpose(arrayC).ravel(), U.ravel()[:-1] ]
+
+
+def factorizeTDS(arrayL, arrayC, arrayU):
+    # LU factors of a tridiagonal matrix M which can be re-used for several solves;
+    # individual matrices per right-hand side (column) are factorized together as
+    # one block-diagonal matrix, this is a single LAPACK call as well
+    if np.ndim(arrayC)==2:
+        [arrayL, arrayC, arrayU] = blockDiagonals(arrayL, arrayC, arrayU)
+    dl, d, du, du2, ipiv, info = lapack.dgttrf(arrayL, arrayC, arrayU)
+    if info!=0: raise ValueError('factorizeTDS: tridiagonal system is singular')
+    return [dl, d, du, du2, ipiv]
+
+
+def solveFactorizedTDS(factors, y):
+    # solve linear system Mx = y for LU factors of M from factorizeTDS()
+    y = np.asarray(y, dtype=float)
+    if factors[1].shape[0]==y.shape[0]:  # one matrix for all right-hand sides
+        x, info = lapack.dgttrs(*factors, y)
+    else:  # block-diagonal matrix, column j of y is block j
+        x, info = lapack.dgttrs(*factors, y.T.ravel())
+        x = x.reshape(y.shape[::-1]).T
+    if info!=0: raise ValueError('solveFactorizedTDS: invalid factors')
+    return x
+
+
+def solveTridiagonal(arrayL, arrayC, arrayU, y):
+    # solve linear systen Mx = y for a tridiagonal matrix M = diag[l, c, u]
+    if np.ndim(arrayC)==1:  # factorize and solve in one LAPACK call
+        _, _, _, x, info = lapack.dgtsv(arrayL, arrayC, arrayU, y)
+        if info!=0: raise ValueError('solveTridiagonal: tridiagonal system is singular')
+        return x
+    return solveFactorizedTDS(factorizeTDS(arrayL,arrayC,arrayU),y)
+
 
 def solveTDS(diagA, y):
-    # solve linear systen Ax = y for a tridiagonal matrix A
-    a = diagA.diagonal(-1)
-    b = diagA.diagonal(0)
-    c = diagA.diagonal(1)
-    # in place LU decomposition; no error handling if LU decomposition does not exist
-    for i in range(1,b.shape[0]):
-        a[i-1] /= b[i-1]
-        b[i] -= c[i-1]*a[i-1]
-    # forward substitution
-    z = np.zeros(b.shape[0])
-    z[0] = y[0]
-    for i in range(1,z.shape[0]):
-        z[i] = y[i] - a[i-1]*z[i-1]
-    # backward substitution, overwrite input y
-    y[-1] = z[-1]/b[-1]
-    for i in range(z.shape[0]-1,0,-1):
-        y[i-1] = (z[i-1] - c[i-1]*y[i])/b[i-1]
+    # solve linear systen Ax = y for a (scipy.sparse) tridiagonal matrix A;
+    # y is overwritten by the solution x
+    y[:] = solveTridiagonal(diagA.diagonal(-1), diagA.diagonal(0), diagA.diagonal(1), y)
     return
 
 
-def thetaStep(arrayL, arrayC, arrayU, arrayRHS, stepSize, theta):
+# LU factors of [I+h*theta*M] for thetaStep(); None for Explicit Euler
+def thetaFactors(arrayL, arrayC, arrayU, stepSize, theta):
+    if theta==0:
+        return None
+    h = stepSize*theta
+    return factorizeTDS(h*arrayL, 1.0 + h*arrayC, h*arrayU)
+
+
+def thetaStep(arrayL, arrayC, arrayU, arrayRHS, stepSize, theta, factors=None):
     # solve v = [I+h*theta*M]^-1 [I-h(1-theta)M] r
-    # where M = diag[l, c, u] and r = RHS
-    M = diags([arrayL, arrayC, arrayU], [-1, 0, 1])
-    # print(M.toarray())
-    I = identity(arrayC.shape[0])
-    b = (I - (stepSize*(1.0-theta))*M).dot(arrayRHS)
+    # where M = diag[l, c, u] and r = RHS; factors of [I+h*theta*M] from
+    # thetaFactors() may be provided if the same operator is used repeatedly
+    b = arrayRHS - (stepSize*(1.0-theta)) * tridiagonalProduct(arrayL,arrayC,arrayU,arrayRHS)
     if theta==0:  # Explicit Euler
         return b
-    A = (I + (stepSize*theta)*M)
-    solveTDS(A,b)
-    return b
+    if factors is not None:
+        return solveFactorizedTDS(factors,b)
+    h = stepSize*theta
+    return solveTridiagonal(h*arrayL, 1.0 + h*arrayC, h*arrayU, b)
@@ -2,26 +2,83 @@
 
 import QuantLib as ql
 
+import numpy as np
+from collections import OrderedDict
+
 import matplotlib.pyplot as plt
 import pandas
 
 class YieldCurve:
 
     # Python constructor
-    def __init__(self, terms, rates):
-        today = ql.Settings.getEvaluationDate(ql.Settings.instance())
+    def __init__(self, terms, rates, cacheSize=10000):
         self.terms = terms
-        self.dates = [ ql.WeekendsOnly().advance(today,ql.Period(term),ql.ModifiedFollowing) for term in [ '0d' ] + terms ]
-        self.rates = [rates[0]] + rates
+        self.cacheSize = cacheSize   # max. number of memoised scalar discount factors and forward rates
+        self.cache     = OrderedDict()
+        self.version   = 0    # incremented by update(), dependent caches compare versions
+        self.yieldTermStructureHandle = ql.RelinkableYieldTermStructureHandle()  # re-linked by update()
+        self.update(rates)
+
+    # the relinkable handle to yts which follows update(), e.g. for Swap; all
+    # users share this one handle
+    def handle(self):
+        return self.yieldTermStructureHandle
+
+    # (re-)build the curve for today's evaluation date and given rates; the handle
+    # from handle() is re-linked, models and methods which cache curve-based
+    # quantities check version (e.g. HullWhiteModel.state())
+    def update(self, rates=None):
+        today = ql.Settings.getEvaluationDate(ql.Settings.instance())
+        self.dates = [ ql.WeekendsOnly().advance(today,ql.Period(term),ql.ModifiedFollowing) for term in [ '0d' ] + self.terms ]
+        if rates is not None:
+            self.rates = [rates[0]] + rates
         # use rates as backward flat interpolated continuous compounded forward rates
         self.yts = ql.ForwardCurve(self.dates,self.rates,ql.Actual365Fixed(),ql.NullCalendar())
+        # we replicate the curve with NumPy for fast evaluation of discount(time) and forwardRate(time)
+        self.times = np.array([ ql.Actual365Fixed().yearFraction(self.dates[0],d) for d in self.dates ])
+        self.rateValues = np.array(self.rates)
+        self.integratedRates = np.append([0.0], np.cumsum(self.rateValues[1:] * np.diff(self.times)))
+        self.yieldTermStructureHandle.linkTo(self.yts)
+        self.version += 1
+        self.clearCache()
+
+    def clearCache(self):
+        self.cache.clear()
+
+    # memoise scalar results; we evict least recently used entries
+    def cached(self, key, function):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        value = function()
+        if self.cacheSize>0:
+            self.cache[key] = value
+            if len(self.cache)>self.cacheSize: self.cache.popitem(last=False)
+        return value
+
+    # \int_0^t f(0,s) ds for piecewise flat (backward) forward rates f(0,s)
+    def integratedForwardRate(self,times):
+        idx = np.clip(np.searchsorted(self.times,times,side='left'),1,self.times.shape[0]-1)
+        return self.integratedRates[idx-1] + self.rateValues[idx] * (times - self.times[idx-1])
 
-    # zero coupon bond
+    # zero coupon bond; dateOrTime is a ql.Date, a float or an np.array of times
     def discount(self,dateOrTime):
-        return self.yts.discount(dateOrTime,True)
+        if isinstance(dateOrTime,ql.Date):
+            return self.yts.discount(dateOrTime,True)
+        if np.ndim(dateOrTime)>0:
+            return np.exp(-self.integratedForwardRate(np.asarray(dateOrTime)))
+        return self.cached(('d',dateOrTime), lambda : np.exp(-self.integratedForwardRate(dateOrTime)))
 
+    # instantaneous forward rate consistent with QuantLib's
+    # yts.forwardRate(time,time,ql.Continuous,...), i.e. a difference quotient with dt=1.0e-4
     def forwardRate(self,time):
-        return self.yts.forwardRate(time,time,ql.Continuous,ql.Annual,True).rate()
+        def rate(time):
+            t1 = np.maximum(time - 0.5e-4, 0.0)
+            t2 = t1 + 1.0e-4
+            return (self.integratedForwardRate(t2) - self.integratedForwardRate(t1)) / 1.0e-4
+        if np.ndim(time)>0:
+            return rate(np.asarray(time))
+        return self.cached(('f',time), lambda : rate(time))
   
     # plot zero rates and forward rate
     def plot(self,stepsize=0.1):
@@ -0,0 +1,99 @@
+
+import time
+import numpy as np
+
+import pandas
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModelWithDiscreteNumeraire
+from QuantLibWrapper.MCSimulation import MCSimulation
+from QuantLibWrapper.BermudanOption import BermudanOption
+from QuantLibWrapper.Regression import Regression
+from QuantLibWrapper.AMCSolver import AMCSolver, AMCSolverOnlyExerciseRegression, AMCSolverCoterminalRateRegression, \
+                                      AMCSolverCoterminalRateOnlyExerciseRegression
+from QuantLibWrapper.Payoffs import SwapRate
+from QuantLibWrapper import Payoffs
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = YieldCurve(terms,rates)
+model = HullWhiteModelWithDiscreteNumeraire(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# Bermudan bond option with annual exercises 12y, ..., 19y into a 20y bond
+
+payTimes  = [ 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 20.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03,  1.0 ]
+expiryTimes = np.array(payTimes[:8])
+underlyings = [ Payoffs.CouponBond(model,payTimes[k],payTimes[k:],[-1.0]+cashFlows[k+1:]) for k in range(8) ]
+
+# the previous roll-back with a loop over paths; controls and regression values
+# are evaluated per path, the regression is fitted on the same training paths
+
+class LoopSolver:
+
+    # Python constructor
+    def __init__(self, solver):
+        self.solver = solver
+
+    def xSet(self, expiryTime):
+        return self.solver.xSet(expiryTime)
+
+    def control(self, T0, x):
+        if isinstance(self.solver,AMCSolverCoterminalRateOnlyExerciseRegression):
+            S = SwapRate(model,T0,T0,self.solver.maturityTime).at(x)
+            return np.array([ S, max(S-self.solver.strikeRate,0.0) ])
+        if isinstance(self.solver,AMCSolverCoterminalRateRegression):
+            return np.array([ SwapRate(model,T0,T0,self.solver.maturityTime).at(x), SwapRate(model,T0,T0,T0+0.5).at(x) ])
+        return np.array([ x[0] ])
+
+    def rollBack(self, T0, T1, x1, U1, H1):
+        x0 = self.xSet(T0)
+        s  = self.solver
+        m  = s.minSampleIdx
+        V0 = np.zeros(U1.shape)
+        N0 = np.array([ model.numeraire(x0[i]) for i in range(x0.shape[0]) ])
+        N1 = np.array([ model.numeraire(x1[i]) for i in range(x1.shape[0]) ])
+        R = None
+        if m>0 and T0>0:
+            C = np.array([ self.control(T0,x0[i]) for i in range(m) ])
+            if s.onlyExercise:
+                O = np.array([ U1[i] - H1[i] for i in range(m) ])
+            else:
+                O = np.array([ N0[i]/N1[i]*max(U1[i],H1[i]) for i in range(m) ])
+            R = Regression(C,O,s.maxPolynomialDegree)
+        for i in range(x1.shape[0]):
+            if s.onlyExercise:
+                I = R.value(self.control(T0,x0[i])) if R!=None else U1[i] - H1[i]
+                V0[i] = N0[i]/N1[i] * (U1[i] if I>0 else H1[i])
+            else:
+                V0[i] = R.value(self.control(T0,x0[i])) if R!=None else N0[i]/N1[i]*max(U1[i],H1[i])
+        if T0==0:
+            sampleIdx = m if m<x1.shape[0] else 0
+            return [ np.array([0.0]), np.array([ np.mean(V0[sampleIdx:]) ]) ]
+        return [x0, V0]
+
+# vectorised roll-back vs the path loop on the same simulation
+
+simulation = MCSimulation(model,np.array([0.0]+[12.0+k for k in range(9)]),4000)
+solvers = [ AMCSolver(simulation,2,0.25),
+            AMCSolverOnlyExerciseRegression(simulation,2,0.25),
+            AMCSolverCoterminalRateRegression(simulation,2,0.25,20.0,0.03),
+            AMCSolverCoterminalRateOnlyExerciseRegression(simulation,2,0.25,20.0,0.03) ]
+results = []
+for solver in solvers:
+    start = time.perf_counter()
+    npv = BermudanOption(expiryTimes,underlyings,solver).npv()
+    vectorSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    loopNpv = BermudanOption(expiryTimes,underlyings,LoopSolver(solver)).npv()
+    loopSeconds = time.perf_counter() - start
+    results.append([ type(solver).__name__, npv, npv-loopNpv, loopSeconds, vectorSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Solver', 'NPV', 'Diff', 'LoopSeconds', 'VectorSeconds' ]
+print(table)
+print('expect round-off differences only; about 1e-10 for the nearly collinear swap and Libor rate controls')
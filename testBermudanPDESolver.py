@@ -0,0 +1,147 @@
+
+import time
+import numpy as np
+
+import pandas
+
+import QuantLib as ql
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel, HullWhiteModelWithDiscreteNumeraire
+from QuantLibWrapper.Swaption import createSwaption
+from QuantLibWrapper.BermudanSwaption import BermudanSwaption
+from QuantLibWrapper.BermudanOption import BermudanOption, BermudanOptionPortfolio
+from QuantLibWrapper.DensityIntegrations import CubicSplineExactIntegration, DensityIntegrationWithBreakEven, SimpsonIntegration
+from QuantLibWrapper.PDESolver import PDESolver, PDESolverToTolerance
+from QuantLibWrapper.Grids import concentratedGrid
+from QuantLibWrapper import Payoffs
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = YieldCurve(terms,rates)
+model = HullWhiteModelWithDiscreteNumeraire(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# Bermudan bond options with annual exercises 12y, ..., 19y into a 20y bond
+
+payTimes  = [ 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 20.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03,  1.0 ]
+def bermudan(strike, exercises):
+    expiryTimes = np.array([ payTimes[k] for k in exercises ])
+    underlyings = [ Payoffs.CouponBond(model,payTimes[k],[payTimes[k]]+payTimes[k+1:],[-strike]+cashFlows[k+1:]) for k in exercises ]
+    return [ expiryTimes, underlyings ]
+
+# concentrated grids
+
+x = concentratedGrid(-0.1,0.1,41,[0.0],0.1)
+print('Grid: monotone %s, end points %s, x=0 on grid %s, min/max step %.4f / %.4f'
+      % (str(np.all(np.diff(x)>0)), str([x[0],x[-1]]), str(np.any(x==0.0)), np.min(np.diff(x)), np.max(np.diff(x))))
+
+# 8 annual exercises with 1/48 time steps vs a 801-point reference; expect
+# 7.5e-6 for 41 points concentrated at x=0 and 1.2e-5 for 101 uniform points
+
+[ expiryTimes, underlyings ] = bermudan(1.0,range(8))
+reference = BermudanOption(expiryTimes,underlyings,PDESolver(model,801,5,0.5,1.0/48.0)).npv()
+grids = [ [ 'uniform 41',      PDESolver(model,41,5,0.5,1.0/48.0) ],
+          [ 'uniform 101',     PDESolver(model,101,5,0.5,1.0/48.0) ],
+          [ 'concentrated 41', PDESolver(model,41,5,0.5,1.0/48.0,concentrationPoints=[0.0]) ] ]
+table = pandas.DataFrame([ [ name, BermudanOption(expiryTimes,underlyings,solver).npv() - reference ] for [ name, solver ] in grids ])
+table.columns = [ 'Grid', 'Error' ]
+print('Reference: %.10f' % reference)
+print(table)
+
+# the discount term uses the step-average forward rate log(P(0,T0)/P(0,T1))/(T1-T0);
+# the forward curve jumps at pillars, with f(t) at the theta point a 12y zero bond
+# had a relative error of -1.1e-4 (Crank-Nicolson) which did not vanish with h
+
+results = []
+for [ theta, timeStepSize ] in [ [ 0.5, 1.0/12.0 ], [ 0.5, 1.0/48.0 ], [ 1.0, 0.25 ] ]:
+    solver = PDESolver(model,101,5,theta,timeStepSize)
+    x = solver.xSet(12.0)
+    [ x, V ] = solver.rollBack(0.0,12.0,x,np.ones(x.shape),np.zeros(x.shape))
+    results.append([ theta, timeStepSize, np.interp(0.0,x,V)/curve.discount(12.0) - 1.0 ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Theta', 'TimeStep', 'ZeroBondError' ]
+print(table)
+print('expect about -1.2e-6, -4.4e-7 and 2.9e-3 (7.9e-3 with f at T0 for implicit Euler)')
+[ expiryTimes, underlyings ] = bermudan(1.0,range(8))
+print('Bermudan 51 points, h=1/4: Crank-Nicolson %.7f (expect 0.0192283), implicit Euler %.7f (expect 0.0190206, 0.0190989 with f at T0)'
+      % (BermudanOption(expiryTimes,underlyings,PDESolver(model,51,5,0.5,0.25)).npv(),
+         BermudanOption(expiryTimes,underlyings,PDESolver(model,51,5,1.0,0.25)).npv()))
+
+# a portfolio of Bermudans in one backward induction reproduces individual pricing;
+# single-trade portfolios exactly, otherwise up to the additional roll-back dates
+
+trades = [ bermudan(1.0,range(8)), bermudan(0.95,[1,3,5]), bermudan(1.05,[0,2,4,6,7]) ]
+methods = [ SimpsonIntegration(model,101,5),
+            CubicSplineExactIntegration(model,101,5),
+            DensityIntegrationWithBreakEven(CubicSplineExactIntegration(model,101,5)),
+            PDESolver(model,101,5,0.5,1.0/12.0) ]
+results = []
+for method in methods:
+    individual = np.array([ BermudanOption(expiryTimes,underlyings,method).npv() for [ expiryTimes, underlyings ] in trades ])
+    portfolio = BermudanOptionPortfolio([ trade[0] for trade in trades ],[ trade[1] for trade in trades ],method).npv()
+    single = np.array([ BermudanOptionPortfolio([ expiryTimes ],[ underlyings ],method).npv() for [ expiryTimes, underlyings ] in trades ]).ravel()
+    results.append([ type(method).__name__, np.max(np.abs(single-individual)), np.max(np.abs(portfolio-individual)) ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Method', 'SingleTradeDiff', 'PortfolioDiff' ]
+print(table)
+
+# benchmark: 20 Bermudans with different strikes, kernels are cached by the runs above.
+# DensityIntegrationWithBreakEven splits the grid at the break-even state of each
+# trade; such trades are still rolled back one by one and the portfolio only saves
+# the overhead per trade (about 3x here, vs 6-7x for the PDE and spline methods)
+
+trades = [ bermudan(strike,range(8)) for strike in np.linspace(0.9,1.1,20) ]
+results = []
+for method in methods:
+    start = time.perf_counter()
+    for [ expiryTimes, underlyings ] in trades:
+        BermudanOption(expiryTimes,underlyings,method).npv()
+    individualSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    BermudanOptionPortfolio([ trade[0] for trade in trades ],[ trade[1] for trade in trades ],method).npv()
+    portfolioSeconds = time.perf_counter() - start
+    results.append([ type(method).__name__, individualSeconds, portfolioSeconds, individualSeconds/portfolioSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Method', 'IndividualSeconds', 'PortfolioSeconds', 'Speedup' ]
+print(table)
+
+# co-terminal 1y-9y Bermudan swaption (notional 1e4) priced to a tolerance;
+# PDESolver(101,5,0.5,1/12) gives 373.85 and density integration 373.98 (201 points)
+
+discCurve = YieldCurve(['30y'],[0.025])
+projCurve = YieldCurve(['30y'],[0.030])
+swaptions = [ createSwaption(str(k)+'y',str(10-k)+'y',discCurve,projCurve,0.03,ql.VanillaSwap.Receiver,0.01) for k in range(1,10) ]
+hwModel = HullWhiteModel(discCurve,0.05,np.arange(1.0,10.0),np.full(9,0.0085))
+bermudanSwaption = BermudanSwaption(swaptions,0.05,model=hwModel,method=PDESolver(hwModel,101,5,0.5,1.0/12.0))
+pdeNpv = bermudanSwaption.npv()
+bermudanSwaption.method = CubicSplineExactIntegration(hwModel,201,5)
+densityNpv = bermudanSwaption.npv()
+bermudanSwaption.method = CubicSplineExactIntegration(hwModel,401,6)
+reference = bermudanSwaption.npv()
+results = []
+for tolerance in [ 1.0, 0.1, 0.01 ]:
+    start = time.perf_counter()
+    npv = bermudanSwaption.npvToTolerance(tolerance)
+    details = bermudanSwaption.toleranceDetails
+    results.append([ tolerance, npv, npv-reference, details['error'], details['converged'], details['levels'],
+                     details['nGridPoints'], details['timeStepSize'], time.perf_counter()-start ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Tolerance', 'NPV', 'Error', 'EstError', 'Converged', 'Levels', 'GridPoints', 'TimeStep', 'Seconds' ]
+print('PDE(101,1/12): %.4f, Density(201): %.4f, Density(401): %.4f' % (pdeNpv,densityNpv,reference))
+print(table)
+
+# not enough refinement levels are reported with the resolution actually priced
+
+solver = PDESolver(hwModel,21,5,0.5,0.25,rannacherSteps=2,smoothPayoff=True)
+def price(method):
+    bermudanSwaption.method = method
+    return bermudanSwaption.npv()
+[ npv, details ] = PDESolverToTolerance(price,solver,0.01,maxLevels=2)
+print('maxLevels=2: npv %.4f, converged %s, grid points %d, time step %.4f'
+      % (npv, str(details['converged']), details['nGridPoints'], details['timeStepSize']))
@@ -0,0 +1,73 @@
+
+import time
+import numpy as np
+
+import pandas
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+from QuantLibWrapper.BermudanOption import BermudanOption
+from QuantLibWrapper.DensityIntegrations import SimpsonIntegration, CubicSplineExactIntegration
+from QuantLibWrapper import Payoffs
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = YieldCurve(terms,rates)
+model = HullWhiteModel(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# Bermudan bond options with annual exercises 2y, ..., 9y into a 10y bond
+
+payTimes  = [ 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 10.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 1.0 ]
+def bermudan(strike, method):
+    underlyings = [ Payoffs.CouponBond(model,payTimes[k],payTimes[k:],[-strike]+cashFlows[k+1:]) for k in range(8) ]
+    return BermudanOption(np.array(payTimes[:8]),underlyings,method)
+
+# repricing with cached kernels vs kernels calculated per roll-back (maxCacheBytes=0)
+
+results = []
+for [ name, Method ] in [ [ 'Simpson', SimpsonIntegration ], [ 'CubicSpline', CubicSplineExactIntegration ] ]:
+    cached   = Method(model,101,5)
+    uncached = Method(model,101,5,maxCacheBytes=0)
+    strikes  = np.linspace(0.9,1.1,10)
+    bermudan(1.0,cached).npv()  # fill the cache
+    start = time.perf_counter()
+    cachedNpvs = np.array([ bermudan(K,cached).npv() for K in strikes ])
+    cachedSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    uncachedNpvs = np.array([ bermudan(K,uncached).npv() for K in strikes ])
+    uncachedSeconds = time.perf_counter() - start
+    results.append([ name, np.max(np.abs(cachedNpvs-uncachedNpvs)), len(cached.kernelCache), len(uncached.kernelCache),
+                     cached.kernelCacheBytes, uncachedSeconds, cachedSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Method', 'MaxDiff', 'CachedKernels', 'UncachedKernels', 'CacheBytes', 'UncachedSeconds', 'CachedSeconds' ]
+print(table)
+print('expect MaxDiff 0, 8 cached kernels and no kernels with maxCacheBytes=0')
+
+# eviction: a Simpson kernel for 101 grid points at T0 and T1 needs 101*101*8 + 101*8 = 82416 bytes;
+# with room for three kernels only the three most recently used roll-backs are kept
+
+method = SimpsonIntegration(model,101,5,maxCacheBytes=3*82416)
+bermudan(1.0,method).npv()
+print('Kernels %d, bytes %d <= %d: %s' % (len(method.kernelCache), method.kernelCacheBytes, method.maxCacheBytes,
+                                          str(method.kernelCacheBytes<=method.maxCacheBytes)))
+print('Cached roll-backs [T0,T1]: ' + str([ [ float(key[1]), float(key[2]) ] for key in method.kernelCache.keys() ]) + ' (expect the last three, [0,2] last)')
+x1 = method.xSet(3.0)
+U1 = np.maximum(np.exp(-x1)-1.0, 0.0)
+method.rollBack(2.0,3.0,x1,U1,U1)   # a cache hit moves [2,3] to the end
+method.rollBack(4.0,5.0,x1,U1,U1)   # a miss evicts the least recently used kernel
+print('After a hit on [2,3] and a miss on [4,5]: ' + str([ [ float(key[1]), float(key[2]) ] for key in method.kernelCache.keys() ]))
+
+# kernels are keyed on the model state; a volatility change must not re-use them
+
+method = CubicSplineExactIntegration(model,101,5)
+npv0 = bermudan(1.0,method).npv()
+model.setVolatility(2,0.011)
+npv1 = bermudan(1.0,method).npv()
+fresh = bermudan(1.0,CubicSplineExactIntegration(model,101,5)).npv()
+print('NPV before %.8f, after volatility change %.8f, fresh method %.8f, diff %.2e' % (npv0,npv1,fresh,npv1-fresh))
@@ -0,0 +1,112 @@
+
+import time
+import numpy as np
+from scipy.stats import norm
+from scipy import integrate
+from scipy.interpolate import CubicSpline
+
+import pandas
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+from QuantLibWrapper.DensityIntegrations import SimpsonIntegration, HermiteIntegration, CubicSplineExactIntegration
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = YieldCurve(terms,rates)
+model = HullWhiteModel(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# the previous point-wise roll-backs, one output grid point x0[i] at a time
+
+def scalarSimpson(method, T0, T1, x1, U1, H1):
+    x0 = method.xSet(T0)
+    V0 = np.zeros(x0.shape[0])
+    sigma = np.sqrt(model.varianceX(T0,T1))
+    V = np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ])
+    for i in range(x0.shape[0]):
+        mu = model.expectationX(T0, x0[i], T1)
+        fx = np.array([ V[k] * norm.pdf((x1[k]-mu)/sigma)/sigma for k in range(x1.shape[0])])
+        V0[i] = model.zeroBond(T0,x0[i],T1) * integrate.simpson(fx, x=x1)
+    return [x0, V0]
+
+def scalarHermite(method, T0, T1, x1, U1, H1):
+    x0 = method.xSet(T0)
+    V0 = np.zeros(x0.shape[0])
+    sigma = np.sqrt(model.varianceX(T0,T1))
+    V = CubicSpline(x1, np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ]))
+    for i in range(x0.shape[0]):
+        mu = model.expectationX(T0, x0[i], T1)
+        I = 0.0
+        for k in range(method.hermX.shape[0]):
+            I += method.hermW[k] * V(np.sqrt(2.0)*sigma*method.hermX[k] + mu)
+        V0[i] = model.zeroBond(T0,x0[i],T1) * I / np.sqrt(np.pi)
+    return [x0, V0]
+
+def scalarCubicSpline(method, T0, T1, x1, U1, H1):
+    x0 = method.xSet(T0)
+    V0 = np.zeros(x0.shape[0])
+    sigma = np.sqrt(model.varianceX(T0,T1))
+    V = CubicSpline(x1, np.array([ max(U1[k],H1[k]) for k in range(U1.shape[0]) ]))
+    for i in range(x0.shape[0]):
+        mu = model.expectationX(T0, x0[i], T1)
+        xBar     = np.array([ (x-mu)/sigma for x in V.x ])
+        Phi      = np.array([ norm.cdf(x) for x in xBar ])
+        PhiPrime = np.array([ norm.pdf(x) for x in xBar ])
+        dF0 = np.diff(Phi)
+        dF1 = np.diff(-1.0*PhiPrime)
+        dF2 = np.diff(Phi - xBar*PhiPrime)
+        dF3 = np.diff(-1.0*(xBar**2 + 2.0)*PhiPrime)
+        I0  = dF0
+        I1  = sigma*dF1 - sigma*xBar[:-1]*I0
+        I2  = (sigma**2)*dF2 - 2*sigma*xBar[:-1]*I1 - (sigma**2)*(xBar[:-1]**2)*I0
+        I3  = (sigma**3)*dF3 - 3*sigma*xBar[:-1]*I2 - 3*(sigma**2)*(xBar[:-1]**2)*I1 - (sigma**3)*(xBar[:-1]**3)*I0
+        I = 0.0
+        for k in range(xBar.shape[0]-1):
+            I += V.c[3][k]*I0[k] + V.c[2][k]*I1[k] + V.c[1][k]*I2[k] + V.c[0][k]*I3[k]
+        V0[i] = model.zeroBond(T0,x0[i],T1) * I
+    return [x0, V0]
+
+# roll back a call on a 5y bond and an exercise value from T1 to T0; vectorised
+# methods (kernels computed afresh, caches are cleared) vs the point-wise loops
+
+methods = [ [ 'Simpson',     SimpsonIntegration(model,101,5),          scalarSimpson ],
+            [ 'Hermite',     HermiteIntegration(model,10,101,5),       scalarHermite ],
+            [ 'CubicSpline', CubicSplineExactIntegration(model,101,5), scalarCubicSpline ] ]
+results = []
+for [ T0, T1 ] in [ [ 1.0, 2.0 ], [ 5.0, 5.5 ], [ 9.0, 12.0 ] ]:
+    x1 = methods[0][1].xSet(T1)
+    U1 = np.maximum(model.zeroBonds(T1,x1,[T1+5.0])[:,0] - model.yieldCurve.discount(T1+5.0)/model.yieldCurve.discount(T1), 0.0)
+    H1 = 0.5 * U1[::-1]
+    for [ name, method, scalarMethod ] in methods:
+        if hasattr(method,'clearKernelCache'): method.clearKernelCache()
+        start = time.perf_counter()
+        [ x0, V0 ] = method.rollBack(T0,T1,x1,U1,H1)
+        vectorSeconds = time.perf_counter() - start
+        start = time.perf_counter()
+        [ x0Scalar, V0Scalar ] = scalarMethod(method,T0,T1,x1,U1,H1)
+        scalarSeconds = time.perf_counter() - start
+        results.append([ name, T0, T1, np.max(np.abs(x0-x0Scalar)), np.max(np.abs(V0-V0Scalar)), np.max(np.abs(V0Scalar)),
+                         scalarSeconds, vectorSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Method', 'T0', 'T1', 'GridDiff', 'MaxDiff', 'MaxV0', 'ScalarSeconds', 'VectorSeconds' ]
+print(table)
+print('expect round-off differences only')
+
+# several trades [len(x1),nTrades] in one roll-back vs one trade at a time
+
+x1 = methods[0][1].xSet(6.0)
+U1 = np.stack([ np.maximum(np.exp(-x1)-K, 0.0) for K in [ 0.95, 1.0, 1.05 ] ], axis=1)
+H1 = np.zeros(U1.shape)
+results = []
+for [ name, method, scalarMethod ] in methods:
+    V0 = method.rollBack(5.0,6.0,x1,U1,H1)[1]
+    single = np.stack([ method.rollBack(5.0,6.0,x1,U1[:,j],H1[:,j])[1] for j in range(U1.shape[1]) ], axis=1)
+    results.append([ name, np.max(np.abs(V0-single)) ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Method', 'TradesDiff' ]
+print(table)
@@ -0,0 +1,74 @@
+
+import time
+import numpy as np
+from scipy.optimize import brentq
+
+import pandas
+
+import QuantLib as ql
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+from QuantLibWrapper.Swaption import createSwaption
+from QuantLibWrapper.HullWhiteCalibration import HullWhiteCalibration
+
+# curves and vols
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+rates2 = [ r+0.005 for r in rates ]
+discCurve = YieldCurve(terms,rates)
+projCurve = YieldCurve(terms,rates2)
+meanReversion = 0.05
+
+# co-terminal swaptions with a vol term structure
+
+maturity  = 20  # in years
+swaptions = []
+for k in range(1,maturity):
+    sigma = 0.0090 + 0.0002*k
+    swaptions.append( createSwaption(str(k)+'y',str(maturity-k)+'y',discCurve,projCurve,0.03,ql.VanillaSwap.Receiver,sigma) )
+
+# Newton calibration
+
+start = time.perf_counter()
+calibration = HullWhiteCalibration(swaptions,meanReversion)
+model = calibration.calibrate()
+seconds = time.perf_counter() - start
+
+# reference: brentq bootstrap with full swaption pricing per objective call
+
+start = time.perf_counter()
+refModel = HullWhiteModel(discCurve,meanReversion,model.volatilityTimes,model.volatilityValues)
+for k in range(len(swaptions)):
+    def objective(sigma):
+        refModel.setVolatility(k,sigma)
+        return swaptions[k].npvHullWhite(refModel) - swaptions[k].npv()
+    refModel.setVolatility(k,brentq(objective,1.0e-4,1.0e-1,xtol=1.0e-12))
+refSeconds = time.perf_counter() - start
+
+table = pandas.DataFrame([ model.volatilityTimes,
+                           model.volatilityValues,
+                           refModel.volatilityValues,
+                           calibration.targetPrices,
+                           [ swaption.npvHullWhite(model) for swaption in swaptions ],
+                           calibration.iterations,
+                           calibration.converged
+                         ]).T
+table.columns = [ 'Times', 'Vols', 'RefVols', 'SwptNPV', 'HWNPV', 'Iterations', 'Converged' ]
+print(table)
+print('Newton: %.3fs, brentq: %.3fs' % (seconds,refSeconds))
+print('max |Vols - RefVols|: %.2e (expect < 1e-8)' % np.max(np.abs(model.volatilityValues-refModel.volatilityValues)))
+print('max |HWNPV/SwptNPV - 1|: %.2e (expect < 1e-6)' % np.max(np.abs(table['HWNPV']/table['SwptNPV']-1.0)))
+
+# recalibration to shifted prices starts from the calibrated vols
+
+calibration.calibrate(1.01*calibration.targetPrices)
+print('Recalibration iterations: ' + str(calibration.iterations) + ' (expect about 3)')
+print('max |HWNPV/SwptNPV - 1.01|: %.2e (expect < 1e-6)' % np.max(np.abs(np.array([ swaption.npvHullWhite(model) for swaption in swaptions ])
+                                                         / table['SwptNPV'] - 1.01)))
+
+# an iteration limit is reported, not hidden
+
+calibration.calibrate(calibration.targetPrices/1.01,maxIterations=1)
+print('Converged with maxIterations=1: ' + str(calibration.converged))
@@ -0,0 +1,69 @@
+
+import time
+import numpy as np
+from scipy import integrate
+
+import pandas
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+
+pandas.set_option('display.width', 200)
+
+# model with a volatility term structure
+
+curve = YieldCurve(['30y'],[0.03])
+model = HullWhiteModel(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# the previous implementations of y(t) and sigma(t) scan the volatility times per call
+
+def scalarIndex(t):
+    idxSet = np.where(model.volatilityTimes<t)[0]
+    return -1 if (idxSet.shape[0]==0) else idxSet[-1]
+
+def scalarY(t):
+    idx = scalarIndex(t)
+    t0 = 0.0 if idx<0 else model.volatilityTimes[idx]
+    y0 = 0.0 if idx<0 else model.y_[idx]
+    s1 = model.volatilityValues[min(idx+1,len(model.volatilityValues)-1)]
+    return (model.GPrime(t0,t)**2) * y0 + s1**2 * (1.0 - np.exp(-2*model.meanReversion*(t-t0))) / (2.0 * model.meanReversion)
+
+def scalarSigma(t):
+    idx = scalarIndex(t)
+    return model.volatilityValues[min(idx+1,len(model.volatilityValues)-1)]
+
+# bucket look-ups for scalar and array times vs the previous scan; times
+# include the volatility times themselves and extrapolation beyond 10y
+
+times = np.concatenate([ np.linspace(0.0,15.0,1501), model.volatilityTimes ])
+start = time.perf_counter()
+yScalar     = np.array([ scalarY(t) for t in times ])
+sigmaScalar = np.array([ scalarSigma(t) for t in times ])
+scalarSeconds = time.perf_counter() - start
+start = time.perf_counter()
+yLookup     = np.array([ model.y(t) for t in times ])
+sigmaLookup = np.array([ model.sigma(t) for t in times ])
+lookupSeconds = time.perf_counter() - start
+start = time.perf_counter()
+yArray     = model.y(times)
+sigmaArray = model.sigma(times)
+arraySeconds = time.perf_counter() - start
+table = pandas.DataFrame([ [ 'y',     np.max(np.abs(yLookup-yScalar)),         np.max(np.abs(yArray-yScalar)) ],
+                           [ 'sigma', np.max(np.abs(sigmaLookup-sigmaScalar)), np.max(np.abs(sigmaArray-sigmaScalar)) ] ])
+table.columns = [ 'Function', 'ScalarLookupDiff', 'ArrayDiff' ]
+print(table)
+print('scan: %.4fs, look-up per time: %.4fs, array: %.4fs' % (scalarSeconds,lookupSeconds,arraySeconds))
+
+# exact drift integral \int_t^T G'(u,T)y(u)du vs adaptive quadrature and the
+# previous three-point Simpson rule; the Simpson error grows with T-t
+
+results = []
+for [ t, T ] in [ [ 0.0, 0.5 ], [ 0.5, 1.5 ], [ 0.0, 5.0 ], [ 3.0, 12.0 ], [ 0.0, 20.0 ] ]:
+    f = lambda u : model.GPrime(u,T)*model.y(u)
+    quad = integrate.quad(f,t,T,points=[ s for s in model.volatilityTimes if t<s and s<T ],epsabs=1.0e-14,epsrel=1.0e-12)[0]
+    simpson = (T-t) / 6 * (f(t) + 4*f((t+T)/2) + f(T))
+    exact = model.riskNeutralExpectationX(t,0.0,T)
+    results.append([ t, T, exact, exact-quad, simpson-quad ])
+table = pandas.DataFrame(results)
+table.columns = [ 't', 'T', 'Integral', 'ExactError', 'SimpsonError' ]
+print(table)
@@ -0,0 +1,68 @@
+
+import time
+import numpy as np
+from scipy.optimize import brentq
+
+import pandas
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModel
+
+pandas.set_option('display.width', 200)
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = YieldCurve(terms,rates)
+model = HullWhiteModel(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# zero bond matrix [n,m] vs scalar zeroBond(t,x,T) per state and maturity
+
+results = []
+for t in [ 0.0, 1.0, 5.0, 12.0 ]:
+    x = np.linspace(-0.1,0.1,201)
+    T = t + np.array([ 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0 ])
+    start = time.perf_counter()
+    scalar = np.array([ [ model.zeroBond(t,xi,Tj) for Tj in T ] for xi in x ])
+    scalarSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    matrix = model.zeroBonds(t,x,T)
+    matrixSeconds = time.perf_counter() - start
+    payoffs = model.zeroBondPayoffs(np.stack([ x, np.zeros(x.shape) ],axis=-1),t,T)
+    results.append([ t, np.max(np.abs(matrix/scalar-1.0)), np.max(np.abs(payoffs-matrix)), scalarSeconds, matrixSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 't', 'MatrixRelDiff', 'PayoffsDiff', 'ScalarSeconds', 'MatrixSeconds' ]
+print(table)
+
+# coupon bond options vs the previous implementation with zeroBond() per cash flow
+
+def scalarCouponBondOption(expiryTime, payTimes, cashFlows, strikePrice, callOrPut):
+    def objective(x):
+        bond = 0
+        for i in range(len(payTimes)):
+            bond += cashFlows[i] * model.zeroBond(expiryTime,x,payTimes[i])
+        return bond - strikePrice
+    xStar = brentq(objective,-1.0, 1.0, xtol=1.0e-8)
+    bondOption = 0.0
+    for i in range(len(payTimes)):
+        strike = model.zeroBond(expiryTime,xStar,payTimes[i])
+        bondOption += cashFlows[i] * model.zeroBondOption(expiryTime,payTimes[i],strike,callOrPut)
+    return bondOption
+
+results = []
+for expiryTime in [ 1.0, 5.0, 10.0 ]:
+    payTimes  = [ expiryTime ] + [ expiryTime+k for k in range(1,11) ] + [ expiryTime+10.0 ]
+    cashFlows = [ -1.0 ] + [ 0.04 for k in range(1,11) ] + [ 1.0 ]
+    for callOrPut in [ 1.0, -1.0 ]:
+        start = time.perf_counter()
+        scalar = scalarCouponBondOption(expiryTime,payTimes,cashFlows,0.0,callOrPut)
+        scalarSeconds = time.perf_counter() - start
+        start = time.perf_counter()
+        vector = model.couponBondOption(expiryTime,payTimes,cashFlows,0.0,callOrPut)
+        vectorSeconds = time.perf_counter() - start
+        results.append([ expiryTime, callOrPut, vector, vector-scalar, scalarSeconds, vectorSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Expiry', 'CallOrPut', 'BondOption', 'Diff', 'ScalarSeconds', 'VectorSeconds' ]
+print(table)
+print('expect round-off differences only')
@@ -0,0 +1,67 @@
+
+import time
+import numpy as np
+from scipy.optimize import brentq
+
+import pandas
+
+from QuantLibWrapper.Helpers import Black, Bachelier, BlackImpliedVol, BachelierImpliedVol, BlackImpliedVols, BachelierImpliedVols
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# the previous scalar inversion via brentq on fixed brackets; we use the old
+# brackets and quotes with vols inside these brackets
+
+def brentqBlackVol(price, strike, forward, T, callOrPut):
+    return brentq(lambda sigma : Black(strike, forward, sigma, T, callOrPut) - price, 0.01, 1.00, xtol=1.0e-14)
+
+def brentqBachelierVol(price, strike, forward, T, callOrPut):
+    return brentq(lambda sigma : Bachelier(strike, forward, sigma, T, callOrPut) - price, 1e-4, 1e-1, xtol=1.0e-14)
+
+# random quotes: forwards around 3%, strikes +/- 3 std devs, calls and puts
+
+np.random.seed(42)
+n = 2000
+forward   = 0.03 + 0.01*np.random.standard_normal(n)
+T         = np.random.uniform(0.1,30.0,n)
+callOrPut = np.where(np.random.uniform(0.0,1.0,n)<0.5, 1.0, -1.0)
+normalVol = np.random.uniform(0.002,0.015,n)
+blackVol  = np.random.uniform(0.05,0.80,n)
+forward   = np.maximum(forward,0.005)  # Black needs positive forwards
+normalStrike = forward + np.random.uniform(-3.0,3.0,n)*normalVol*np.sqrt(T)
+blackStrike  = forward * np.exp(np.random.uniform(-3.0,3.0,n)*blackVol*np.sqrt(T))
+
+results = []
+for [ name, vols, strikes, pricer, batchSolver, scalarSolver, brentqSolver ] in \
+    [ [ 'Bachelier', normalVol, normalStrike, Bachelier, BachelierImpliedVols, BachelierImpliedVol, brentqBachelierVol ],
+      [ 'Black',     blackVol,  blackStrike,  Black,     BlackImpliedVols,     BlackImpliedVol,     brentqBlackVol ] ]:
+    # vectorised pricing vs pricing per quote
+    prices = pricer(strikes,forward,vols,T,callOrPut)
+    scalarPrices = np.array([ pricer(strikes[i],forward[i],vols[i],T[i],callOrPut[i]) for i in range(n) ])
+    # batch inversion vs brentq per quote
+    start = time.perf_counter()
+    batch = batchSolver(prices,strikes,forward,T,callOrPut)
+    batchSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    reference = np.array([ brentqSolver(prices[i],strikes[i],forward[i],T[i],callOrPut[i]) for i in range(n) ])
+    brentqSeconds = time.perf_counter() - start
+    scalar = np.array([ scalarSolver(prices[i],strikes[i],forward[i],T[i],callOrPut[i]) for i in range(0,n,20) ])
+    results.append([ name, np.max(np.abs(prices-scalarPrices)), np.max(np.abs(batch/vols-1.0)), np.max(np.abs(batch/reference-1.0)),
+                     np.max(np.abs(scalar-batch[::20])), brentqSeconds, batchSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Model', 'PriceDiff', 'RelErrorVsInput', 'RelDiffVsBrentq', 'ScalarDiff', 'BrentqSeconds', 'BatchSeconds' ]
+print(table)
+print('expect relative differences of 1e-10 or below')
+
+# quotes without implied vol give nan in batch mode and raise in scalar mode;
+# zero out-of-the-money prices give zero vol
+
+prices = np.array([ 0.0, 0.001, 0.01-1.0e-6, 0.2 ])   # zero, valid, below intrinsic, above the forward
+strikes = np.array([ 0.04, 0.03, 0.02, 0.03 ])
+print('Black vols:     ' + str(BlackImpliedVols(prices,strikes,0.03,1.0,1.0)) + ' (expect 0, a vol, nan, nan)')
+print('Bachelier vols: ' + str(BachelierImpliedVols(prices[:3],strikes[:3],0.03,1.0,1.0)) + ' (expect 0, a vol, nan)')
+try:
+    BlackImpliedVol(0.2,0.03,0.03,1.0,1.0)
+except ValueError as e:
+    print(str(e))
@@ -0,0 +1,56 @@
+
+import numpy as np
+
+import pandas
+
+import QuantLibWrapper.YieldCurve as yc
+
+from QuantLibWrapper.HullWhiteModel import HullWhiteModelWithDiscreteNumeraire
+from QuantLibWrapper.MCSimulation import MCSimulation, RandomisedQMCIncrements
+from QuantLibWrapper import Payoffs
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = yc.YieldCurve(terms,rates)
+model = HullWhiteModelWithDiscreteNumeraire(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# a 12y into 8y coupon bond option
+
+payTimes  = [ 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 20.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03,  1.0 ]
+option = Payoffs.Pay(Payoffs.VanillaOption(Payoffs.CouponBond(model,12.0,payTimes,cashFlows),0.0,1.0),12.0)
+analytic = model.couponBondOption(12.0,payTimes,cashFlows,0.0,1.0)
+
+# RMSE vs analytic price over 10 seeds with 4096 paths; expect about
+# 6.3e-4 pseudo random, 8.6e-5 Sobol and 1.3e-4 RQMC (error bar 1.7e-4)
+
+times  = np.array([ 0.0+k for k in range(13) ] + [ 13.0+k for k in range(8) ])
+nPaths = 4096
+results = []
+for increments in [ 'pseudo', 'antithetic', 'sobol', 'rqmc' ]:
+    errors, stdErrors = [], []
+    for seed in range(10):
+        sim = MCSimulation(model,times,nPaths,seed,increments)
+        errors.append(sim.npv(option) - analytic)
+        stdErrors.append(sim.stdError(option))
+    results.append([ increments, np.sqrt(np.mean(np.square(errors))), np.mean(stdErrors) ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Increments', 'RMSE', 'StdError' ]
+print(table)
+
+# increments are standard normal for all generators
+
+for increments in [ 'antithetic', 'sobol', 'rqmc' ]:
+    dW = MCSimulation(model,times,nPaths,123,increments).dW
+    print('%-10s mean %9.2e, std %.6f, shape %s' % (increments, np.mean(dW), np.std(dW), str(dW.shape)))
+
+# antithetic paths with odd nPaths and RQMC blocks which do not divide nPaths
+
+sim = MCSimulation(model,times,1001,123,'antithetic')
+print('Antithetic paths: %d, mirrored: %s' % (sim.dW.shape[0], str(np.all(sim.dW[501:]==-sim.dW[:500]))))
+try:
+    RandomisedQMCIncrements(nScrambles=16).standardNormals(1000,times,1)
+except ValueError as e:
+    print(str(e))
@@ -0,0 +1,47 @@
+
+import time
+import numpy as np
+
+import pandas
+
+import QuantLibWrapper.YieldCurve as yc
+
+from QuantLibWrapper.HullWhiteModel import HullWhiteModelWithDiscreteNumeraire
+from QuantLibWrapper.MCSimulation import MCSimulationParallel
+from QuantLibWrapper import Payoffs
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = yc.YieldCurve(terms,rates)
+model = HullWhiteModelWithDiscreteNumeraire(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# a 12y into 8y coupon bond option
+
+payTimes  = [ 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 20.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03,  1.0 ]
+option = Payoffs.Pay(Payoffs.VanillaOption(Payoffs.CouponBond(model,12.0,payTimes,cashFlows),0.0,1.0),12.0)
+analytic = model.couponBondOption(12.0,payTimes,cashFlows,0.0,1.0)
+
+# results only depend on seed and chunkSize, not on the number of workers
+
+times  = np.array([ k*0.25 for k in range(49) ] + [ 13.0+k for k in range(8) ])
+nPaths = 40000
+results = []
+for nWorkers in [ 1, 2, 4 ]:
+    start = time.perf_counter()
+    sim = MCSimulationParallel(model,times,nPaths,[option],[0.0,12.0],chunkSize=2500,nWorkers=nWorkers)
+    results.append([ nWorkers, time.perf_counter()-start, sim.npv(option), sim.stdError(option), np.sum(sim.X) ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Workers', 'Seconds', 'NPV', 'StdErr', 'SumX' ]
+print(table)
+print('Analytic: %.8f' % analytic)
+print('Identical for all workers: ' + str(np.all(table['NPV']==table['NPV'][0]) and np.all(table['SumX']==table['SumX'][0])))
+print('Analytic within 3 std errors: ' + str(abs(table['NPV'][0]-analytic)<3*table['StdErr'][0]))
+
+# a payoff which is not registered is evaluated on the retained states
+
+european = Payoffs.Pay(Payoffs.VanillaOption(Payoffs.CouponBond(model,12.0,payTimes,cashFlows),0.0,1.0),12.0)
+print('Registered vs retained states npv: %.2e' % (sim.npv(european)-sim.npv(option)))
+print('Registered vs retained states std error: %.2e' % (sim.stdError(european)-sim.stdError(option)))
@@ -0,0 +1,50 @@
+
+import numpy as np
+
+import pandas
+
+import QuantLibWrapper.YieldCurve as yc
+
+from QuantLibWrapper.HullWhiteModel import HullWhiteModelWithDiscreteNumeraire
+from QuantLibWrapper.MCSimulation import MCSimulation, MCSimulationStreaming
+from QuantLibWrapper import Payoffs
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = yc.YieldCurve(terms,rates)
+model = HullWhiteModelWithDiscreteNumeraire(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# a 12y into 8y coupon bond option and a 13y into 7y option
+
+payTimes  = [ 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 20.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03, 0.03,  1.0 ]
+option1 = Payoffs.Pay(Payoffs.VanillaOption(Payoffs.CouponBond(model,12.0,payTimes,cashFlows),0.0,1.0),12.0)
+option2 = Payoffs.Pay(Payoffs.VanillaOption(Payoffs.CouponBond(model,13.0,payTimes[1:],[-1.0]+cashFlows[2:]),0.0,1.0),13.0)
+analytic = [ model.couponBondOption(12.0,payTimes,cashFlows,0.0,1.0),
+             model.couponBondOption(13.0,payTimes[1:],[-1.0]+cashFlows[2:],0.0,1.0) ]
+
+# full simulation vs streaming in chunks; both draw from the same random numbers,
+# option1 is evaluated on the fly, option2 from retained states
+
+times  = np.array([ 0.0, 2.0, 6.0 ] + [ 12.0+k for k in range(9) ])
+nPaths = 10001
+full   = MCSimulation(model,times,nPaths)
+stream = MCSimulationStreaming(model,times,nPaths,[option1],[0.0,12.0,13.0],chunkSize=997)
+
+table = pandas.DataFrame([ [ 'option1', analytic[0], full.npv(option1), stream.npv(option1), full.stdError(option1), stream.stdError(option1) ],
+                           [ 'option2', analytic[1], full.npv(option2), stream.npv(option2), full.stdError(option2), stream.stdError(option2) ] ])
+table.columns = [ 'Payoff', 'Analytic', 'FullNPV', 'StreamNPV', 'FullStdErr', 'StreamStdErr' ]
+print(table)
+print('max |StreamNPV - FullNPV|: %.2e (expect round-off only)' % np.max(np.abs(table['StreamNPV']-table['FullNPV'])))
+print('max |retained states - full states|: %.2e' % np.max(np.abs(stream.X-full.X[:,stream.retainIdx,:])))
+print('Analytic within 3 std errors: ' + str(np.all(np.abs(table['StreamNPV']-table['Analytic'])<3*table['StreamStdErr'])))
+print('Retained / full states memory: %d / %d bytes' % (stream.X.nbytes, full.X.nbytes))
+
+# chunks are independent, thus antithetic and QMC increments are rejected
+
+try:
+    MCSimulationStreaming(model,times,nPaths,[option1],increments='sobol')
+except ValueError as e:
+    print(str(e))
@@ -0,0 +1,103 @@
+
+import time
+import numpy as np
+
+import pandas
+
+import QuantLib as ql
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.HullWhiteModel import HullWhiteModelWithDiscreteNumeraire
+from QuantLibWrapper.MCSimulation import MCSimulation
+from QuantLibWrapper.Swaption import createSwaption, CashSettledSwaptionPayoff, CashPhysicalSwitchPayoff
+from QuantLibWrapper import Payoffs
+
+pandas.set_option('display.width', 200)
+
+# yield curve and model
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+curve = YieldCurve(terms,rates)
+model = HullWhiteModelWithDiscreteNumeraire(curve,0.05,np.array([1.0,2.0,5.0,10.0]),np.array([0.010,0.012,0.009,0.011]))
+
+# payoffs observed at 5y
+
+payTimes  = [ 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 10.0 ]
+cashFlows = [ -1.0, 0.03, 0.03, 0.03, 0.03, 0.03, 1.0 ]
+bond      = Payoffs.CouponBond(model,5.0,payTimes,cashFlows)
+swapRate  = Payoffs.SwapRate(model,5.0,5.0,15.0)
+swaption  = createSwaption('5y','10y',curve,curve,0.035,ql.VanillaSwap.Payer,0.01)
+payoffs   = [ [ 'CouponBond',    bond ],
+              [ 'SwapRate',      swapRate ],
+              [ 'VanillaOption', Payoffs.VanillaOption(bond,0.0,1.0) ],
+              [ 'Max',           Payoffs.Max(Payoffs.VanillaOption(swapRate,0.035,1.0),Payoffs.VanillaOption(swapRate,0.04,-1.0)) ],
+              [ 'CashSettled',   CashSettledSwaptionPayoff(swaption,model) ],
+              [ 'CashPhysical',  CashPhysicalSwitchPayoff(swaption,model) ] ]
+
+# the previous scalar implementations for a single state x, one zero bond at a time
+
+def scalarCouponBond(x, payoff):
+    return sum([ payoff.cashFlows[i]*model.zeroBond(payoff.observationTime,x[0],payoff.payTimes[i]) for i in range(len(payoff.payTimes)) ])
+
+def scalarSwapRate(x, payoff):
+    bonds = [ model.zeroBond(payoff.observationTime,x[0],T) for T in payoff.annuityTimes ]
+    return np.dot(bonds,payoff.floatLegWeights) / np.dot(bonds,payoff.annuityWeights)
+
+def scalarSwaptionRates(x, payoff):
+    annuity = 0.0
+    for cf in payoff.details['annuityLeg']:
+        annuity += cf[1] * model.zeroBond(payoff.details['expiryTime'],x[0],cf[0])
+    floatLeg = 0.0
+    for cf in payoff.details['floatLeg']:
+        floatLeg += cf[1] * model.zeroBond(payoff.details['expiryTime'],x[0],cf[0])
+    swapRate = floatLeg / annuity
+    cashAnnuity = 0.0
+    for k in range(payoff.details['annuityLeg'].shape[0]):
+        cashAnnuity += payoff.tau / np.power(1.0 + payoff.tau*swapRate, k+1)
+    return [ annuity, swapRate, cashAnnuity ]
+
+def scalarCashSettled(x, payoff):
+    [ annuity, swapRate, cashAnnuity ] = scalarSwaptionRates(x,payoff)
+    return payoff.details['notional'] * cashAnnuity * payoff.details['callOrPut'] * (swapRate - payoff.details['strikeRate'])
+
+def scalarCashPhysical(x, payoff):
+    [ annuity, swapRate, cashAnnuity ] = scalarSwaptionRates(x,payoff)
+    return payoff.details['notional'] * (annuity-cashAnnuity) * np.abs(swapRate - payoff.details['strikeRate'])
+
+scalarPayoffs = [ lambda x : scalarCouponBond(x,bond),
+                  lambda x : scalarSwapRate(x,swapRate),
+                  lambda x : max(scalarCouponBond(x,bond),0.0),
+                  lambda x : max(max(scalarSwapRate(x,swapRate)-0.035,0.0),max(0.04-scalarSwapRate(x,swapRate),0.0)),
+                  lambda x : scalarCashSettled(x,payoffs[4][1]),
+                  lambda x : scalarCashPhysical(x,payoffs[5][1]) ]
+
+# at() on an array of states vs the scalar implementations per state
+
+X = np.array([ [ x, 0.0 ] for x in np.linspace(-0.1,0.1,1001) ])
+results = []
+for k in range(len(payoffs)):
+    start = time.perf_counter()
+    scalar = np.array([ scalarPayoffs[k](x) for x in X ])
+    scalarSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    vector = payoffs[k][1].at(X)
+    vectorSeconds = time.perf_counter() - start
+    single = np.array([ payoffs[k][1].at(x) for x in X[::100] ])
+    results.append([ payoffs[k][0], np.max(np.abs(vector-scalar)), np.max(np.abs(single-scalar[::100])), scalarSeconds, vectorSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Payoff', 'ArrayDiff', 'SingleStateDiff', 'ScalarSeconds', 'ArraySeconds' ]
+print(table)
+print('expect round-off differences only')
+
+# discounted payoffs of a simulation vs the previous loop over paths
+
+times = np.array([ 0.0, 1.0, 2.0, 5.0, 10.0 ])
+sim = MCSimulation(model,times,10000)
+payoff = Payoffs.Pay(Payoffs.VanillaOption(bond,0.0,1.0),10.0)
+V0 = sim.discountedPayoffs(payoff,sim.X,sim.times)
+obsIdx = np.where(sim.times==payoff.observationTime)[0][0]
+payIdx = np.where(sim.times==payoff.payTime)[0][0]
+scalar = np.array([ model.numeraire(sim.X[i][0]) * max(scalarCouponBond(sim.X[i][obsIdx],bond),0.0) / model.numeraire(sim.X[i][payIdx])
+                    for i in range(sim.X.shape[0]) ])
+print('discountedPayoffs: max |array - loop| %.2e, NPV %.8f vs %.8f' % (np.max(np.abs(V0-scalar)), np.mean(V0), np.mean(scalar)))
@@ -0,0 +1,48 @@
+
+import time
+import numpy as np
+from scipy.linalg import lstsq
+
+import pandas
+
+from QuantLibWrapper.Regression import Regression, MultiIndexSet
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# the previous implementation: monomials per control via a double loop over
+# multi-indices and dimensions, and the SVD-based lstsq default
+
+def scalarMonomials(multiIdxSet, control):
+    x = np.ones(multiIdxSet.shape[0])
+    for i in range(multiIdxSet.shape[0]):
+        for j in range(multiIdxSet.shape[1]):
+            x[i] *= control[j]**multiIdxSet[i][j]
+    return x
+
+# noisy observations of a smooth function of d controls
+
+np.random.seed(42)
+results = []
+for [ d, degree, nPaths ] in [ [ 1, 2, 10000 ], [ 1, 4, 10000 ], [ 2, 2, 10000 ], [ 2, 3, 10000 ], [ 3, 2, 10000 ] ]:
+    controls = np.random.standard_normal([nPaths,d]) * 0.02
+    observations = np.exp(-np.sum(controls,axis=1)) + 0.01*np.random.standard_normal(nPaths)
+    multiIdxSet = np.array(MultiIndexSet(d,degree+1))
+    # design matrix
+    start = time.perf_counter()
+    A = np.array([ scalarMonomials(multiIdxSet,c) for c in controls ])
+    scalarSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    R = Regression(controls,observations,degree)
+    regressionSeconds = time.perf_counter() - start
+    # coefficients and values; the design matrix is ill-conditioned for small
+    # controls, thus we compare fitted values rather than coefficients
+    beta = lstsq(A,observations)[0]
+    values = A.dot(beta)
+    perPath = np.array([ R.value(c) for c in controls[:100] ])
+    results.append([ d, degree, np.max(np.abs(R.monomials(controls)-A)), np.max(np.abs(R.value(controls)-values)),
+                     np.max(np.abs(perPath-R.value(controls[:100]))), scalarSeconds, regressionSeconds ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Dim', 'Degree', 'BasisDiff', 'FitDiff', 'PerPathDiff', 'LoopBasisSeconds', 'RegressionSeconds' ]
+print(table)
+print('expect round-off differences only; FitDiff compares gelsy with the SVD-based fit')
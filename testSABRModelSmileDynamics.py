@@ -15,28 +15,18 @@ print(model1.calibrateATM(0.01), model2.calibrateATM(0.01), model3.calibrateATM(
 # Strikes
 strikes = [ (i+1)/1000 for i in range(100) ]
 # implied volatility
-vols1 = [model1.normalVolatility(strike) for strike in strikes]
-vols2 = [model2.normalVolatility(strike) for strike in strikes]
-vols3 = [model3.normalVolatility(strike) for strike in strikes]
+vols1 = model1.normalVolatility(np.array(strikes))
+vols2 = model2.normalVolatility(np.array(strikes))
+vols3 = model3.normalVolatility(np.array(strikes))
 
-# smile dynamics
+# smile dynamics; we evaluate all forwards (rows) and strikes (columns) at once
 S_ = [ 0.020, 0.035, 0.050, 0.065, 0.080 ]
-vols1_ = []
-vols2_ = []
-vols3_ = []
-backBone1_ = []
-backBone2_ = []
-backBone3_ = []
-for S in S_:
-    model1.forward = S
-    model2.forward = S
-    model3.forward = S
-    vols1_.append([model1.normalVolatility(strike) for strike in strikes])
-    vols2_.append([model2.normalVolatility(strike) for strike in strikes])
-    vols3_.append([model3.normalVolatility(strike) for strike in strikes])
-    backBone1_.append(model1.normalVolatility(S))
-    backBone2_.append(model2.normalVolatility(S))
-    backBone3_.append(model3.normalVolatility(S))
+vols1_ = model1.normalVolatility(np.array(strikes)[np.newaxis,:],np.array(S_)[:,np.newaxis])
+vols2_ = model2.normalVolatility(np.array(strikes)[np.newaxis,:],np.array(S_)[:,np.newaxis])
+vols3_ = model3.normalVolatility(np.array(strikes)[np.newaxis,:],np.array(S_)[:,np.newaxis])
+backBone1_ = model1.normalVolatility(np.array(S_),np.array(S_))
+backBone2_ = model2.normalVolatility(np.array(S_),np.array(S_))
+backBone3_ = model3.normalVolatility(np.array(S_),np.array(S_))
 
 plt.figure()
 plt.plot(strikes,vols1, 'b-', label='beta=0.1,nu=0.5,rho=0.3')
@@ -0,0 +1,54 @@
+
+import time
+import numpy as np
+
+import pandas
+
+from QuantLibWrapper.SabrModel import SabrModel
+from QuantLibWrapper.SabrCalibration import SabrCalibration
+
+# a synthetic swaption cube [nExpiries,nTenors,nStrikes] from known SABR parameters
+
+expiryTimes = np.array([ 0.5, 1.0, 2.0, 3.0, 5.0, 7.0, 10.0, 15.0, 20.0, 30.0 ])
+tenors      = np.array([ 1.0, 2.0, 3.0, 4.0, 5.0, 7.0, 10.0, 12.0, 15.0, 20.0, 25.0, 30.0 ])
+[ E, J ] = np.meshgrid(expiryTimes, tenors, indexing='ij')
+forwards = 0.02 + 0.0005*E + 0.0004*J
+alpha    = 0.0015 + 0.0010*np.exp(-0.1*E)
+rho      = -0.2 - 0.3*np.exp(-0.2*J)
+nu       = 0.25 + 0.30*np.exp(-0.15*E)
+beta, shift = 0.5, 0.01
+strikes  = forwards[...,np.newaxis] + 1.0e-4*np.array([ -200.0, -100.0, -50.0, -25.0, 0.0, 25.0, 50.0, 100.0, 200.0 ])
+model = SabrModel(forwards[...,np.newaxis],E[...,np.newaxis],alpha[...,np.newaxis],beta,nu[...,np.newaxis],rho[...,np.newaxis],shift)
+marketVols = model.normalVolatility(strikes)
+
+# calibrate the full cube; parameters should be recovered to about 1e-14
+
+start = time.perf_counter()
+calibration = SabrCalibration(forwards,expiryTimes,strikes,marketVols,beta,shift).calibrate()
+seconds = time.perf_counter() - start
+print(calibration.report())
+print('Cube %dx%d calibrated in %.2fs, %.1f iterations per smile' % (E.shape[0],E.shape[1],seconds,np.mean(calibration.iterations)))
+print('max |alpha error|: %.2e' % np.max(np.abs(calibration.alpha-alpha)))
+print('max |rho error|:   %.2e' % np.max(np.abs(calibration.rho-rho)))
+print('max |nu error|:    %.2e' % np.max(np.abs(calibration.nu-nu)))
+print('max |vol error|:   %.2e' % np.max(np.abs(calibration.modelVols()-marketVols)))
+
+# parallel calibration of tenors gives the same results
+
+parallel = SabrCalibration(forwards,expiryTimes,strikes,marketVols,beta,shift).calibrate(nWorkers=4)
+print('Parallel vs serial alpha, rho, nu: %.2e' % np.max(np.abs(np.array([ parallel.alpha-calibration.alpha,
+                                                                          parallel.rho-calibration.rho,
+                                                                          parallel.nu-calibration.nu ]))))
+
+# missing quotes (including ATM) are skipped; a smile without quotes is an error
+
+quotes = marketVols.copy()
+quotes[0,0,[0,4,8]] = np.nan
+quotes[1,0,:]       = np.nan
+calibration = SabrCalibration(forwards,expiryTimes,strikes,quotes,beta,shift)
+[ a, r, n ] = calibration.calibrateSmile(0,0)[:3]
+print('Missing ATM quote, errors alpha, rho, nu: %.2e, %.2e, %.2e' % (a-alpha[0,0], r-rho[0,0], n-nu[0,0]))
+try:
+    calibration.calibrateSmile(1,0)
+except ValueError as e:
+    print('Smile without quotes: ' + str(e))
@@ -0,0 +1,82 @@
+
+import time
+import numpy as np
+
+import pandas
+
+from QuantLibWrapper.SabrModel import SabrModel
+from QuantLibWrapper.Helpers import Bachelier
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# the previous scalar implementation for a single strike on a model with float parameters
+
+def scalarNormalVolatility(model, strike):
+    Sav     = model.sAverage(strike,model.forward)
+    CSav    = model.localVolC(Sav)
+    gamma1  = model.beta / (Sav+model.shift)
+    gamma2  = model.beta * (model.beta-1) / (Sav+model.shift) / (Sav+model.shift)
+    I1      = (2*gamma2 - gamma1*gamma1) / 24 * model.alpha * model.alpha * CSav * CSav
+    I1      = I1 + model.rho * model.nu * model.alpha * gamma1 / 4 * CSav
+    I1      = I1 + (2 - 3*model.rho*model.rho) / 24 * model.nu * model.nu
+    sigmaN  = model.alpha * CSav
+    if np.fabs(strike-model.forward)>1.0e-8:
+        sigmaN = model.nu * (model.forward - strike) / model.chi(model.zeta(strike,model.forward))
+    return sigmaN * (1 + I1*model.timeToExpiry)
+
+def scalarVanillaPrice(model, strike, callOrPut):
+    return Bachelier(strike,model.forward,scalarNormalVolatility(model,strike),model.timeToExpiry,callOrPut)
+
+def scalarDensity(model, rate):
+    eps = 1.0e-4
+    cop = -1.0 if rate<model.forward else 1.0
+    return (scalarVanillaPrice(model,rate-eps,cop) - 2*scalarVanillaPrice(model,rate,cop) + scalarVanillaPrice(model,rate+eps,cop))/eps/eps
+
+# an expiry x tenor x strike cube with parameters per smile; strikes include the ATM point
+
+expiryTimes = np.array([ 1.0, 2.0, 5.0, 10.0, 20.0, 30.0 ])
+tenors      = np.array([ 1.0, 2.0, 5.0, 10.0, 15.0, 20.0, 25.0, 30.0 ])
+[ E, J ] = np.meshgrid(expiryTimes, tenors, indexing='ij')
+forwards = 0.02 + 0.0005*E + 0.0004*J
+alpha    = 0.0015 + 0.0010*np.exp(-0.1*E)
+rho      = -0.2 - 0.3*np.exp(-0.2*J)
+nu       = 0.25 + 0.30*np.exp(-0.15*E)
+beta, shift = 0.5, 0.01
+strikes  = forwards[...,np.newaxis] + 1.0e-4*np.linspace(-200.0,200.0,41)
+cube = SabrModel(forwards[...,np.newaxis],E[...,np.newaxis],alpha[...,np.newaxis],beta,nu[...,np.newaxis],rho[...,np.newaxis],shift)
+
+start = time.perf_counter()
+vols   = cube.normalVolatility(strikes)
+prices = cube.vanillaPrice(strikes,1.0)
+dens   = cube.density(strikes)
+arraySeconds = time.perf_counter() - start
+
+start = time.perf_counter()
+scalarVols   = np.zeros(strikes.shape)
+scalarPrices = np.zeros(strikes.shape)
+scalarDens   = np.zeros(strikes.shape)
+for i in range(E.shape[0]):
+    for j in range(E.shape[1]):
+        model = SabrModel(forwards[i,j],E[i,j],alpha[i,j],beta,nu[i,j],rho[i,j],shift)
+        for k in range(strikes.shape[2]):
+            scalarVols[i,j,k]   = scalarNormalVolatility(model,strikes[i,j,k])
+            scalarPrices[i,j,k] = scalarVanillaPrice(model,strikes[i,j,k],1.0)
+            scalarDens[i,j,k]   = scalarDensity(model,strikes[i,j,k])
+scalarSeconds = time.perf_counter() - start
+
+table = pandas.DataFrame([ [ 'normalVolatility', np.max(np.abs(vols-scalarVols)),     np.max(np.abs(scalarVols)) ],
+                           [ 'vanillaPrice',     np.max(np.abs(prices-scalarPrices)), np.max(np.abs(scalarPrices)) ],
+                           [ 'density',          np.max(np.abs(dens-scalarDens)),     np.max(np.abs(scalarDens)) ] ])
+table.columns = [ 'Function', 'MaxDiff', 'MaxValue' ]
+print(table)
+print('%dx%dx%d cube: scalar loop %.3fs, arrays %.4fs' % (strikes.shape + (scalarSeconds,arraySeconds)))
+
+# forward and timeToExpiry arguments vs models with these values
+
+model = SabrModel(0.03,5.0,0.002,beta,0.4,-0.3,shift)
+S_ = np.array([ 0.02, 0.03, 0.05 ])
+K_ = np.linspace(0.0,0.06,13)
+vols = model.normalVolatility(K_[np.newaxis,:],S_[:,np.newaxis],2.0)
+scalarVols = np.array([ [ scalarNormalVolatility(SabrModel(S,2.0,0.002,beta,0.4,-0.3,shift),K) for K in K_ ] for S in S_ ])
+print('forward and expiry arguments: max diff %.2e, scalar call returns %s' % (np.max(np.abs(vols-scalarVols)), type(model.normalVolatility(0.03)).__name__))
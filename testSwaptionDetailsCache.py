@@ -0,0 +1,80 @@
+
+import time
+import numpy as np
+
+import pandas
+
+import QuantLib as ql
+
+from QuantLibWrapper.YieldCurve import YieldCurve
+from QuantLibWrapper.Swaption import createSwaption
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# curves and co-terminal swaptions
+
+terms = [    '1y',    '2y',    '3y',    '4y',    '5y',    '6y',    '7y',    '8y',    '9y',   '10y',   '12y',   '15y',   '20y',   '25y',   '30y', '50y'   ]
+rates = [ 2.70e-2, 2.75e-2, 2.80e-2, 3.00e-2, 3.36e-2, 3.68e-2, 3.97e-2, 4.24e-2, 4.50e-2, 4.75e-2, 4.75e-2, 4.70e-2, 4.50e-2, 4.30e-2, 4.30e-2, 4.30e-2 ]
+discCurve = YieldCurve(terms,rates)
+projCurve = YieldCurve(terms,[ r+0.005 for r in rates ])
+swaptions = [ createSwaption(str(k)+'y',str(20-k)+'y',discCurve,projCurve,0.03,ql.VanillaSwap.Receiver,0.01) for k in range(1,20) ]
+
+# maximum difference of cached details and details calculated from the QuantLib legs
+
+def detailsDiff():
+    diff = 0.0
+    for swaption in swaptions:
+        for [ cached, fresh ] in [ [ swaption.bondOptionDetails(), swaption.calculateBondOptionDetails() ],
+                                  [ swaption.swaptionDetails(),    swaption.calculateSwaptionDetails() ] ]:
+            for key in fresh.keys():
+                diff = max(diff, np.max(np.abs(np.asarray(cached[key])-np.asarray(fresh[key]))))
+    return diff
+
+# repeated access: cached details vs extraction per call
+
+start = time.perf_counter()
+for swaption in swaptions:
+    for k in range(10):
+        swaption.calculateBondOptionDetails()
+        swaption.calculateSwaptionDetails()
+freshSeconds = time.perf_counter() - start
+start = time.perf_counter()
+for swaption in swaptions:
+    for k in range(10):
+        swaption.bondOptionDetails()
+        swaption.swaptionDetails()
+cachedSeconds = time.perf_counter() - start
+print('Cached vs fresh details: max diff %.2e; 10 accesses per swaption: fresh %.3fs, cached %.3fs' % (detailsDiff(),freshSeconds,cachedSeconds))
+
+# cached arrays are read-only, the returned dict is a copy
+
+details = swaptions[0].bondOptionDetails()
+try:
+    details['cashFlows'][0] = 0.0
+except ValueError as e:
+    print('Write to cached array: ' + str(e))
+details['cashFlows'] = None
+print('Replacing a dict item does not change the cache: ' + str(swaptions[0].bondOptionDetails()['cashFlows'] is not None))
+
+# curve updates notify the observer via the relinked handles; float leg spreads
+# and cash flows change with the curves and the cache must follow
+
+before = swaptions[5].bondOptionDetails()['cashFlows'].copy()
+discCurve.update([ r+0.01 for r in rates ])
+projCurve.update([ r+0.02 for r in rates ])
+entries = len([ key for key in swaptions[5].detailsCache.keys() if key!='evaluationDate' ])
+after = swaptions[5].bondOptionDetails()['cashFlows']
+print('After curve update: cache entries %d (expect 0), max change in cash flows %.2e, max diff to fresh details %.2e'
+      % (entries, np.max(np.abs(after-before)), detailsDiff()))
+
+# a new evaluation date is not observable, it is checked on access
+
+swaptions[0].bondOptionDetails()
+today = ql.Settings.instance().evaluationDate
+ql.Settings.instance().evaluationDate = today + 1
+cachedDate = swaptions[0].detailsCache['evaluationDate']
+swaptions[0].bondOptionDetails()
+print('Evaluation date in cache before / after access: %d / %d (today+1 is %d)'
+      % (cachedDate, swaptions[0].detailsCache['evaluationDate'], (today+1).serialNumber()))
+ql.Settings.instance().evaluationDate = today
@@ -0,0 +1,100 @@
+
+import time
+import numpy as np
+from scipy.sparse import diags, identity
+
+import pandas
+
+from QuantLibWrapper.ThetaMethod import solveTDS, solveTridiagonal, factorizeTDS, solveFactorizedTDS, thetaFactors, thetaStep
+
+pandas.set_option('display.width', 200)
+pandas.set_option('display.max_columns', 20)
+
+# the previous implementation: Thomas algorithm per right-hand side and theta
+# step via scipy.sparse matrices
+
+def thomasSolve(l, c, u, y):
+    l = np.array(l, dtype=float)
+    c = np.array(c, dtype=float)
+    for i in range(1,c.shape[0]):
+        l[i-1] /= c[i-1]
+        c[i] -= u[i-1]*l[i-1]
+    z = np.zeros(c.shape[0])
+    z[0] = y[0]
+    for i in range(1,z.shape[0]):
+        z[i] = y[i] - l[i-1]*z[i-1]
+    x = np.zeros(c.shape[0])
+    x[-1] = z[-1]/c[-1]
+    for i in range(z.shape[0]-1,0,-1):
+        x[i-1] = (z[i-1] - u[i-1]*x[i])/c[i-1]
+    return x
+
+def sparseThetaStep(l, c, u, r, stepSize, theta):
+    M = diags([l, c, u], [-1, 0, 1])
+    I = identity(c.shape[0])
+    b = (I - (stepSize*(1.0-theta))*M).dot(r)
+    if theta==0:
+        return b
+    return thomasSolve(stepSize*theta*l, 1.0 + stepSize*theta*c, stepSize*theta*u, b)
+
+# diagonally dominant PDE-like operators: n grid points and m trades
+
+np.random.seed(42)
+n = 101
+m = 20
+l = -1.0 - np.random.uniform(0.0,0.5,[n-1,m])
+u = -1.0 - np.random.uniform(0.0,0.5,[n-1,m])
+c =  2.5 + np.random.uniform(0.0,0.5,[n,m])
+y = np.random.standard_normal([n,m])
+
+# shared diagonals for all columns vs Thomas per column and a dense solve
+
+x = solveTridiagonal(l[:,0],c[:,0],u[:,0],y)
+dense = np.linalg.solve(np.diag(c[:,0]) + np.diag(l[:,0],-1) + np.diag(u[:,0],1), y)
+thomas = np.stack([ thomasSolve(l[:,0],c[:,0],u[:,0],y[:,j]) for j in range(m) ], axis=1)
+print('Shared diagonals: max |x - Thomas| %.2e, max |x - dense| %.2e' % (np.max(np.abs(x-thomas)), np.max(np.abs(x-dense))))
+
+# one tridiagonal matrix per column, solved as one block-diagonal system vs Thomas per column
+
+start = time.perf_counter()
+x = solveTridiagonal(l,c,u,y)
+batchedSeconds = time.perf_counter() - start
+start = time.perf_counter()
+thomas = np.stack([ thomasSolve(l[:,j],c[:,j],u[:,j],y[:,j]) for j in range(m) ], axis=1)
+thomasSeconds = time.perf_counter() - start
+start = time.perf_counter()
+columns = np.stack([ solveTridiagonal(l[:,j],c[:,j],u[:,j],y[:,j]) for j in range(m) ], axis=1)
+columnSeconds = time.perf_counter() - start
+print('Matrix per column: max |x - Thomas| %.2e, max |x - LAPACK per column| %.2e' % (np.max(np.abs(x-thomas)), np.max(np.abs(x-columns))))
+print('Thomas loop %.4fs, LAPACK per column %.4fs, batched %.4fs' % (thomasSeconds,columnSeconds,batchedSeconds))
+
+# re-used factors give the same solution for new right-hand sides
+
+factors = factorizeTDS(l,c,u)
+z = np.random.standard_normal([n,m])
+print('Re-used factors: max |x - solve| %.2e' % np.max(np.abs(solveFactorizedTDS(factors,z)-solveTridiagonal(l,c,u,z))))
+
+# the previous solveTDS(diagA, y) interface overwrites y with the solution
+
+A = diags([l[:,0], c[:,0], u[:,0]], [-1, 0, 1]).tocsr()
+v = y[:,0].copy()
+solveTDS(A,v)
+print('solveTDS: max |y - Thomas| %.2e' % np.max(np.abs(v-thomasSolve(l[:,0],c[:,0],u[:,0],y[:,0]))))
+
+# theta steps with shared and per-column operators, with and without factors,
+# vs the previous sparse matrix implementation per column
+
+results = []
+for theta in [ 0.0, 0.5, 1.0 ]:
+    h = 0.1
+    reference = np.stack([ sparseThetaStep(l[:,j],c[:,j],u[:,j],y[:,j],h,theta) for j in range(m) ], axis=1)
+    shared    = np.stack([ sparseThetaStep(l[:,0],c[:,0],u[:,0],y[:,j],h,theta) for j in range(m) ], axis=1)
+    factors   = thetaFactors(l,c,u,h,theta)
+    results.append([ theta,
+                     np.max(np.abs(thetaStep(l[:,0],c[:,0],u[:,0],y,h,theta)-shared)),
+                     np.max(np.abs(thetaStep(l,c,u,y,h,theta)-reference)),
+                     np.max(np.abs(thetaStep(l,c,u,y,h,theta,factors)-reference)) ])
+table = pandas.DataFrame(results)
+table.columns = [ 'Theta', 'SharedDiff', 'PerColumnDiff', 'FactorsDiff' ]
+print(table)
+print('expect round-off differences only')